@@ -0,0 +1,175 @@
+# Rendering benchmark of the bed view. It compares the old full redraw (delete every oval and create it again) with the
+# incremental rendering of GuiGridVisualization on large grids, for a few wells changing state every frame:
+#   full        - delete and create all items every frame
+#   incremental - draw_grid scanning all slots, updating only the changed ones
+#   notified    - refresh_grids, updating only slots reported by the BedController change log
+#
+# Run with:
+#   python -m pipettify.benchmarks.benchmark_rendering [--tk] [--frames N] [--changes N]
+#
+# Without --tk (or without a display) a counting canvas is used, which measures the Python side of the rendering and
+# the number of canvas calls per frame. With --tk a real Tk canvas is used, which also includes the Tk cost.
+
+import argparse
+import itertools
+import time
+from collections import Counter
+
+from pipettify.controllers.controller_bed import BedController
+from pipettify.gui.gui_grid_visualization import GuiGridVisualization
+
+PLATES = {
+    "96": (8, 12),
+    "384": (16, 24),
+    "1536": (32, 48),
+}
+
+
+class CountingCanvas:
+    """
+    Stand-in for tk.Canvas that only counts the calls made on it.
+    """
+    def __init__(self):
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            if name.startswith("create_"):
+                return next(self._ids)
+            return None
+        return call
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+class _StubPrinter:
+    curr_x = 0.0
+    curr_y = 0.0
+
+    def estimated_position(self):
+        return self.curr_x, self.curr_y, 0.0
+
+
+def make_bed(rows, columns):
+    """
+    Make a bed with a plate of the given size and a 96 tip rack.
+    """
+    bed_controller = BedController()
+    bed_controller.make_new_grid(probes_rows=rows,
+                                 probes_columns=columns,
+                                 probes_top_left=(20.0, 20.0),
+                                 probes_top_right=(20.0 + 4.5 * (columns - 1), 20.0),
+                                 probes_bottom_left=(20.0, 20.0 + 4.5 * (rows - 1)),
+                                 probes_bottom_right=(20.0 + 4.5 * (columns - 1), 20.0 + 4.5 * (rows - 1)),
+                                 tips_rows=12,
+                                 tips_columns=8,
+                                 tips_top_left=(200.0, 190.0),
+                                 tips_top_right=(263.0, 190.0),
+                                 tips_bottom_left=(200.0, 289.0),
+                                 tips_bottom_right=(263.0, 289.0),
+                                 refilling_tank=(40.0, 250.0),
+                                 disposal_tank=(120.0, 250.0),
+                                 probes_number=rows * columns,
+                                 tips_number=96,
+                                 safe_z=50.0,
+                                 change_tip_z=40.0,
+                                 refilling_z=40.0,
+                                 dispensing_z=40.0,
+                                 drop_tip_z=40.0)
+    return bed_controller
+
+
+def full_redraw(visualization, grid, outline_color, tag, taken_key):
+    """
+    Reference implementation of the old draw_grid: delete all items of the tag and create them again.
+    """
+    canvas = visualization.bed_canvas
+    canvas.delete(tag)
+    max_width = visualization.canvas_size - 2 * visualization.margin
+    max_height = visualization.canvas_size - 2 * visualization.margin
+    scale = min(max_width / visualization.bed_width, max_height / visualization.bed_height)
+    x0 = (visualization.canvas_size - max_width) / 2
+    y0 = (visualization.canvas_size - max_height) / 2
+    radius = 8 * scale / 2
+    for slot in grid.values():
+        probe_x = x0 + slot["coordinates"][0] * scale
+        probe_y = y0 + slot["coordinates"][1] * scale
+        canvas.create_oval(probe_x - radius, visualization.invert_y(probe_y + radius),
+                           probe_x + radius, visualization.invert_y(probe_y - radius),
+                           outline=outline_color, fill="red" if slot[taken_key] else "white", width=2, tag=tag)
+
+
+def run_scenario(canvas_factory, rows, columns, frames, changes, mode):
+    """
+    Render `frames` frames of the probes and tips grids, flipping `changes` probes every frame.
+
+    :return: Tuple (milliseconds per frame, canvas calls per frame or None for a real canvas).
+    """
+    canvas = canvas_factory()
+    bed_controller = make_bed(rows, columns)
+    visualization = GuiGridVisualization(canvas, bed_controller, _StubPrinter())
+    visualization.bed_width = 300
+    visualization.bed_height = 300
+    positions = list(bed_controller.probes)
+
+    def draw_frame():
+        if mode == "notified":
+            visualization.refresh_grids()
+        for grid, outline_color, tag, taken_key in ((bed_controller.probes, "black", "probes", "filled"),
+                                                    (bed_controller.tips, "red", "tips", "taken")):
+            if mode == "incremental":
+                visualization.draw_grid(grid, 0, 0, outline_color, tag, taken_key)
+            elif mode == "full":
+                full_redraw(visualization, grid, outline_color, tag, taken_key)
+        if not isinstance(canvas, CountingCanvas):
+            canvas.update_idletasks()  # Make Tk process the changes, otherwise only the Python side is measured
+
+    draw_frame()  # First frame creates all items in both modes
+    calls_before = canvas.total_calls() if isinstance(canvas, CountingCanvas) else None
+
+    start = time.perf_counter()
+    for frame in range(frames):
+        for change in range(changes):
+            row, col = positions[(frame * changes + change) % len(positions)]
+            bed_controller.update_probe_state(row, col, not bed_controller.get_probe_state(row, col))
+        draw_frame()
+    elapsed = time.perf_counter() - start
+
+    calls = None
+    if calls_before is not None:
+        calls = (canvas.total_calls() - calls_before) / frames
+    return elapsed / frames * 1000, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bed view rendering on large grids.")
+    parser.add_argument("--tk", action="store_true", help="Render on a real Tk canvas (needs a display).")
+    parser.add_argument("--frames", type=int, default=100, help="Number of frames per scenario.")
+    parser.add_argument("--changes", type=int, default=1, help="Number of probes changing state per frame.")
+    args = parser.parse_args()
+
+    canvas_factory = CountingCanvas
+    if args.tk:
+        import tkinter as tk
+        root = tk.Tk()
+
+        def tk_canvas():
+            canvas = tk.Canvas(root, width=400, height=400)
+            canvas.pack()
+            return canvas
+
+        canvas_factory = tk_canvas
+
+    print(f"{'plate':>6} {'mode':>12} {'ms/frame':>10} {'calls/frame':>12}")
+    for plate, (rows, columns) in PLATES.items():
+        for mode in ("full", "incremental", "notified"):
+            ms_per_frame, calls = run_scenario(canvas_factory, rows, columns, args.frames, args.changes, mode)
+            calls_text = f"{calls:12.1f}" if calls is not None else f"{'-':>12}"
+            print(f"{plate:>6} {mode:>12} {ms_per_frame:10.3f} {calls_text}")
+
+
+if __name__ == "__main__":
+    main()
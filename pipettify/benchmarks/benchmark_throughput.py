@@ -0,0 +1,233 @@
+# End-to-end throughput benchmark. Complete jobs run through PipettifyStateMachine, PrinterController and
+# EndEffectorController (the same polling loop as the headless runner) against a simulated printer on a virtual clock,
+# so an hour-long run takes seconds and its results do not depend on the machine:
+#   wells/h        - filled wells per hour of (virtual) run time
+#   trips/well     - serial round trips (commands answered by "ok") per well, M114 queries separately
+#   syscalls/move  - system calls of the serial port (as pyserial would make them) per G1 move
+#   cpu ms/well    - host CPU time per well (real process time, machine dependent)
+#   idle           - share of the run time the printer did not move, and the longest such gap
+#
+# Jobs are the bundled configurations plus synthetic 384 and 1536 well plates (multi-dispense from one aspiration) and a
+# 96 well plate filled one well per cycle, with a single-channel and an 8-channel pipette.
+# Results are compared with the stored baseline (baseline_throughput.json next to this file), regressions of the
+# deterministic metrics beyond the tolerance make the run fail.
+#
+# Run with:
+#   python -m pipettify.benchmarks.benchmark_throughput [--jobs demo test] [--max-wells N] [--save-baseline]
+#                                                      [--trace-dir DIR]
+# With --trace-dir a Chrome trace of every job (on the virtual clock) is written to DIR/<job>.trace.json.
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+from pipettify.benchmarks.simulated_printer import SimulatedPrinter
+from pipettify.controllers.controller_config import BedConfig
+from pipettify.controllers.controller_printer import PrinterController
+from pipettify.sequence_control.sequence_scheduler import DwellScheduler, VirtualClock, run_until_completed
+from pipettify.sequence_control.sequence_state_machine import PipettifyStateMachine
+from pipettify.telemetry.telemetry_tracing import Tracer
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_throughput.json")
+CONFIG_FILES = {
+    "demo": "demo_config.json",
+    "test": "test_config.json",
+    "19_12_demo": "19_12_demo_config.json",
+}
+# Name: (rows, columns, pitch (mm), channels, probe volume (uL), 0 = fill flags only)
+SYNTHETIC_PLATES = {
+    "synthetic_384": (16, 24, 4.5, 1, 10.0),
+    "synthetic_1536": (32, 48, 2.25, 1, 10.0),
+    "synthetic_96": (12, 8, 9.0, 1, 0.0),
+    "synthetic_96_8ch": (12, 8, 9.0, 8, 0.0),
+}
+GAP_THRESHOLD = 0.1  # Idle gaps longer than this (s) are counted
+# Metric: True if higher is better. Only deterministic metrics are checked against the baseline.
+CHECKED_METRICS = {
+    "wells_per_hour": True,
+    "round_trips_per_well": False,
+    "m114_per_well": False,
+    "syscalls_per_move": False,
+    "idle_fraction": False,
+}
+
+
+def synthetic_config(rows, columns, pitch, channels=1, probe_volume=10.0):
+    """
+    Configuration of a plate based on the demo deck. With a probe volume every aspiration serves as many wells as the
+    pipette volume allows, so a 96 tip rack is enough. The channels of a multi-channel pipette are lined up along X,
+    like the 8 tips of a row of the demo tip rack.
+    """
+    with open(os.path.join(REPOSITORY_DIR, CONFIG_FILES["demo"]), "r") as file:
+        data = json.load(file)
+    left, top = 40.0, 60.0
+    right, bottom = left + pitch * (columns - 1), top + pitch * (rows - 1)
+    data.update({
+        "probes_rows": rows,
+        "probes_columns": columns,
+        "probes": {"top_left": [left, top], "top_right": [right, top],
+                   "bottom_left": [left, bottom], "bottom_right": [right, bottom]},
+        "active_probe_slots": "",
+        "probe_volume": probe_volume,
+        "nominal_volume": 200.0,
+        "channels": channels,
+        "channel_pitch": pitch,
+        "channel_axis": "x",
+    })
+    return BedConfig.from_dict(data)
+
+
+def load_jobs():
+    """
+    Get the benchmark jobs.
+
+    :return: Dictionary {name: BedConfig}.
+    """
+    jobs = {name: BedConfig.from_json_file(os.path.join(REPOSITORY_DIR, file_name))
+            for name, file_name in CONFIG_FILES.items()}
+    for name, (rows, columns, pitch, channels, probe_volume) in SYNTHETIC_PLATES.items():
+        jobs[name] = synthetic_config(rows, columns, pitch, channels, probe_volume)
+    return jobs
+
+
+def run_job(config, poll_interval=0.1, max_wells=0, timeout=24 * 3600.0, trace_path=None):
+    """
+    Run one job to completion on the simulated printer.
+
+    :param config: BedConfig of the job.
+    :param poll_interval: State machine polling interval (s).
+    :param max_wells: Fill at most this many wells (the first ones), 0 = all active wells.
+    :param timeout: Give up after this much virtual time (s).
+    :param trace_path: Write a Chrome trace of the job to this file, None = no tracing.
+    :return: Dictionary of the metrics.
+    """
+    if max_wells and len(config.probes.mask()) > max_wells:
+        config.probes.active_slots = max_wells
+    clock = VirtualClock()
+    printer = PrinterController()
+    printer.use_clock(clock, clock.sleep)
+    simulator = SimulatedPrinter(clock)
+    printer.serial = simulator
+    if trace_path:
+        printer.use_tracer(Tracer(clock=clock))
+    bed_controller = printer.bed_controller
+    state_machine = PipettifyStateMachine(printer_controller=printer,
+                                          pipette_controller=printer.tool_controller,
+                                          bed_controller=bed_controller,
+                                          scheduler=DwellScheduler(clock=clock, sleep=clock.sleep))
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        config.apply_to(bed_controller, printer.tool_controller)
+        printer.home()
+        printer.update_current_coordinates()
+        start_time = clock()
+        trips_before = simulator.round_trips()
+        queries_before = simulator.commands["M114"]
+        moves_before = simulator.commands["G1"]
+        syscalls_before = sum(simulator.syscalls.values())
+        cpu_before = time.process_time()
+        state_machine.start_pipetting()
+        completed = run_until_completed(state_machine, poll_interval, timeout=timeout)
+        cpu_time = time.process_time() - cpu_before
+    end_time = clock()
+    if trace_path:
+        printer.tracer.export_chrome_trace(trace_path)
+
+    wells = sum(1 for probe in bed_controller.probes.values() if probe["filled"])
+    run_time = end_time - start_time
+    gaps = simulator.idle_gaps(start_time, end_time)
+    per_well = max(wells, 1)
+    moves = max(simulator.commands["G1"] - moves_before, 1)
+    return {
+        "completed": completed,
+        "wells": wells,
+        "run_time": round(run_time, 3),
+        "wells_per_hour": round(wells / run_time * 3600, 2) if run_time > 0 else 0.0,
+        "round_trips_per_well": round((simulator.round_trips() - trips_before) / per_well, 2),
+        "m114_per_well": round((simulator.commands["M114"] - queries_before) / per_well, 2),
+        "syscalls_per_move": round((sum(simulator.syscalls.values()) - syscalls_before) / moves, 2),
+        "cpu_ms_per_well": round(cpu_time * 1000 / per_well, 3),
+        "idle_fraction": round(sum(gaps) / run_time, 4) if run_time > 0 else 0.0,
+        "longest_gap": round(max(gaps, default=0.0), 3),
+        "gaps_over_threshold": sum(1 for gap in gaps if gap > GAP_THRESHOLD),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results with the baseline.
+
+    :return: List of regression messages.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in CHECKED_METRICS.items():
+            old, new = baseline[name].get(metric), metrics[metric]
+            if old is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{name}: {metric} {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end throughput on a simulated printer.")
+    parser.add_argument("--jobs", nargs="+", help="Jobs to run (default: all).")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="State machine polling interval (s).")
+    parser.add_argument("--max-wells", type=int, default=0, help="Fill at most this many wells per job, 0 = all.")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Allowed relative regression.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--trace-dir", help="Write a Chrome trace of every job to this directory.")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs()
+    names = args.jobs or list(jobs)
+    unknown = [name for name in names if name not in jobs]
+    if unknown:
+        parser.error(f"unknown jobs: {', '.join(unknown)} (available: {', '.join(jobs)})")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+
+    results = {}
+    print(f"{'job':>16} {'wells':>6} {'wells/h':>9} {'trips/well':>11} {'M114/well':>10} {'syscalls/move':>14} "
+          f"{'cpu ms/well':>12} {'idle':>6} {'max gap':>8} {'vs baseline':>12}")
+    for name in names:
+        trace_path = None
+        if args.trace_dir:
+            os.makedirs(args.trace_dir, exist_ok=True)
+            trace_path = os.path.join(args.trace_dir, f"{name}.trace.json")
+        metrics = run_job(jobs[name], args.poll_interval, args.max_wells, trace_path=trace_path)
+        results[name] = metrics
+        reference = baseline.get(name, {}).get("wells_per_hour")
+        delta = f"{metrics['wells_per_hour'] / reference - 1:+12.1%}" if reference else f"{'-':>12}"
+        print(f"{name:>16} {metrics['wells']:6d} {metrics['wells_per_hour']:9.1f} "
+              f"{metrics['round_trips_per_well']:11.1f} {metrics['m114_per_well']:10.1f} "
+              f"{metrics['syscalls_per_move']:14.1f} {metrics['cpu_ms_per_well']:12.2f} {metrics['idle_fraction']:6.1%} {metrics['longest_gap']:7.2f}s "
+              f"{delta}{'' if metrics['completed'] else '  (not completed)'}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# Simulated printer for benchmarks. It stands in for the pyserial object of PrinterController and models the parts of
+# a Marlin-like firmware that matter for throughput, on a virtual clock:
+#   - serial transfer time of every byte in both directions (baudrate)
+#   - commands are processed one after another, each takes a small processing time
+#   - G1 moves are queued in a planner (limited depth) and executed with a trapezoidal profile, per-axis speed limits
+#   - M400 and G28 block the command queue until the planner is empty
+#   - M114 reports the real-time position
+#   - every call is counted as the system calls a pyserial port (POSIX, timeout=0) would make: write, select + read
+#     per read, one select + read per byte in readline, ioctl for in_waiting, tcflush for the buffer resets
+# Nothing runs in the background: replies are computed when the command is written and become readable once the
+# virtual clock reaches their arrival time, so a whole run takes only the host CPU time.
+
+import bisect
+import re
+from collections import Counter, deque
+
+from pipettify.controllers.motion_model import MoveSegment
+
+AXES = ("X", "Y", "Z", "E")
+_WORD = re.compile(r"([A-Z])(-?\d+(?:\.\d*)?)")
+
+
+class SimulatedPrinter:
+    """
+    Serial-like object (write, read, readline, in_waiting, flushes) simulating the printer firmware.
+    """
+    def __init__(self, clock, baudrate=115200, processing_time=0.0005, planner_depth=16, acceleration=1000.0,
+                 e_acceleration=1000.0, max_feedrate=None):
+        """
+        :param clock: Function returning the current (virtual) time (s).
+        :param baudrate: Serial baudrate, one byte takes 10 bits.
+        :param processing_time: Time the firmware needs per command (s).
+        :param planner_depth: Number of moves the planner can hold, further G1 commands wait for a free slot.
+        :param acceleration: Acceleration of XYZ moves (mm/s^2).
+        :param e_acceleration: Acceleration of E (plunger) only moves (mm/s^2).
+        :param max_feedrate: Dictionary {axis: mm/s} of the machine speed limits, M203 can only lower them.
+        """
+        self.clock = clock
+        self.byte_time = 10.0 / baudrate
+        self.processing_time = processing_time
+        self.planner_depth = planner_depth
+        self.acceleration = acceleration
+        self.e_acceleration = e_acceleration
+        self.machine_max_feedrate = max_feedrate or {"X": 300.0, "Y": 300.0, "Z": 20.0, "E": 40.0}
+        self.max_feedrate = dict(self.machine_max_feedrate)
+
+        self.position = {axis: 0.0 for axis in AXES}  # Planned position (end of the last queued move)
+        self.feedrate = 1500.0  # Modal G1 feedrate (mm/min)
+        self.segments = []  # [MoveSegment] in execution order
+        self._segment_starts = []  # Start times of the segments, for bisect
+        self.tx_free_at = 0.0  # Host -> printer line free
+        self.rx_free_at = 0.0  # Printer -> host line free
+        self.firmware_free_at = 0.0  # Firmware ready for the next command
+        self._output = deque()  # [(arrival time, bytes)] not read yet
+        self._partial = b""  # Written bytes without a newline yet
+
+        self.commands = Counter()  # {G-code: count}
+        self.syscalls = Counter()  # {system call: count} of the host side, see the top of this file
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    ############################
+    # SERIAL INTERFACE
+    ############################
+
+    def write(self, data):
+        self.syscalls["write"] += 1
+        self.bytes_written += len(data)
+        now = self.clock()
+        self._partial += data
+        *lines, self._partial = self._partial.split(b"\n")
+        for line in lines:
+            arrival = max(now, self.tx_free_at) + (len(line) + 1) * self.byte_time
+            self.tx_free_at = arrival
+            self._execute(line.decode("ascii", errors="replace").strip(), arrival)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        self.syscalls["ioctl"] += 1
+        now = self.clock()
+        return sum(len(chunk) for arrival, chunk in self._output if arrival <= now)
+
+    def read(self, size=1):
+        now = self.clock()
+        data = b""
+        while self._output and self._output[0][0] <= now and len(data) < size:
+            arrival, chunk = self._output.popleft()
+            take = size - len(data)
+            data += chunk[:take]
+            if len(chunk) > take:
+                self._output.appendleft((arrival, chunk[take:]))
+        self.bytes_read += len(data)
+        self.syscalls["select"] += 1
+        if data:
+            self.syscalls["read"] += 1
+        return data
+
+    def readline(self):
+        """
+        Read up to and including the next newline of the data that already arrived (timeout=0 behaviour).
+        """
+        now = self.clock()
+        data = b""
+        while self._output and self._output[0][0] <= now:
+            arrival, chunk = self._output.popleft()
+            newline = chunk.find(b"\n")
+            if newline >= 0:
+                data += chunk[:newline + 1]
+                if newline + 1 < len(chunk):
+                    self._output.appendleft((arrival, chunk[newline + 1:]))
+                break
+            data += chunk
+        self.bytes_read += len(data)
+        self.syscalls["select"] += len(data) + (0 if data.endswith(b"\n") else 1)  # The last one finds nothing
+        self.syscalls["read"] += len(data)
+        return data
+
+    def reset_input_buffer(self):
+        self.syscalls["tcflush"] += 1
+        now = self.clock()
+        while self._output and self._output[0][0] <= now:
+            self._output.popleft()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def flushOutput(self):
+        self.syscalls["tcflush"] += 1
+
+    def close(self):
+        pass
+
+    ############################
+    # FIRMWARE
+    ############################
+
+    def planner_end(self):
+        return self.segments[-1].end_time if self.segments else 0.0
+
+    def position_at(self, now):
+        """
+        Real-time (x, y, z, e) at the given time.
+        """
+        index = bisect.bisect_right(self._segment_starts, now) - 1
+        if index < 0:
+            return tuple(0.0 for _ in AXES)
+        return self.segments[index].position(now)
+
+    def _reply(self, text, ready_time):
+        data = text.encode("ascii")
+        arrival = max(ready_time, self.rx_free_at) + len(data) * self.byte_time
+        self.rx_free_at = arrival
+        self._output.append((arrival, data))
+
+    def _queue_move(self, words, start):
+        """
+        Queue a G1 move. Waits for a free planner slot if the planner is full.
+
+        :return: Time the command is processed (slot was free).
+        """
+        if len(self.segments) >= self.planner_depth:
+            start = max(start, self.segments[-self.planner_depth].end_time)
+        if "F" in words:
+            self.feedrate = words["F"]
+        begin = tuple(self.position[axis] for axis in AXES)
+        for axis in AXES:
+            if axis in words:
+                self.position[axis] = words[axis]
+        target = tuple(self.position[axis] for axis in AXES)
+
+        deltas = [abs(t - b) for b, t in zip(begin, target)]
+        distance = sum(delta * delta for delta in deltas) ** 0.5
+        speed = self.feedrate / 60.0
+        for axis, delta in zip(AXES, deltas):
+            if delta > 0:
+                speed = min(speed, self.max_feedrate[axis] * distance / delta)  # Per-axis limit
+        only_e = all(delta == 0 for delta in deltas[:3])
+        segment = MoveSegment(max(start, self.planner_end()), begin, target, speed * 60.0,
+                              self.e_acceleration if only_e else self.acceleration)
+        self.segments.append(segment)
+        self._segment_starts.append(segment.start_time)
+        return start
+
+    def _execute(self, line, arrival):
+        line = line.split(";", 1)[0].strip()
+        if not line:
+            return
+        code = line.split()[0].upper()
+        words = {letter: float(value) for letter, value in _WORD.findall(line[len(code):].upper())}
+        self.commands[code] += 1
+        start = max(arrival, self.firmware_free_at)
+        reply = ""
+
+        if code in ("G0", "G1"):
+            start = self._queue_move(words, start)
+        elif code == "G28":
+            self._queue_move({"X": 0.0, "Y": 0.0, "Z": 0.0, "F": 3000.0}, start)
+            start = self.planner_end()
+        elif code == "M400":
+            start = max(start, self.planner_end())
+        elif code == "M114":
+            x, y, z, e = self.position_at(start)
+            reply = f"X:{x:.2f} Y:{y:.2f} Z:{z:.2f} E:{e:.2f} Count X:{x:.2f} Y:{y:.2f} Z:{z:.2f}\n"
+        elif code == "M203":
+            for axis in AXES:
+                if axis in words:
+                    self.max_feedrate[axis] = min(words[axis], self.machine_max_feedrate[axis])
+        elif code == "M112":
+            # Kill: motion stops where it is
+            stopped = self.position_at(start)
+            self.position = dict(zip(AXES, stopped))
+            self.segments.clear()
+            self._segment_starts.clear()
+        elif code == "M115":
+            reply = "FIRMWARE_NAME:Simulated PROTOCOL_VERSION:1.0\n"
+
+        done = start + self.processing_time
+        self.firmware_free_at = done
+        self._reply(reply + "ok\n", done)
+
+    ############################
+    # STATISTICS
+    ############################
+
+    def round_trips(self):
+        """
+        Number of commands the host sent (each one is answered by "ok").
+        """
+        return sum(self.commands.values())
+
+    def motion_intervals(self):
+        """
+        Merged (start, end) intervals during which the printer was moving.
+        """
+        intervals = []
+        for segment in self.segments:
+            if segment.duration <= 0:
+                continue
+            if intervals and segment.start_time <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], segment.end_time)
+            else:
+                intervals.append([segment.start_time, segment.end_time])
+        return intervals
+
+    def idle_gaps(self, start, end):
+        """
+        Lengths of the periods between `start` and `end` during which the printer did not move.
+        """
+        gaps = []
+        previous_end = start
+        for interval_start, interval_end in self.motion_intervals():
+            if interval_start > previous_end:
+                gaps.append(interval_start - previous_end)
+            previous_end = max(previous_end, interval_end)
+        if end > previous_end:
+            gaps.append(end - previous_end)
+        return gaps
@@ -0,0 +1,145 @@
+#####################
+### CAMPAIGN APP ####
+#####################
+
+# Runs one job on several printers connected to this host, e.g.:
+#   python -m pipettify.campaign_app demo_config.json --ports /dev/ttyUSB0 /dev/ttyUSB1 [--worklist transfers.csv]
+# The job (the worklist, or filling all active probes) is split into units (--split column/plate/row/transfer) and
+# shared by the printers, see sequence_control/sequence_campaign.py. Printers that finish early take over the queued
+# units of the others, the work of a printer that fails is finished by the rest.
+#
+# Every printer uses the same configuration (deck layout) and a single-channel pipette.
+
+import argparse
+import sys
+import time
+
+from pipettify.controllers.controller_config import BedConfig
+from pipettify.sequence_control.sequence_campaign import SPLITS
+from pipettify.telemetry.telemetry_logging import configure_logging, get_logger, shutdown_logging
+
+logger = get_logger("campaign_app")
+
+
+def run(args):
+    """
+    Connect to all printers and run the campaign until every transfer is done or no printer is left.
+
+    :return: Process exit code.
+    """
+    start_time = time.monotonic()
+    try:
+        configure_logging(args.log_level, args.log_file)
+    except (OSError, ValueError) as e:
+        print(f"Could not configure logging: {e}", file=sys.stderr)
+        return 2
+    try:
+        return _run(args, start_time)
+    finally:
+        shutdown_logging()
+
+
+def _run(args, start_time):
+    if len(set(args.ports)) != len(args.ports):
+        print("Every port can be given only once.", file=sys.stderr)
+        return 2
+    try:
+        bed_config = BedConfig.from_json_file(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Could not load configuration {args.config}: {e}", file=sys.stderr)
+        return 2
+    if bed_config.channels > 1:
+        print("Campaigns need a single-channel pipette, the transfers are single wells.", file=sys.stderr)
+        return 2
+
+    # Heavy imports only now, after the cheap checks passed
+    from pipettify.controllers.controller_geometry_cache import GeometryCache
+    from pipettify.controllers.controller_printer import PrinterController
+    from pipettify.sequence_control.sequence_campaign import Campaign, fill_entries, run_campaign
+    from pipettify.sequence_control.sequence_scheduler import DwellScheduler
+    from pipettify.sequence_control.sequence_state_machine import PipettifyStateMachine
+
+    state_machines = {}
+    for port in args.ports:
+        printer = PrinterController()
+        bed_controller = printer.bed_controller
+        bed_controller.geometry_cache = GeometryCache()
+        bed_config.apply_to(bed_controller, printer.tool_controller)
+        state_machines[port] = PipettifyStateMachine(printer_controller=printer,
+                                                     pipette_controller=printer.tool_controller,
+                                                     bed_controller=bed_controller,
+                                                     scheduler=DwellScheduler(clock=printer.clock,
+                                                                              sleep=printer.sleep))
+
+    reference_bed = next(iter(state_machines.values())).bed_controller
+    if args.worklist:
+        from pipettify.sequence_control.sequence_worklist import Worklist
+
+        worklist = Worklist(args.worklist, reference_bed, liquid_classes=bed_config.liquid_classes)
+        errors = worklist.validate()
+        if errors:
+            for error in errors:
+                print(error, file=sys.stderr)
+            return 2
+        entries = list(worklist)
+    else:
+        entries = fill_entries(reference_bed)
+    campaign = Campaign(entries, args.ports, split=args.split)
+    logger.info("Campaign of %d transfers on %d printers, split by %s.", campaign.total, len(args.ports), args.split)
+
+    for port, state_machine in list(state_machines.items()):
+        printer = state_machine.printer_controller
+        try:
+            printer.configure_serial_connection(port=port, baudrate=args.baudrate, ready_timeout=args.ready_timeout)
+            if args.home:
+                printer.home()
+            printer.update_current_coordinates()
+        except Exception as e:
+            logger.error("Could not connect to the printer at %s: %s", port, e)
+            campaign.fail(port)
+            del state_machines[port]
+    if not state_machines:
+        print("No printer could be connected.", file=sys.stderr)
+        return 1
+    logger.info("Ready after %.2fs", time.monotonic() - start_time)
+
+    def print_progress(port, state_machine):
+        logger.info("[%8.1fs] %-14s %-22s transfers %d/%d", time.monotonic() - start_time, port,
+                    state_machine.current_state.name, campaign.completed(), campaign.total)
+
+    try:
+        completed = run_campaign(campaign, state_machines, args.poll_interval, on_change=print_progress)
+    except KeyboardInterrupt:
+        # run_campaign stopped and joined the printer threads, nothing else writes to the ports now
+        for state_machine in state_machines.values():
+            state_machine.printer_controller.emergency_stop()
+        print("Interrupted.", file=sys.stderr)
+        return 130
+
+    for port, progress in campaign.summary().items():
+        logger.info("%-14s completed %d, taken over %d units%s", port, progress["completed"], progress["steals"],
+                    ", FAILED" if progress["failed"] else "")
+    logger.info("Campaign %s after %.1fs: %d/%d transfers.", "completed" if completed else "not completed",
+                time.monotonic() - start_time, campaign.completed(), campaign.total)
+    return 0 if completed else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run one job on several printers.")
+    parser.add_argument("config", help="Configuration JSON exported from the GUI, used for every printer.")
+    parser.add_argument("--ports", nargs="+", required=True, help="Serial ports of the printers.")
+    parser.add_argument("--baudrate", type=int, default=115200, help="Serial baudrate.")
+    parser.add_argument("--worklist", help="Optional worklist (CSV/JSON/JSONL), default: fill all active probes.")
+    parser.add_argument("--split", choices=SPLITS, default="column",
+                        help="Unit of work handed to a printer at once (of the destination labware).")
+    parser.add_argument("--home", action="store_true", help="Home the printers before the run.")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="State machine polling interval (s).")
+    parser.add_argument("--log-level", default="INFO", help="Lowest level logged (DEBUG, INFO, WARNING, ...).")
+    parser.add_argument("--log-file", help="Also write the log to this file.")
+    parser.add_argument("--ready-timeout", type=float, default=10.0,
+                        help="How long to wait for the firmware to answer after connecting (s).")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,59 @@
 # (filled or not). This class is used by our GUI to display the current state of the grid and by the sequence controller
 # to move to the next probe.
 
+import threading
+from collections import deque
+
 import numpy as np
 
+from pipettify.controllers.controller_deck import DeckController, Labware, calculate_grid_coordinates
+from pipettify.controllers.controller_slot_mask import SlotMask
+
+VOLUME_TOLERANCE = 1e-6  # Volumes closer than this (uL) are considered equal
+CHANNEL_TOLERANCE = 1.5  # Largest distance (mm) between a channel of a multi-channel tool and the center of its slot
+CHANGE_LOG_SIZE = 4096  # Number of changes kept for consumers, slower consumers get a full refresh
+
+
+class ChangeCursor:
+    """
+    Consumer side of the BedController change log. Each consumer (GUI, metrics, ...) keeps its own cursor
+    and drains the keys that changed since its last drain.
+    """
+    def __init__(self, bed_controller):
+        self.bed_controller = bed_controller
+        self.version = None  # None forces a full refresh on the first drain
+
+    def pending(self):
+        """
+        Check if anything changed since the last drain. Cheap enough to be called on every frame.
+        """
+        return self.version != self.bed_controller.version
+
+    def drain(self):
+        """
+        Get keys changed since the last drain.
+
+        :return: Set of keys (name, position), e.g. ("probes", (0, 1)), ("grid", None).
+                 None if the consumer has to refresh everything (first drain, or too many changes missed).
+        """
+        if self.version is None:
+            self.version = self.bed_controller.version
+            return None
+        self.version, changes = self.bed_controller.changes_since(self.version)
+        return changes
+
+    def reset(self):
+        """
+        Force a full refresh on the next drain.
+        """
+        self.version = None
+
 class BedController:
     """
     Class containg everything related to bed.
     1. Probe grid definition
     2. Z levels for different processes
-    3. TODO
+    3. Deck with all labware (probes, tips, tanks and any additional plates/racks/reservoirs)
     """
     def __init__(self):
         """
@@ -20,6 +65,7 @@ class BedController:
         self.probes_columns = 0
 
         self.probes_number = 0
+        self.probes_mask = SlotMask(0, 0)  # Active probes
         self.probes = {}  # Dictionary to store probe states: {(row, col): {"filled": False, "coordinates": (x, y)}}
         self.probes_top_left = (0, 0)  # Coordinates of the top-left corner of the grid
         self.probes_top_right = (0, 0)  # Coordinates of the top-right corner
@@ -30,12 +76,15 @@ class BedController:
         self.tips_columns = 0
 
         self.tips_number = 0  # Number of tips in the tip rack
+        self.tips_mask = SlotMask(0, 0)  # Active tips
         self.tips = {}  # Dictionary to store tip states: {(row, col): {"taken": False, "coordinates": (x, y)}}
         self.tips_top_left = (0, 0)  # Coordinates of the top-left corner of the tip rack
         self.tips_top_right = (0, 0)  # Coordinates of the top-right corner
         self.tips_bottom_left = (0, 0)  # Coordinates of the bottom-left corner
         self.tips_bottom_right = (0, 0)  # Coordinates of the bottom-right corner
-        self.tip_diameter = 0  # Diameter of the tips
+        self.tip_diameter = 8  # Diameter of the tips
+        self.probe_diameter = 8  # Diameter of the probes
+        self.tank_diameter = 40  # Diameter of the refilling and disposal tanks
         
         self.refilling_tank = (0, 0)  # X, Y center coordinates of the refilling tank        
         self.disposal_tank = (0, 0)  # X, Y center coordinates of the disposal tank
@@ -47,6 +96,29 @@ class BedController:
         self.drop_tip_z = 40    # Z coordinate that tool needs to achieve to drop the tip
         self.refilling_z = 30
 
+        # Per-probe volume accounting (uL), arrays of shape (probes_rows, probes_columns)
+        self.probe_volume = 0.0  # Target volume of every active probe, 0 = volumes are not tracked
+        self.target_volumes = np.zeros((0, 0))
+        self.dispensed_volumes = np.zeros((0, 0))
+        self.probes_route = np.zeros((0, 2), dtype=int)  # (row, col) of active probes in the order they are filled
+
+        # Change tracking: every real change increases the version and is appended to the change log
+        self.version = 0
+        self._change_log = deque(maxlen=CHANGE_LOG_SIZE)  # (version, key)
+        self._change_lock = threading.Lock()
+        self._listeners = []
+
+        # Deck with all labware and a spatial index of their slots. Probes, tips and tanks are registered
+        # on every make_new_grid, additional labware can be placed with deck.add_labware().
+        self.deck = DeckController()
+
+        # Optional GeometryCache, if set the slot coordinates are loaded from it instead of being calculated
+        self.geometry_cache = None
+
+        # Inputs of the last applied configuration, used to apply only what changed
+        self._grid_inputs = {}  # {"probes": (...), "tips": (...)}
+        self._applied_probe_volume = None
+        self._source_plate_inputs = None  # Inputs of the applied source plate, None = no source plate
         
     def make_new_grid(self,
                       probes_rows,
@@ -69,16 +141,30 @@ class BedController:
                       change_tip_z,
                       refilling_z,
                       dispensing_z,
-                      drop_tip_z):
+                      drop_tip_z,
+                      probes_mask=None,
+                      tips_mask=None):
         """
         Make a new grid and initialize probes accordingly.
+        Applying is incremental: a grid is only rebuilt if its geometry changed, and filled/taken flags (and dispensed
+        volumes) are kept for every slot that still exists, so calibration can be tweaked in the middle of a run.
 
         :param rows: Number of rows in the grid.
         :param columns: Number of columns in the grid.
         :param top_left: Tuple (x, y) of the top-left corner coordinates.
         :param bottom_right: Tuple (x, y) of the bottom-right corner coordinates.
         :param num_probes: Number of active probes.
+        :param probes_mask: Optional SlotMask (or its text specification) of active probes, replaces probes_number.
+        :param tips_mask: Optional SlotMask (or its text specification) of active tips, replaces tips_number.
+        :return: Set of what changed: "probes", "tips", "tanks", "z_heights", "volumes".
         """
+        previous = {
+            "probes": self._grid_inputs.get("probes"),
+            "tips": self._grid_inputs.get("tips"),
+            "tanks": (self.refilling_tank, self.disposal_tank),
+            "z_heights": (self.safe_z, self.dispensing_z, self.change_tip_z, self.drop_tip_z, self.refilling_z),
+        }
+
         self.probes_rows = probes_rows
         self.probes_columns = probes_columns
 
@@ -98,8 +184,10 @@ class BedController:
         self.refilling_tank = refilling_tank
         self.disposal_tank = disposal_tank
         
-        self.probes_number = min(probes_number, probes_rows * probes_columns)
-        self.tips_number = min(tips_number, tips_rows * tips_columns)
+        self.probes_mask = self._active_mask(probes_mask, probes_number, probes_rows, probes_columns)
+        self.tips_mask = self._active_mask(tips_mask, tips_number, tips_rows, tips_columns)
+        self.probes_number = len(self.probes_mask)
+        self.tips_number = len(self.tips_mask)
         
         self.safe_z = safe_z
         self.dispensing_z = dispensing_z
@@ -107,86 +195,162 @@ class BedController:
         self.drop_tip_z = drop_tip_z
         self.refilling_z = refilling_z
 
-        self._initialize_probes()
-        self._initialize_tips()
+        self._grid_inputs = {
+            "probes": (self.probes_rows, self.probes_columns, self.probes_top_left, self.probes_top_right,
+                       self.probes_bottom_left, self.probes_bottom_right, self.probes_mask),
+            "tips": (self.tips_rows, self.tips_columns, self.tips_top_left, self.tips_top_right,
+                     self.tips_bottom_left, self.tips_bottom_right, self.tips_mask),
+        }
+        changed = {name for name, inputs in self._grid_inputs.items() if inputs != previous[name]}
+        if (self.refilling_tank, self.disposal_tank) != previous["tanks"]:
+            changed.add("tanks")
+        if (self.safe_z, self.dispensing_z, self.change_tip_z, self.drop_tip_z, self.refilling_z) != \
+                previous["z_heights"]:
+            changed.add("z_heights")
+
+        if "probes" in changed:
+            old_probes = self.probes
+            old_dispensed = {(int(row), int(col)): self.dispensed_volumes[row, col]
+                             for row, col in zip(*np.nonzero(self.dispensed_volumes))}
+            self._initialize_probes()
+            self._restore_slot_states(self.probes, old_probes, "filled")
+            for position, volume in old_dispensed.items():
+                if position in self.probes:
+                    self.dispensed_volumes[position] = volume
+        elif self.probe_volume != self._applied_probe_volume:
+            self.target_volumes[:] = 0.0
+            self.target_volumes[self.probes_route[:, 0], self.probes_route[:, 1]] = self.probe_volume
+            changed.add("volumes")
+        self._applied_probe_volume = self.probe_volume
+
+        if "tips" in changed:
+            old_tips = self.tips
+            self._initialize_tips()
+            self._restore_slot_states(self.tips, old_tips, "taken")
+
+        if changed & {"probes", "tips", "tanks"}:
+            self._register_deck_labware()  # Labware with unchanged geometry keeps its index entries
+            self._mark_changed(("grid", None))
+        elif changed:
+            self._mark_changed(("config", None))
+        return changed
+
+    @staticmethod
+    def _active_mask(mask, number, rows, columns):
+        """
+        Get the SlotMask of active slots: the given mask (parsed if it is a text), or the first `number` slots.
+        """
+        if mask is None:
+            return SlotMask.first(rows, columns, number)
+        if not isinstance(mask, SlotMask):
+            return SlotMask.parse(rows, columns, mask)
+        if (mask.rows, mask.columns) != (rows, columns):
+            raise ValueError(f"Mask of a {mask.rows}x{mask.columns} grid does not fit a {rows}x{columns} grid.")
+        return mask
+
+    def clear_slot_states(self, probes=True, tips=False):
+        """
+        Start over with an empty plate and/or a full tip rack. Applying a configuration keeps the states, so this is
+        the way to reset them.
+
+        :param probes: Mark all probes as not filled and forget dispensed volumes.
+        :param tips: Mark all tips as not taken.
+        """
+        if probes:
+            for probe in self.probes.values():
+                probe["filled"] = False
+            self.dispensed_volumes[:] = 0.0
+        if tips:
+            for tip in self.tips.values():
+                tip["taken"] = False
+        self._mark_changed(("grid", None))
+
+    @staticmethod
+    def _restore_slot_states(slots, old_slots, state_key):
+        """
+        Copy state flags from the old slots to the new ones, for positions present in both.
+        """
+        for position, slot in slots.items():
+            old_slot = old_slots.get(position)
+            if old_slot is not None and old_slot[state_key]:
+                slot[state_key] = True
 
     def _initialize_probes(self):
         """
-        Initialize or update the probe grid based on the current attributes.
+        Initialize or update the probe grid based on the current attributes. Only probes of the active mask are created.
         """
-        self.probes = {}
-        count = 0
-        for row in range(self.probes_rows):
-            for col in range(self.probes_columns):
-                if count < self.probes_number:
-                    self.probes[(row, col)] = {"filled": False, "coordinates": None}
-                    count += 1
-                else:
-                    break
-        self._calculate_grid_coordinates(self.probes,
-                                         self.probes_top_left,
-                                         self.probes_top_right,
-                                         self.probes_bottom_left,
-                                         self.probes_bottom_right,
-                                         self.probes_rows,
-                                         self.probes_columns)
+        self.probes = self._build_grid("filled",
+                                       self.probes_rows,
+                                       self.probes_columns,
+                                       (self.probes_top_left, self.probes_top_right,
+                                        self.probes_bottom_left, self.probes_bottom_right),
+                                       self.probes_mask)
+        self._initialize_volumes()
+
+    def _initialize_volumes(self):
+        """
+        Initialize per-probe target and dispensed volumes. Inactive probes have target volume 0.
+        """
+        self.probes_route = np.array(list(self.probes.keys()), dtype=int).reshape(-1, 2)
+        self.target_volumes = np.zeros((self.probes_rows, self.probes_columns))
+        self.dispensed_volumes = np.zeros((self.probes_rows, self.probes_columns))
+        self.target_volumes[self.probes_route[:, 0], self.probes_route[:, 1]] = self.probe_volume
         
     def _initialize_tips(self):
         """
-        Initialize or update the tip rack based on the current attributes.
+        Initialize or update the tip rack based on the current attributes. Only tips of the active mask are created.
         """
-        self.tips = {}
-        count = 0
-        for row in range(self.tips_rows):
-            for col in range(self.tips_columns):
-                if count < self.tips_number:
-                    self.tips[(row, col)] = {"taken": False, "coordinates": None}
-                    count += 1
-                else:
-                    break
-        self._calculate_grid_coordinates(self.tips,
-                                         self.tips_top_left,
-                                         self.tips_top_right,
-                                         self.tips_bottom_left,
-                                         self.tips_bottom_right,
-                                         self.tips_rows,
-                                         self.tips_columns)
+        self.tips = self._build_grid("taken",
+                                     self.tips_rows,
+                                     self.tips_columns,
+                                     (self.tips_top_left, self.tips_top_right,
+                                      self.tips_bottom_left, self.tips_bottom_right),
+                                     self.tips_mask)
+
+    def _build_grid(self, state_key, rows, columns, corners, mask):
+        """
+        Build a slots dictionary of the active slots, in row-major order. Coordinates are taken from the geometry
+        cache if it is set.
+
+        :param state_key: Name of the state flag of the slots ("filled" or "taken").
+        :param corners: Tuple of (x, y) corners: top-left, top-right, bottom-left, bottom-right.
+        :param mask: SlotMask of the active slots.
+        """
+        if self.geometry_cache is not None:
+            geometry = self.geometry_cache.grid_geometry(rows, columns, corners, mask)
+            return {(int(row), int(col)): {state_key: False, "coordinates": (float(x), float(y))}
+                    for row, col, x, y in geometry.tolist()}
+
+        slots = {position: {state_key: False, "coordinates": None} for position in mask}
+        self._calculate_grid_coordinates(slots, *corners, rows, columns)
+        return slots
 
     def _calculate_grid_coordinates(self, grid, top_left, top_right, bottom_left, bottom_right, rows, columns):
         """
         Calculate coordinates for all probes in an irregular grid.
         The probes are evenly distributed within the quadrilateral defined by the four corners.
         """
-        # Extract corner coordinates
-        top_left_x, top_left_y = top_left
-        top_right_x, top_right_y = top_right
-        bottom_left_x, bottom_left_y = bottom_left
-        bottom_right_x, bottom_right_y = bottom_right
-
-        # top_x_diff = top_right_x - top_left_x
-
-        for row in range(rows):
-            for col in range(columns):
-                # Calculate interpolation factors
-                t = row / (rows - 1) if rows > 1 else 0
-                u = col / (columns - 1) if columns > 1 else 0
-
-                # Interpolate top edge
-                top_x = top_left_x + u * (top_right_x - top_left_x)
-                top_y = top_left_y + u * (top_right_y - top_left_y)
-
-                # Interpolate bottom edge
-                bottom_x = bottom_left_x + u * (bottom_right_x - bottom_left_x)
-                bottom_y = bottom_left_y + u * (bottom_right_y - bottom_left_y)
-
-                # Interpolate between top and bottom edges
-                probe_x = top_x + t * (bottom_x - top_x)
-                probe_y = top_y + t * (bottom_y - top_y)
-
-                # Assign the calculated coordinates to the probe
-                if (row, col) in grid:
-                    grid[(row, col)]["coordinates"] = (probe_x, probe_y)
+        calculate_grid_coordinates(grid, top_left, top_right, bottom_left, bottom_right, rows, columns)
 
+    def _register_deck_labware(self):
+        """
+        Place probes, tips and tanks on the deck, sharing the probes/tips dictionaries with the deck labware.
+        Collisions are not checked here, the user calibrates these positions by hand.
+        """
+        self.deck.add_labware(Labware("probes", "plate", self.probes_rows, self.probes_columns,
+                                      self.probes_top_left, self.probes_top_right,
+                                      self.probes_bottom_left, self.probes_bottom_right,
+                                      self.probe_diameter, state_key="filled", slots=self.probes),
+                              check_collisions=False)
+        self.deck.add_labware(Labware("tips", "tip_rack", self.tips_rows, self.tips_columns,
+                                      self.tips_top_left, self.tips_top_right,
+                                      self.tips_bottom_left, self.tips_bottom_right,
+                                      self.tip_diameter, state_key="taken", slots=self.tips),
+                              check_collisions=False)
+        for name, kind, center in (("refilling_tank", "reservoir", self.refilling_tank),
+                                   ("disposal_tank", "disposal", self.disposal_tank)):
+            self.deck.add_labware(Labware(name, kind, 1, 1, center, center, center, center, self.tank_diameter),
+                                  check_collisions=False)
 
     def update_probe_state(self, row, column, new_state):
         """
@@ -198,7 +362,9 @@ class BedController:
         """
         if (row, column) not in self.probes:
             raise KeyError(f"No probe exists at position ({row}, {column}).")
-        self.probes[(row, column)]["filled"] = new_state
+        if self.probes[(row, column)]["filled"] != new_state:
+            self.probes[(row, column)]["filled"] = new_state
+            self._mark_changed(("probes", (row, column)))
 
     def get_probe_state(self, row, column):
         """
@@ -223,6 +389,305 @@ class BedController:
                 return position
         return None  # All probes are filled
 
+    ########
+    # CHANGE NOTIFICATIONS
+    ########
+    def _mark_changed(self, key):
+        """
+        Record a change and notify listeners.
+
+        :param key: Tuple (name, position) of what changed, e.g. ("probes", (0, 1)) or ("grid", None).
+        """
+        with self._change_lock:
+            self.version += 1
+            version = self.version
+            self._change_log.append((version, key))
+        for listener in self._listeners:
+            listener(version, key)
+
+    def add_listener(self, listener):
+        """
+        Call listener(version, key) on every change. Listeners are called synchronously, keep them cheap.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Stop calling the listener.
+        """
+        self._listeners.remove(listener)
+
+    def changes_since(self, version):
+        """
+        Get keys changed after the given version.
+
+        :param version: Version the consumer has already seen.
+        :return: Tuple (current_version, set_of_keys). The set is None if the change log no longer reaches
+                 back to the given version and the consumer has to refresh everything.
+        """
+        with self._change_lock:
+            current_version = self.version
+            if version == current_version:
+                return current_version, set()
+            if not self._change_log or self._change_log[0][0] > version + 1:
+                return current_version, None
+            changes = set()
+            for change_version, key in reversed(self._change_log):
+                if change_version <= version:
+                    break
+                changes.add(key)
+        return current_version, changes
+
+    def change_cursor(self):
+        """
+        Make a new cursor for a consumer of the change log.
+        """
+        return ChangeCursor(self)
+
+    ########
+    # VOLUME ACCOUNTING
+    ########
+    def tracks_volumes(self):
+        """
+        Check if any probe has a target volume, i.e. the run is driven by volumes instead of filled flags.
+        """
+        return bool(self.target_volumes.any())
+
+    def set_target_volumes(self, volume, positions=None):
+        """
+        Set the target volume of active probes.
+
+        :param volume: Target volume (uL), scalar or array matching positions.
+        :param positions: Optional list of (row, col) positions. If None, all active probes are updated.
+        """
+        if positions is None:
+            positions = self.probes_route
+        positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+        self.target_volumes[positions[:, 0], positions[:, 1]] = volume
+        self._mark_changed(("volumes", None))
+
+    def record_dispenses(self, positions, volumes):
+        """
+        Add dispensed volumes for a batch of probes. Probes that reached their target are marked as filled.
+
+        :param positions: List of (row, col) positions, the same probe can appear multiple times.
+        :param volumes: Dispensed volume (uL), scalar or list matching positions.
+        """
+        positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+        if len(positions) == 0:
+            return
+        np.add.at(self.dispensed_volumes, (positions[:, 0], positions[:, 1]), volumes)
+        for row, col in positions:
+            self._mark_changed(("volumes", (int(row), int(col))))
+
+        reached = self.dispensed_volumes[positions[:, 0], positions[:, 1]] >= \
+            self.target_volumes[positions[:, 0], positions[:, 1]] - VOLUME_TOLERANCE
+        for row, col in positions[reached]:
+            if not self.probes[(row, col)]["filled"]:
+                self.update_probe_state(int(row), int(col), True)
+
+    def remaining_volumes(self):
+        """
+        Get the volume still missing in every active probe, in route order.
+
+        :return: Array of shape (n,) aligned with probes_route.
+        """
+        rows, cols = self.probes_route[:, 0], self.probes_route[:, 1]
+        return np.clip(self.target_volumes[rows, cols] - self.dispensed_volumes[rows, cols], 0.0, None)
+
+    def wells_below_target(self):
+        """
+        Get active probes whose dispensed volume is below the target, in route order.
+
+        :return: Array of (row, col) positions.
+        """
+        return self.probes_route[self.remaining_volumes() > VOLUME_TOLERANCE]
+
+    def total_reagent_needed(self):
+        """
+        Get the total volume still needed to fill all active probes (uL).
+        """
+        return float(self.remaining_volumes().sum())
+
+    def probes_per_aspiration(self, capacity):
+        """
+        Plan which probes a single aspiration can serve. Probes are taken in route order as long as their remaining
+        volumes fit into the aspirated volume. A probe that needs more than the capacity is served alone.
+
+        :param capacity: Volume of liquid aspirated at once (uL), see EndEffectorController.liquid_capacity.
+        :return: List of tuples ((row, col), volume).
+        """
+        remaining = self.remaining_volumes()
+        needed = remaining > VOLUME_TOLERANCE
+        positions = self.probes_route[needed]
+        remaining = remaining[needed]
+        if len(remaining) == 0 or capacity <= 0:
+            return []
+
+        count = max(int(np.searchsorted(np.cumsum(remaining), capacity + VOLUME_TOLERANCE, side="right")), 1)
+        volumes = np.minimum(remaining[:count], capacity)
+        return [((int(row), int(col)), float(volume)) for (row, col), volume in zip(positions[:count], volumes)]
+
+    def remaining_refills(self, capacity):
+        """
+        Count the aspirations still needed to fill all active probes, using the same plan as probes_per_aspiration.
+
+        :param capacity: Volume of liquid aspirated at once (uL), see EndEffectorController.liquid_capacity.
+        """
+        remaining = self.remaining_volumes()
+        remaining = remaining[remaining > VOLUME_TOLERANCE]
+        if len(remaining) == 0 or capacity <= 0:
+            return 0
+
+        # Probes bigger than the capacity take full aspirations on their own first
+        refills = int(np.sum(np.ceil(remaining / capacity - VOLUME_TOLERANCE) - 1))
+        remaining = remaining - (np.ceil(remaining / capacity - VOLUME_TOLERANCE) - 1) * capacity
+
+        # The rest is packed greedily in route order
+        start = 0
+        cumulative = np.cumsum(remaining)
+        while start < len(remaining):
+            offset = cumulative[start - 1] if start > 0 else 0.0
+            end = int(np.searchsorted(cumulative, offset + capacity + VOLUME_TOLERANCE, side="right"))
+            start = max(end, start + 1)
+            refills += 1
+        return refills
+
+    ########
+    # SOURCE PLATE
+    ########
+    def set_source_plate(self, rows, columns, top_left, top_right, bottom_left, bottom_right, mask=None):
+        """
+        Place the source plate of plate-to-plate transfers on the deck as labware "source_plate". Worklist rows and
+        generated transfers address its wells as "source_plate:<slot>", the liquid is aspirated at refilling_z.
+        The plate is only rebuilt if its geometry changed.
+
+        :param rows: Number of rows of the plate.
+        :param columns: Number of columns of the plate.
+        :param top_left: Tuple (x, y) of the top-left well, the other corners likewise.
+        :param mask: SlotMask (or its text specification) of the wells that hold liquid, None = all wells.
+        :return: True if the plate changed.
+        """
+        mask = self._active_mask(mask, rows * columns, rows, columns)
+        inputs = (rows, columns, top_left, top_right, bottom_left, bottom_right, mask)
+        if inputs == self._source_plate_inputs:
+            return False
+        corners = (top_left, top_right, bottom_left, bottom_right)
+        slots = self._build_grid("aspirated", rows, columns, corners, mask)
+        self.deck.add_labware(Labware("source_plate", "plate", rows, columns, *corners, self.probe_diameter,
+                                      state_key="aspirated", slots=slots),
+                              check_collisions=False)
+        self._source_plate_inputs = inputs
+        self._mark_changed(("grid", None))
+        return True
+
+    def remove_source_plate(self):
+        """
+        Take the source plate off the deck.
+
+        :return: True if there was a source plate.
+        """
+        if self._source_plate_inputs is None:
+            return False
+        self.deck.remove_labware("source_plate")
+        self._source_plate_inputs = None
+        self._mark_changed(("grid", None))
+        return True
+
+    def has_source_plate(self):
+        return self._source_plate_inputs is not None
+
+    ########
+    # MULTI-CHANNEL
+    ########
+    def channel_block(self, labware_name, head, channel_offsets, tolerance=CHANNEL_TOLERANCE):
+        """
+        Get the slots under the channels of a multi-channel tool whose first channel is above `head`. The slots are
+        looked up by their coordinates, so blocks follow the geometry of the labware whatever its orientation.
+
+        :param labware_name: Name of the labware ("probes", "tips", ...).
+        :param head: (row, col) of the slot under the first channel.
+        :param channel_offsets: List of (dx, dy) of every channel relative to the first one (mm), the first is (0, 0).
+        :param tolerance: Largest distance (mm) between a channel and the center of its slot.
+        :return: List of (row, col), one per channel, or None if any channel is not above a slot of the labware.
+        """
+        x, y = self.deck.slot_coordinates(labware_name, head)
+        block = []
+        for dx, dy in channel_offsets:
+            found = self.deck.nearest_slot(x + dx, y + dy, labware_name=labware_name, max_distance=tolerance)
+            if found is None:
+                return None
+            block.append(found[1])
+        return block
+
+    def _next_block(self, labware_name, channel_offsets, is_free):
+        """
+        Find the first block (in slot order of its first channel) whose slots are all free.
+        """
+        for head in self.deck.get_labware(labware_name).slots:
+            if not is_free(head):
+                continue
+            block = self.channel_block(labware_name, head, channel_offsets)
+            if block is not None and all(is_free(position) for position in block):
+                return block
+        return None
+
+    def _probe_needs_liquid(self, position):
+        if self.tracks_volumes():
+            row, col = position
+            return self.target_volumes[row, col] - self.dispensed_volumes[row, col] > VOLUME_TOLERANCE
+        return not self.probes[position]["filled"]
+
+    def next_tip_block(self, channel_offsets):
+        """
+        Find the next set of tips a multi-channel tool can pick up at once.
+
+        :param channel_offsets: See channel_block.
+        :return: List of (row, col), one per channel, or None if no such set of available tips is left.
+        """
+        return self._next_block("tips", channel_offsets, lambda position: not self.tips[position]["taken"])
+
+    def next_probe_block(self, channel_offsets):
+        """
+        Find the next set of probes a multi-channel tool fills at once. Every probe of the set must still need liquid
+        (not filled, or below its target volume when volumes are tracked).
+
+        :param channel_offsets: See channel_block.
+        :return: List of (row, col), one per channel, or None if no such set is left.
+        """
+        return self._next_block("probes", channel_offsets, self._probe_needs_liquid)
+
+    def probe_blocks_per_aspiration(self, capacity, channel_offsets):
+        """
+        Plan which probe blocks a single aspiration of a multi-channel tool can serve, the multi-channel counterpart of
+        probes_per_aspiration. Every channel dispenses the same volume, the largest remaining volume of the block.
+
+        :param capacity: Volume of liquid aspirated at once by every channel (uL), see
+            EndEffectorController.liquid_capacity.
+        :param channel_offsets: See channel_block.
+        :return: List of tuples (block, volume), block = list of (row, col).
+        """
+        if capacity <= 0:
+            return []
+        plan = []
+        planned = set()
+        total = 0.0
+        remaining = self.target_volumes - self.dispensed_volumes
+        for head in self.probes:
+            if head in planned or not self._probe_needs_liquid(head):
+                continue
+            block = self.channel_block("probes", head, channel_offsets)
+            if block is None or planned.intersection(block) or \
+                    not all(self._probe_needs_liquid(position) for position in block):
+                continue
+            volume = min(max(float(remaining[row, col]) for row, col in block), capacity)
+            if plan and total + volume > capacity + VOLUME_TOLERANCE:
+                break
+            plan.append((block, volume))
+            planned.update(block)
+            total += volume
+        return plan
+
     def is_configured(self): # TODO -> add check for tip grid
         """
         Check if the grid has been configured.
@@ -244,7 +709,9 @@ class BedController:
         """
         if (row, column) not in self.tips:
             raise KeyError(f"No tip exists at position ({row}, {column}).")
-        self.tips[(row, column)]["taken"] = new_state
+        if self.tips[(row, column)]["taken"] != new_state:
+            self.tips[(row, column)]["taken"] = new_state
+            self._mark_changed(("tips", (row, column)))
 
     def get_tip_state(self, row, column):
         """
@@ -258,6 +725,27 @@ class BedController:
             raise KeyError(f"No tip exists at position ({row}, {column}).")
         return self.tips[(row, column)]["taken"]
 
+    def update_slot_state(self, labware_name, row, column, new_state):
+        """
+        Update the state of a slot of any labware on the deck (filled for plates, taken for tip racks).
+
+        :param labware_name: Name of the labware ("probes", "tips" or any additional deck labware).
+        :param row: Row index of the slot.
+        :param column: Column index of the slot.
+        :param new_state: New state for the slot.
+        """
+        if labware_name == "probes":
+            self.update_probe_state(row, column, new_state)
+        elif labware_name == "tips":
+            self.update_tip_state(row, column, new_state)
+        else:
+            labware = self.deck.get_labware(labware_name)
+            if (row, column) not in labware.slots:
+                raise KeyError(f"No slot exists at position ({row}, {column}) in labware '{labware_name}'.")
+            if labware.slots[(row, column)][labware.state_key] != new_state:
+                labware.slots[(row, column)][labware.state_key] = new_state
+                self._mark_changed((labware_name, (row, column)))
+
     def next_tip(self):
         """
         Find the next unfilled tip based on the grid layout.
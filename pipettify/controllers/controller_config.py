@@ -0,0 +1,357 @@
+# This file implements the typed configuration of the bed. The configuration is loaded straight from JSON (the same
+# layout the GUI has always exported, values may be strings or numbers), validated against a small schema and applied
+# to the BedController without any GUI. The GUI only shows and edits it.
+
+import json
+
+from pipettify.controllers.controller_liquid_class import DEFAULT_LIQUID_CLASS, LiquidClass, default_liquid_classes
+from pipettify.controllers.controller_slot_mask import SlotMask
+
+REQUIRED = object()  # Marker of fields without a default value
+
+GRID_CORNERS = ("top_left", "top_right", "bottom_left", "bottom_right")
+Z_HEIGHTS = ("safe_z", "dispensing_z", "change_tip_z", "drop_tip_z", "refilling_z")
+LIQUID_CLASS_SPEEDS = ("aspirate_speed", "dispense_speed")
+LIQUID_CLASS_AMOUNTS = ("air_gap", "pre_dwell", "post_dwell")
+CHANNEL_AXES = ("x", "y")
+
+
+class _Reader:
+    """
+    Reads typed values from the raw configuration dictionary and collects all errors, so the user sees every invalid
+    field at once instead of fixing them one by one.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.errors = []
+
+    def value(self, path):
+        """
+        Get the raw value of a field, or REQUIRED if it is missing.
+        """
+        return self._lookup(path)
+
+    def _lookup(self, path):
+        value = self.data
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                return REQUIRED
+            value = value[key]
+        return value
+
+    def number(self, path, kind=float, default=REQUIRED, minimum=None):
+        """
+        Read a number. Empty strings and missing fields use the default.
+
+        :param path: Dotted path of the field, e.g. "z_heights.safe_z".
+        :param kind: int or float.
+        :param minimum: Smallest allowed value.
+        """
+        value = self._lookup(path)
+        if value is REQUIRED or value is None or value == "":
+            if default is REQUIRED:
+                self.errors.append(f"{path}: missing value")
+            return default
+        try:
+            number = kind(float(value)) if kind is int else kind(value)
+            if kind is int and float(value) != number:
+                raise ValueError
+        except (TypeError, ValueError):
+            self.errors.append(f"{path}: expected {kind.__name__}, got {value!r}")
+            return default if default is not REQUIRED else kind(0)
+        if minimum is not None and number < minimum:
+            self.errors.append(f"{path}: must be at least {minimum}, got {number}")
+        return number
+
+    def boolean(self, path, default):
+        """
+        Read a true/false value. Missing fields use the default.
+        """
+        value = self._lookup(path)
+        if value is REQUIRED:
+            return default
+        if not isinstance(value, bool):
+            self.errors.append(f"{path}: expected true or false, got {value!r}")
+            return default
+        return value
+
+    def point(self, path):
+        """
+        Read an (x, y) point.
+        """
+        value = self._lookup(path)
+        if value is REQUIRED:
+            self.errors.append(f"{path}: missing value")
+            return (0.0, 0.0)
+        try:
+            if len(value) != 2:
+                raise ValueError
+            return float(value[0]), float(value[1])
+        except (TypeError, ValueError):
+            self.errors.append(f"{path}: expected [x, y], got {value!r}")
+            return (0.0, 0.0)
+
+
+class GridConfig:
+    """
+    Configuration of one grid (probes plate or tip rack).
+    """
+    def __init__(self, rows, columns, top_left, top_right, bottom_left, bottom_right, active_slots=None):
+        """
+        :param rows: Number of rows.
+        :param columns: Number of columns.
+        :param top_left: Tuple (x, y) of the top-left slot, the other corners likewise.
+        :param active_slots: Number of active slots (the first ones in row-major order), or text specification
+                             of the active slots mask (see SlotMask.parse), None = all slots.
+        """
+        self.rows = rows
+        self.columns = columns
+        self.top_left = top_left
+        self.top_right = top_right
+        self.bottom_left = bottom_left
+        self.bottom_right = bottom_right
+        self.active_slots = rows * columns if active_slots is None else active_slots
+
+    @classmethod
+    def _read(cls, reader, name, active_key):
+        rows = reader.number(f"{name}_rows", int, minimum=1)
+        columns = reader.number(f"{name}_columns", int, minimum=1)
+        corners = [reader.point(f"{name}.{corner}") for corner in GRID_CORNERS]
+        raw_active = reader.value(active_key)
+        if isinstance(raw_active, str) and raw_active.strip() and not raw_active.strip().isdigit():
+            # Mask specification, e.g. "A1:D6, !B2"
+            active_slots = raw_active.strip()
+            if rows > 0 and columns > 0:
+                try:
+                    SlotMask.parse(rows, columns, active_slots)
+                except ValueError as e:
+                    reader.errors.append(f"{active_key}: {e}")
+        else:
+            active_slots = reader.number(active_key, int, default=None, minimum=0)  # Empty = all slots
+            if active_slots is not None and rows > 0 and columns > 0 and active_slots > rows * columns:
+                reader.errors.append(f"{active_key}: {active_slots} active slots do not fit "
+                                     f"into {rows}x{columns} {name}")
+        return cls(rows, columns, *corners, active_slots=active_slots)
+
+    def mask(self):
+        """
+        Get the SlotMask of the active slots.
+        """
+        return SlotMask.parse(self.rows, self.columns, self.active_slots)
+
+    def corners_dict(self):
+        return {corner: list(getattr(self, corner)) for corner in GRID_CORNERS}
+
+    def __eq__(self, other):
+        return isinstance(other, GridConfig) and vars(self) == vars(other)
+
+
+def _read_liquid_classes(reader):
+    """
+    Read the "liquid_classes" field: {name: {aspirate_speed, dispense_speed, blow_out, air_gap, pre_dwell, post_dwell}}.
+    Missing parameters use the defaults of LiquidClass, the built-in classes are available unless overridden.
+    """
+    liquid_classes = default_liquid_classes()
+    raw = reader.value("liquid_classes")
+    if raw is REQUIRED:
+        return liquid_classes
+    if not isinstance(raw, dict):
+        reader.errors.append(f"liquid_classes: expected an object, got {raw!r}")
+        return liquid_classes
+    for name in raw:
+        path = f"liquid_classes.{name}"
+        liquid_classes[name] = LiquidClass(
+            name,
+            blow_out=reader.boolean(f"{path}.blow_out", True),
+            **{key: reader.number(f"{path}.{key}", default=500.0, minimum=1) for key in LIQUID_CLASS_SPEEDS},
+            **{key: reader.number(f"{path}.{key}", default=0.0, minimum=0) for key in LIQUID_CLASS_AMOUNTS})
+    return liquid_classes
+
+
+class BedConfig:
+    """
+    Typed configuration of the bed: probes, tips, tanks, Z heights, volumes and liquid classes.
+    """
+    def __init__(self, probes, tips, refilling_tank, disposal_tank, safe_z, dispensing_z, change_tip_z, drop_tip_z,
+                 refilling_z, bed_width=300.0, bed_height=300.0, probe_volume=0.0, nominal_volume=0.0,
+                 liquid_classes=None, liquid_class=DEFAULT_LIQUID_CLASS, channels=1, channel_pitch=9.0,
+                 channel_axis="y", source_plate=None):
+        """
+        :param probes: GridConfig of the probes.
+        :param tips: GridConfig of the tips.
+        :param refilling_tank: Tuple (x, y) of the refilling tank.
+        :param disposal_tank: Tuple (x, y) of the disposal tank.
+        :param probe_volume: Target volume of every active probe (uL), 0 = volumes are not tracked.
+        :param nominal_volume: Volume aspirated between neutral and half push (first stop) of the pipette (uL), not
+                               the blow-out volume of a full push, 0 = unknown.
+        :param liquid_classes: Dictionary {name: LiquidClass}, None = the built-in classes.
+        :param liquid_class: Name of the liquid class used for the run (worklist rows may override it).
+        :param channels: Number of channels of the pipette, >1 = multi-channel tool filling several probes per cycle.
+        :param channel_pitch: Distance between neighbouring channels (mm).
+        :param channel_axis: Deck axis the channels are lined up along ("x" or "y").
+        :param source_plate: Optional GridConfig of the source plate of plate-to-plate transfers, its active slots are
+                             the wells holding liquid.
+        """
+        self.bed_width = bed_width
+        self.bed_height = bed_height
+        self.probes = probes
+        self.tips = tips
+        self.refilling_tank = refilling_tank
+        self.disposal_tank = disposal_tank
+        self.safe_z = safe_z
+        self.dispensing_z = dispensing_z
+        self.change_tip_z = change_tip_z
+        self.drop_tip_z = drop_tip_z
+        self.refilling_z = refilling_z
+        self.probe_volume = probe_volume
+        self.nominal_volume = nominal_volume
+        self.liquid_classes = default_liquid_classes() if liquid_classes is None else liquid_classes
+        self.liquid_class = liquid_class
+        self.channels = channels
+        self.channel_pitch = channel_pitch
+        self.channel_axis = channel_axis
+        self.source_plate = source_plate
+
+    ############################
+    # LOADING / SAVING
+    ############################
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build the configuration from a dictionary in the exported JSON layout.
+
+        :raises ValueError: If any field is missing or invalid, listing all of them.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Invalid configuration: expected a JSON object")
+        reader = _Reader(data)
+        config = cls(probes=GridConfig._read(reader, "probes", "active_probe_slots"),
+                     tips=GridConfig._read(reader, "tips", "active_tip_slots"),
+                     refilling_tank=reader.point("refilling_tank"),
+                     disposal_tank=reader.point("disposal_tank"),
+                     bed_width=reader.number("bed_width", default=300.0, minimum=1),
+                     bed_height=reader.number("bed_height", default=300.0, minimum=1),
+                     probe_volume=reader.number("probe_volume", default=0.0, minimum=0),
+                     nominal_volume=reader.number("nominal_volume", default=0.0, minimum=0),
+                     liquid_classes=_read_liquid_classes(reader),
+                     liquid_class=data.get("liquid_class") or DEFAULT_LIQUID_CLASS,
+                     channels=reader.number("channels", kind=int, default=1, minimum=1),
+                     channel_pitch=reader.number("channel_pitch", default=9.0),
+                     channel_axis=data.get("channel_axis") or "y",
+                     source_plate=(GridConfig._read(reader, "source_plate", "active_source_plate_slots")
+                                   if reader.value("source_plate") is not REQUIRED else None),
+                     **{z: reader.number(f"z_heights.{z}") for z in Z_HEIGHTS})
+        if config.liquid_class not in config.liquid_classes:
+            reader.errors.append(f"liquid_class: unknown liquid class {config.liquid_class!r}")
+        if config.channel_axis not in CHANNEL_AXES:
+            reader.errors.append(f"channel_axis: expected one of {', '.join(CHANNEL_AXES)}, got {config.channel_axis!r}")
+        if config.channels > 1 and config.channel_pitch == 0:
+            reader.errors.append("channel_pitch: must not be 0 for a multi-channel pipette")
+        if reader.errors:
+            raise ValueError("Invalid configuration:\n" + "\n".join(f" - {error}" for error in reader.errors))
+        return config
+
+    @classmethod
+    def from_json_file(cls, path):
+        """
+        Load the configuration from a JSON file.
+        """
+        with open(path, "r") as file:
+            return cls.from_dict(json.load(file))
+
+    def to_dict(self):
+        """
+        Get the configuration in the exported JSON layout.
+        """
+        data = {
+            "bed_width": self.bed_width,
+            "bed_height": self.bed_height,
+            "probes_rows": self.probes.rows,
+            "probes_columns": self.probes.columns,
+            "probes": self.probes.corners_dict(),
+            "active_probe_slots": self.probes.active_slots,
+            "tips_rows": self.tips.rows,
+            "tips_columns": self.tips.columns,
+            "tips": self.tips.corners_dict(),
+            "active_tip_slots": self.tips.active_slots,
+            "refilling_tank": list(self.refilling_tank),
+            "disposal_tank": list(self.disposal_tank),
+            "z_heights": {z: getattr(self, z) for z in Z_HEIGHTS},
+            "probe_volume": self.probe_volume,
+            "nominal_volume": self.nominal_volume,
+            "liquid_classes": {name: liquid_class.to_dict() for name, liquid_class in self.liquid_classes.items()},
+            "liquid_class": self.liquid_class,
+            "channels": self.channels,
+            "channel_pitch": self.channel_pitch,
+            "channel_axis": self.channel_axis,
+        }
+        if self.source_plate is not None:
+            data.update({
+                "source_plate_rows": self.source_plate.rows,
+                "source_plate_columns": self.source_plate.columns,
+                "source_plate": self.source_plate.corners_dict(),
+                "active_source_plate_slots": self.source_plate.active_slots,
+            })
+        return data
+
+    def to_json_file(self, path):
+        """
+        Save the configuration to a JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+    ############################
+    # APPLYING
+    ############################
+
+    def grid_parameters(self):
+        """
+        Get keyword arguments of BedController.make_new_grid.
+        """
+        parameters = {
+            "refilling_tank": self.refilling_tank,
+            "disposal_tank": self.disposal_tank,
+            "probes_number": len(self.probes.mask()),
+            "tips_number": len(self.tips.mask()),
+            "probes_mask": self.probes.mask(),
+            "tips_mask": self.tips.mask(),
+            **{z: getattr(self, z) for z in Z_HEIGHTS},
+        }
+        for name, grid in (("probes", self.probes), ("tips", self.tips)):
+            parameters[f"{name}_rows"] = grid.rows
+            parameters[f"{name}_columns"] = grid.columns
+            for corner in GRID_CORNERS:
+                parameters[f"{name}_{corner}"] = getattr(grid, corner)
+        return parameters
+
+    def apply_to(self, bed_controller, tool_controller=None):
+        """
+        Build the grids of the bed controller (and set the pipette volume of the tool controller) from the configuration.
+        Only what changed since the last apply is rebuilt, filled/taken states are kept.
+
+        :param bed_controller: BedController to configure.
+        :param tool_controller: Optional EndEffectorController.
+        :return: Set of what changed, see BedController.make_new_grid, and "source_plate".
+        """
+        bed_controller.probe_volume = self.probe_volume
+        changed = bed_controller.make_new_grid(**self.grid_parameters())
+        if self.source_plate is not None:
+            plate = self.source_plate
+            if bed_controller.set_source_plate(plate.rows, plate.columns, plate.top_left, plate.top_right,
+                                               plate.bottom_left, plate.bottom_right, plate.mask()):
+                changed.add("source_plate")
+        elif bed_controller.remove_source_plate():
+            changed.add("source_plate")
+        if tool_controller is not None:
+            tool_controller.nominal_volume = self.nominal_volume
+            tool_controller.liquid_classes = self.liquid_classes
+            tool_controller.liquid_class = self.liquid_classes[self.liquid_class]
+            tool_controller.channels = self.channels
+            tool_controller.channel_pitch = self.channel_pitch
+            tool_controller.channel_axis = self.channel_axis
+        return changed
+
+    def __eq__(self, other):
+        return isinstance(other, BedConfig) and vars(self) == vars(other)
@@ -0,0 +1,483 @@
+# This file implements the deck model. The deck is a set of labware instances (probe plates, tip racks, reservoirs,
+# disposal tanks) placed on the printer bed, each one with its own grid of slots. All slots are kept in a spatial index
+# (uniform grid hash) so that we can quickly find the nearest slot, check which slot was clicked on the GUI canvas and
+# check if something collides with the labware, even for a full deck of high-density plates.
+
+import math
+
+# Row letters used for slot names ("A1", "B12", "AA3" for plates with more than 26 rows)
+ROW_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def slot_name(row, column):
+    """
+    Convert slot position to its human readable name, e.g. (0, 0) -> "A1", (1, 11) -> "B12".
+
+    :param row: Row index of the slot.
+    :param column: Column index of the slot.
+    :return: Name of the slot.
+    """
+    letters = ""
+    row += 1
+    while row > 0:
+        row, remainder = divmod(row - 1, len(ROW_LETTERS))
+        letters = ROW_LETTERS[remainder] + letters
+    return f"{letters}{column + 1}"
+
+
+def parse_slot_name(name):
+    """
+    Convert slot name to its position, e.g. "A1" -> (0, 0), "B12" -> (1, 11).
+
+    :param name: Name of the slot.
+    :return: Tuple (row, column) of the slot.
+    """
+    name = name.strip().upper()
+    split = 0
+    while split < len(name) and name[split] in ROW_LETTERS:
+        split += 1
+    if split == 0 or split == len(name) or not name[split:].isdigit():
+        raise ValueError(f"Invalid slot name: {name}")
+
+    row = 0
+    for letter in name[:split]:
+        row = row * len(ROW_LETTERS) + ROW_LETTERS.index(letter) + 1
+    column = int(name[split:])
+    if column < 1:
+        raise ValueError(f"Invalid slot name: {name}")
+    return row - 1, column - 1
+
+
+def calculate_grid_coordinates(grid, top_left, top_right, bottom_left, bottom_right, rows, columns):
+    """
+    Calculate coordinates for all slots in an irregular grid.
+    The slots are evenly distributed within the quadrilateral defined by the four corners.
+    """
+    # Extract corner coordinates
+    top_left_x, top_left_y = top_left
+    top_right_x, top_right_y = top_right
+    bottom_left_x, bottom_left_y = bottom_left
+    bottom_right_x, bottom_right_y = bottom_right
+
+    for row in range(rows):
+        for col in range(columns):
+            # Calculate interpolation factors
+            t = row / (rows - 1) if rows > 1 else 0
+            u = col / (columns - 1) if columns > 1 else 0
+
+            # Interpolate top edge
+            top_x = top_left_x + u * (top_right_x - top_left_x)
+            top_y = top_left_y + u * (top_right_y - top_left_y)
+
+            # Interpolate bottom edge
+            bottom_x = bottom_left_x + u * (bottom_right_x - bottom_left_x)
+            bottom_y = bottom_left_y + u * (bottom_right_y - bottom_left_y)
+
+            # Interpolate between top and bottom edges
+            slot_x = top_x + t * (bottom_x - top_x)
+            slot_y = top_y + t * (bottom_y - top_y)
+
+            # Assign the calculated coordinates to the slot
+            if (row, col) in grid:
+                grid[(row, col)]["coordinates"] = (slot_x, slot_y)
+
+
+class Labware:
+    """
+    Single piece of labware placed on the deck.
+    1. Kind of the labware ("plate", "tip_rack", "reservoir", "disposal")
+    2. Grid of slots with their coordinates and state
+    3. Diameter of a single slot, used for hit-testing and collision checks
+    """
+    def __init__(self,
+                 name,
+                 kind,
+                 rows,
+                 columns,
+                 top_left,
+                 top_right,
+                 bottom_left,
+                 bottom_right,
+                 slot_diameter,
+                 state_key="filled",
+                 slots=None):
+        """
+        Create labware and calculate the coordinates of its slots.
+
+        :param name: Unique name of the labware on the deck.
+        :param kind: Kind of the labware ("plate", "tip_rack", "reservoir", "disposal").
+        :param rows: Number of rows in the grid.
+        :param columns: Number of columns in the grid.
+        :param top_left: Tuple (x, y) of the top-left slot coordinates.
+        :param top_right: Tuple (x, y) of the top-right slot coordinates.
+        :param bottom_left: Tuple (x, y) of the bottom-left slot coordinates.
+        :param bottom_right: Tuple (x, y) of the bottom-right slot coordinates.
+        :param slot_diameter: Diameter of a single slot (mm).
+        :param state_key: Name of the state flag stored for each slot ("filled" for plates, "taken" for tips).
+        :param slots: Already computed slots dictionary to share (e.g. BedController.probes). If None, all
+                      slots of the grid are created and their coordinates are calculated.
+        """
+        self.name = name
+        self.kind = kind
+        self.rows = rows
+        self.columns = columns
+        self.top_left = top_left
+        self.top_right = top_right
+        self.bottom_left = bottom_left
+        self.bottom_right = bottom_right
+        self.slot_diameter = slot_diameter
+        self.state_key = state_key
+
+        if slots is None:
+            slots = {}
+            for row in range(rows):
+                for col in range(columns):
+                    slots[(row, col)] = {state_key: False, "coordinates": None}
+            calculate_grid_coordinates(slots, top_left, top_right, bottom_left, bottom_right, rows, columns)
+        self.slots = slots  # Dictionary to store slot states: {(row, col): {state_key: False, "coordinates": (x, y)}}
+
+    def slot_coordinates(self, position):
+        """
+        Get coordinates of a specific slot.
+
+        :param position: Tuple (row, column) of the slot.
+        :return: Tuple (x, y) of the slot coordinates.
+        """
+        if position not in self.slots:
+            raise KeyError(f"No slot exists at position {position} in labware '{self.name}'.")
+        return self.slots[position]["coordinates"]
+
+    def geometry_signature(self):
+        """
+        Get everything the slot centres and sizes depend on. Two labware with equal signatures occupy the same places.
+        """
+        return (self.rows, self.columns,
+                tuple(tuple(corner) for corner in (self.top_left, self.top_right, self.bottom_left, self.bottom_right)),
+                self.slot_diameter, tuple(self.slots))
+
+    def bounding_box(self):
+        """
+        Get the bounding box of all slots, including their diameter.
+
+        :return: Tuple (min_x, min_y, max_x, max_y), or None if the labware has no slots.
+        """
+        coordinates = [slot["coordinates"] for slot in self.slots.values() if slot["coordinates"] is not None]
+        if not coordinates:
+            return None
+        radius = self.slot_diameter / 2
+        return (min(x for x, _ in coordinates) - radius,
+                min(y for _, y in coordinates) - radius,
+                max(x for x, _ in coordinates) + radius,
+                max(y for _, y in coordinates) + radius)
+
+
+class SpatialIndex:
+    """
+    Uniform grid hash over slot centres.
+    The bed is split into square cells of `cell_size` mm, each cell keeps the slots whose centre falls into it.
+    Lookups only visit cells around the query point, so their cost does not depend on the number of slots on the deck.
+    """
+    def __init__(self, cell_size=10.0):
+        """
+        :param cell_size: Size of a single cell (mm). Something close to the slot pitch works best.
+        """
+        self.cell_size = cell_size
+        self.cells = {}  # {(cell_x, cell_y): [(x, y, radius, key), ...]}
+        self.entries = {}  # {key: (x, y, radius)}, key is a tuple (labware_name, (row, col))
+        self.max_radius = 0.0
+        self.bounds = None  # (min_cell_x, min_cell_y, max_cell_x, max_cell_y)
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def insert(self, key, x, y, radius):
+        """
+        Insert a slot into the index.
+
+        :param key: Unique key of the slot, (labware_name, (row, col)).
+        :param x: X coordinate of the slot centre.
+        :param y: Y coordinate of the slot centre.
+        :param radius: Radius of the slot.
+        """
+        if key in self.entries:
+            self.remove(key)
+        cell = self._cell(x, y)
+        self.cells.setdefault(cell, []).append((x, y, radius, key))
+        self.entries[key] = (x, y, radius)
+        self.max_radius = max(self.max_radius, radius)
+        if self.bounds is None:
+            self.bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            self.bounds = (min(self.bounds[0], cell[0]), min(self.bounds[1], cell[1]),
+                           max(self.bounds[2], cell[0]), max(self.bounds[3], cell[1]))
+
+    def insert_many(self, items):
+        """
+        Insert many slots at once, bounds and radius are updated only once.
+
+        :param items: Iterable of tuples (key, x, y, radius).
+        """
+        items = list(items)
+        self.remove_many(key for key, _, _, _ in items if key in self.entries)
+        if not items:
+            return
+        cells = self.cells
+        entries = self.entries
+        size = self.cell_size
+        floor = math.floor
+        cell_xs = []
+        cell_ys = []
+        for key, x, y, radius in items:
+            cell = (floor(x / size), floor(y / size))
+            bucket = cells.get(cell)
+            if bucket is None:
+                cells[cell] = [(x, y, radius, key)]
+            else:
+                bucket.append((x, y, radius, key))
+            entries[key] = (x, y, radius)
+            cell_xs.append(cell[0])
+            cell_ys.append(cell[1])
+        self.max_radius = max(self.max_radius, max(item[3] for item in items))
+        bounds = (min(cell_xs), min(cell_ys), max(cell_xs), max(cell_ys))
+        if self.bounds is not None:
+            bounds = (min(self.bounds[0], bounds[0]), min(self.bounds[1], bounds[1]),
+                      max(self.bounds[2], bounds[2]), max(self.bounds[3], bounds[3]))
+        self.bounds = bounds
+
+    def remove(self, key):
+        """
+        Remove a slot from the index. Unknown keys are ignored.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        cell = self._cell(entry[0], entry[1])
+        bucket = self.cells.get(cell, [])
+        bucket[:] = [item for item in bucket if item[3] != key]
+        if not bucket:
+            self.cells.pop(cell, None)
+
+    def remove_many(self, keys):
+        """
+        Remove many slots at once, every affected cell is filtered only once. Unknown keys are ignored.
+        """
+        removed = {}  # {cell: set of keys}
+        for key in keys:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                removed.setdefault(self._cell(entry[0], entry[1]), set()).add(key)
+        for cell, cell_keys in removed.items():
+            bucket = [item for item in self.cells.get(cell, ()) if item[3] not in cell_keys]
+            if bucket:
+                self.cells[cell] = bucket
+            else:
+                self.cells.pop(cell, None)
+
+    def query_radius(self, x, y, radius):
+        """
+        Find all slots whose centre is within `radius` of the given point.
+
+        :return: List of tuples (distance, key), sorted by distance.
+        """
+        found = []
+        min_cell_x, min_cell_y = self._cell(x - radius, y - radius)
+        max_cell_x, max_cell_y = self._cell(x + radius, y + radius)
+        for cell_x in range(min_cell_x, max_cell_x + 1):
+            for cell_y in range(min_cell_y, max_cell_y + 1):
+                for slot_x, slot_y, _, key in self.cells.get((cell_x, cell_y), ()):
+                    distance = math.hypot(slot_x - x, slot_y - y)
+                    if distance <= radius:
+                        found.append((distance, key))
+        found.sort()
+        return found
+
+    def nearest(self, x, y, max_distance=None, predicate=None):
+        """
+        Find the slot closest to the given point. Cells are visited in growing rings around the point,
+        the search stops as soon as no unvisited cell can contain a closer slot.
+
+        :param max_distance: Ignore slots further away than this distance (mm).
+        :param predicate: Optional function predicate(key) -> bool, slots for which it returns False are skipped.
+        :return: Tuple (distance, key) of the nearest slot, or None if nothing was found.
+        """
+        if self.bounds is None:
+            return None
+        center_x, center_y = self._cell(x, y)
+        # Number of rings needed to cover the whole index from the query point
+        max_ring = max(abs(center_x - self.bounds[0]), abs(center_x - self.bounds[2]),
+                       abs(center_y - self.bounds[1]), abs(center_y - self.bounds[3]))
+        if max_distance is not None:
+            max_ring = min(max_ring, int(math.ceil(max_distance / self.cell_size)) + 1)
+
+        best = None
+        for ring in range(max_ring + 1):
+            for cell_x in range(center_x - ring, center_x + ring + 1):
+                for cell_y in range(center_y - ring, center_y + ring + 1):
+                    if max(abs(cell_x - center_x), abs(cell_y - center_y)) != ring:
+                        continue  # Only the border of the ring, inner cells were already visited
+                    for slot_x, slot_y, _, key in self.cells.get((cell_x, cell_y), ()):
+                        if predicate is not None and not predicate(key):
+                            continue
+                        distance = math.hypot(slot_x - x, slot_y - y)
+                        if max_distance is not None and distance > max_distance:
+                            continue
+                        if best is None or distance < best[0]:
+                            best = (distance, key)
+            # Every slot in the next ring is at least `ring * cell_size` away from the query point
+            if best is not None and best[0] <= ring * self.cell_size:
+                break
+        return best
+
+    def hit_test(self, x, y):
+        """
+        Find the slot whose circle contains the given point.
+
+        :return: Key of the slot, or None if the point is not inside any slot.
+        """
+        for distance, key in self.query_radius(x, y, self.max_radius):
+            if distance <= self.entries[key][2]:
+                return key
+        return None
+
+    def collisions(self, x, y, radius):
+        """
+        Find all slots whose circle overlaps a circle of `radius` around the given point.
+
+        :return: List of keys of the colliding slots, closest first.
+        """
+        return [key for distance, key in self.query_radius(x, y, radius + self.max_radius)
+                if distance < radius + self.entries[key][2]]
+
+
+class DeckController:
+    """
+    Class containing everything placed on the deck.
+    1. Labware instances (plates, tip racks, reservoirs) with their own grids
+    2. Spatial index of all slots for nearest-slot lookups, hit-testing and collision checks
+    """
+    def __init__(self, cell_size=10.0):
+        """
+        Initialize an empty deck.
+
+        :param cell_size: Cell size of the spatial index (mm).
+        """
+        self.labware = {}  # Dictionary to store labware: {name: Labware}
+        self.index = SpatialIndex(cell_size)
+
+    def add_labware(self, labware, check_collisions=True):
+        """
+        Place labware on the deck. Labware with the same name is replaced.
+
+        :param labware: Labware to place.
+        :param check_collisions: If True, raise ValueError when any slot overlaps slots of other labware.
+        """
+        previous = self.labware.get(labware.name)
+        if previous is not None and previous.geometry_signature() == labware.geometry_signature():
+            # Same slots in the same places, the index entries stay valid
+            self.labware[labware.name] = labware
+            return
+        if previous is not None:
+            self.remove_labware(labware.name)
+
+        if check_collisions:
+            radius = labware.slot_diameter / 2
+            for slot in labware.slots.values():
+                x, y = slot["coordinates"]
+                colliding = self.index.collisions(x, y, radius)
+                if colliding:
+                    other_name, other_position = colliding[0]
+                    raise ValueError(f"Labware '{labware.name}' collides with slot "
+                                     f"{slot_name(*other_position)} of labware '{other_name}'.")
+
+        self.labware[labware.name] = labware
+        self._index_labware(labware)
+
+    def remove_labware(self, name):
+        """
+        Remove labware from the deck.
+
+        :param name: Name of the labware.
+        """
+        labware = self.get_labware(name)
+        self.index.remove_many((name, position) for position in labware.slots)
+        del self.labware[name]
+
+    def get_labware(self, name):
+        """
+        Get labware by its name.
+        """
+        if name not in self.labware:
+            raise KeyError(f"No labware named '{name}' on the deck.")
+        return self.labware[name]
+
+    def labware_of_kind(self, kind):
+        """
+        Get all labware of the given kind, in the order they were placed on the deck.
+        """
+        return [labware for labware in self.labware.values() if labware.kind == kind]
+
+    def reindex_labware(self, name):
+        """
+        Update the spatial index after slot coordinates of the labware have changed.
+        """
+        labware = self.get_labware(name)
+        self.index.remove_many((name, position) for position in labware.slots)
+        self._index_labware(labware)
+
+    def _index_labware(self, labware):
+        radius = labware.slot_diameter / 2
+        self.index.insert_many(((labware.name, position), slot["coordinates"][0], slot["coordinates"][1], radius)
+                               for position, slot in labware.slots.items() if slot["coordinates"] is not None)
+
+    def nearest_slot(self, x, y, kind=None, labware_name=None, free_only=False, max_distance=None):
+        """
+        Find the slot closest to the given point.
+
+        :param kind: Only consider labware of this kind.
+        :param labware_name: Only consider slots of this labware.
+        :param free_only: Only consider slots whose state flag is False (not filled / not taken).
+        :param max_distance: Ignore slots further away than this distance (mm).
+        :return: Tuple (labware_name, (row, col)), or None if nothing was found.
+        """
+        def predicate(key):
+            labware = self.labware[key[0]]
+            if kind is not None and labware.kind != kind:
+                return False
+            if labware_name is not None and labware.name != labware_name:
+                return False
+            if free_only and labware.slots[key[1]][labware.state_key]:
+                return False
+            return True
+
+        result = self.index.nearest(x, y, max_distance=max_distance, predicate=predicate)
+        return result[1] if result is not None else None
+
+    def slot_at(self, x, y):
+        """
+        Find the slot under the given point, e.g. the one clicked on the GUI canvas.
+
+        :return: Tuple (labware_name, (row, col)), or None if there is no slot under the point.
+        """
+        return self.index.hit_test(x, y)
+
+    def collisions(self, x, y, radius, ignore=None):
+        """
+        Check which slots would be hit by a round object (e.g. the tool) placed at the given point.
+
+        :param radius: Radius of the object (mm).
+        :param ignore: Optional collection of labware names to ignore.
+        :return: List of tuples (labware_name, (row, col)) of colliding slots, closest first.
+        """
+        colliding = self.index.collisions(x, y, radius)
+        if ignore:
+            colliding = [key for key in colliding if key[0] not in ignore]
+        return colliding
+
+    def slot_coordinates(self, labware_name, position):
+        """
+        Get coordinates of a slot of the given labware.
+        """
+        return self.get_labware(labware_name).slot_coordinates(position)
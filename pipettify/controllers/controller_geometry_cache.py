@@ -0,0 +1,138 @@
+# This file implements an on-disk cache of computed grid geometry (slot positions in route order and their
+# coordinates). Entries are content-addressed: the file name is the SHA-256 of the normalised geometry inputs (grid size,
+# corners, mask of active slots and the version of the calculation), so any change of the inputs gives a different
+# entry and stale geometry is never used. Known layouts are read from .npy files instead of being recalculated.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from pipettify.telemetry.telemetry_logging import get_logger
+
+logger = get_logger("controller_geometry_cache")
+
+GEOMETRY_VERSION = 2  # Increase when the geometry calculation changes, old entries are then ignored
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pipettify", "geometry")
+
+
+def geometry_key(rows, columns, corners, mask):
+    """
+    Get the cache key of a grid.
+
+    :param rows: Number of rows.
+    :param columns: Number of columns.
+    :param corners: Tuple of (x, y) corners: top-left, top-right, bottom-left, bottom-right.
+    :param mask: SlotMask of the active slots.
+    :return: Hex digest of the normalised inputs.
+    """
+    normalised = {
+        "version": GEOMETRY_VERSION,
+        "rows": int(rows),
+        "columns": int(columns),
+        "corners": [[round(float(x), 6), round(float(y), 6)] for x, y in corners],
+        "mask": format(mask.bits, "x"),
+    }
+    text = json.dumps(normalised, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compute_grid_geometry(rows, columns, corners, mask):
+    """
+    Calculate the active slots of a grid, evenly distributed within the quadrilateral defined by the four corners.
+
+    :param mask: SlotMask of the active slots.
+    :return: Array of shape (active slots, 4) with rows (row, col, x, y) in route (row-major) order.
+    """
+    (top_left_x, top_left_y), (top_right_x, top_right_y), \
+        (bottom_left_x, bottom_left_y), (bottom_right_x, bottom_right_y) = corners
+    positions = np.array(list(mask), dtype=float).reshape(-1, 2)
+    row = positions[:, 0]
+    col = positions[:, 1]
+    t = row / (rows - 1) if rows > 1 else np.zeros(len(positions))
+    u = col / (columns - 1) if columns > 1 else np.zeros(len(positions))
+
+    top_x = top_left_x + u * (top_right_x - top_left_x)
+    top_y = top_left_y + u * (top_right_y - top_left_y)
+    bottom_x = bottom_left_x + u * (bottom_right_x - bottom_left_x)
+    bottom_y = bottom_left_y + u * (bottom_right_y - bottom_left_y)
+    return np.column_stack((row, col, top_x + t * (bottom_x - top_x), top_y + t * (bottom_y - top_y)))
+
+
+class GeometryCache:
+    """
+    Content-addressed cache of grid geometry, kept in memory and on disk.
+    """
+    def __init__(self, directory=None):
+        """
+        :param directory: Directory of the cache files. Defaults to $PIPETTIFY_CACHE_DIR or ~/.cache/pipettify/geometry.
+        """
+        self.directory = directory or os.environ.get("PIPETTIFY_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.memory = {}  # {key: array} of entries used in this session
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def load(self, key):
+        """
+        Get a cached entry (read from disk on first use), or None if it is not cached.
+        """
+        if key in self.memory:
+            return self.memory[key]
+        try:
+            array = np.load(self.path(key))
+        except (OSError, ValueError):
+            return None
+        if array.ndim != 2 or array.shape[1] != 4:
+            return None  # Damaged entry, will be overwritten
+        self.memory[key] = array
+        return array
+
+    def store(self, key, array):
+        """
+        Save an entry. The cache is only an optimisation, so failures are reported but not raised.
+        """
+        self.memory[key] = array
+        temporary_path = self.path(key) + f".{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary_path, "wb") as file:
+                np.save(file, array)
+            os.replace(temporary_path, self.path(key))  # Atomic, readers never see a half-written entry
+        except OSError as e:
+            logger.warning("Could not write geometry cache entry %s: %s", key, e)
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+
+    def grid_geometry(self, rows, columns, corners, mask):
+        """
+        Get the geometry of a grid, calculating and caching it if it is not cached yet.
+
+        :param mask: SlotMask of the active slots.
+        :return: Array of shape (active slots, 4) with rows (row, col, x, y) in route order.
+        """
+        key = geometry_key(rows, columns, corners, mask)
+        array = self.load(key)
+        if array is not None:
+            self.hits += 1
+            return array
+        self.misses += 1
+        array = compute_grid_geometry(rows, columns, corners, mask)
+        self.store(key, array)
+        return array
+
+    def clear(self):
+        """
+        Remove all entries from memory and disk.
+        """
+        self.memory.clear()
+        if not os.path.isdir(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".npy"):
+                os.remove(os.path.join(self.directory, file_name))
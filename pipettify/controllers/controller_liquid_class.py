@@ -0,0 +1,52 @@
+# This file implements liquid classes - named sets of pipetting parameters (plunger speeds, blow-out, air gap and dwell
+# times). Water-like reagents can run at the maximum plunger speed without waiting, viscous ones are aspirated slowly
+# and given time to settle before the tip leaves the liquid. Classes are stored in the configuration; the
+# EndEffectorController applies the speeds and the state machine the dwell times.
+
+DEFAULT_LIQUID_CLASS = "default"
+
+
+class LiquidClass:
+    """
+    Pipetting parameters of one kind of liquid.
+    """
+    def __init__(self, name, aspirate_speed=500.0, dispense_speed=500.0, blow_out=True, air_gap=0.0,
+                 pre_dwell=0.0, post_dwell=0.0):
+        """
+        :param name: Name of the class, e.g. "water" or "glycerol".
+        :param aspirate_speed: Plunger speed while aspirating (mm/min).
+        :param dispense_speed: Plunger speed while dispensing (mm/min).
+        :param blow_out: Push to the second stop when dispensing (full push). False stops at the first stop.
+        :param air_gap: Volume of air (uL) aspirated before the liquid, 0 = no air gap.
+        :param pre_dwell: Wait (s) above the liquid before the tip moves down.
+        :param post_dwell: Wait (s) after aspirating/dispensing before the tip moves up.
+        """
+        self.name = name
+        self.aspirate_speed = aspirate_speed
+        self.dispense_speed = dispense_speed
+        self.blow_out = blow_out
+        self.air_gap = air_gap
+        self.pre_dwell = pre_dwell
+        self.post_dwell = post_dwell
+
+    def to_dict(self):
+        return {key: value for key, value in vars(self).items() if key != "name"}
+
+    def __eq__(self, other):
+        return isinstance(other, LiquidClass) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"LiquidClass({self.name!r})"
+
+
+def default_liquid_classes():
+    """
+    Get the built-in liquid classes. "default" keeps the old behaviour (F500, full push, no waiting).
+
+    :return: Dictionary {name: LiquidClass}.
+    """
+    return {
+        DEFAULT_LIQUID_CLASS: LiquidClass(DEFAULT_LIQUID_CLASS),
+        "water": LiquidClass("water", aspirate_speed=1500.0, dispense_speed=1500.0),
+        "viscous": LiquidClass("viscous", aspirate_speed=100.0, dispense_speed=150.0, pre_dwell=0.5, post_dwell=2.0),
+    }
@@ -1,8 +1,16 @@
-import serial
+import contextlib
 import time
 
 from pipettify.controllers.controller_tool import EndEffectorController
 from pipettify.controllers.controller_bed import BedController
+from pipettify.controllers.controller_serial_framing import CommandOutbox, LineBuffer
+from pipettify.controllers.controller_serial_log import SerialRecorder
+from pipettify.controllers.motion_model import MotionEstimator
+from pipettify.telemetry.telemetry_logging import get_logger
+from pipettify.telemetry.telemetry_metrics import NULL_METRICS
+from pipettify.telemetry.telemetry_tracing import NULL_TRACER
+
+logger = get_logger("controller_printer")
 
 class PrinterController:
     """
@@ -12,83 +20,303 @@ class PrinterController:
         self.bed_controller = BedController()
         self.tool_controller = EndEffectorController(send_gcode_func = self.send_gcode,
                                                      update_current_coordinates=self.update_current_coordinates,
-                                                     bed_controller = self.bed_controller)
+                                                     wait_for_moves=self.wait_for_moves,
+                                                     bed_controller = self.bed_controller,
+                                                     burst=self.burst)
         self.curr_x = None
         self.curr_y = None
         self.curr_z = None
         self.max_speed = 12000
         self.max_speed_z = 1000
+        self.acceleration = 1000  # mm/s^2, used for dead reckoning of the toolhead position
+        # Speed limits of the firmware (mm/min) per axis, Z moves run much slower than requested
+        self.machine_max_feedrates = (18000, 18000, 1200)
+        self.motion = MotionEstimator(acceleration=self.acceleration, max_feedrates=self.machine_max_feedrates)
+        self.last_target = None  # (x, y, z) of the last move written, a repeated move is not written again
+        self.last_move_deadline = None  # Clock time after which the last move is written again if not arrived
+        self.move_resend_margin = 10.0  # s after the predicted end of a move before it counts as lost
         self.serial = None
+        # Commands coalesced into bursts, at most a receive buffer in flight, see controller_serial_framing
+        self.outbox = CommandOutbox(make_room=self._make_room)
+        self.input_buffer = LineBuffer()  # Received bytes framed into lines
+        self.clock = time.monotonic  # Time source of all waits, replaced by a virtual clock in simulations
+        self.sleep = time.sleep
+        self.tracer = NULL_TRACER  # Records serial commands and plunger moves, see use_tracer
+        self.metrics = NULL_METRICS  # Counts commands, latencies and timeouts, see use_metrics
+
+    def use_clock(self, clock, sleep):
+        """
+        Use another time source for all waits and estimates (printer, tool and their motion estimators).
+
+        :param clock: Function returning the current time (s).
+        :param sleep: Function blocking for the given time (s).
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.motion.clock = clock
+        self.tool_controller.clock = clock
+        self.tool_controller.sleep = sleep
+        self.tool_controller.motion.clock = clock
+
+    def use_tracer(self, tracer):
+        """
+        Record the serial commands (and the plunger moves of the tool) with the tracer.
+
+        :param tracer: telemetry_tracing.Tracer.
+        """
+        self.tracer = tracer
+        self.tool_controller.tracer = tracer
 
-    def configure_serial_connection(self, port='/dev/ttyUSB0', baudrate=115200):
+    def use_metrics(self, metrics):
         """
-        Connect to printer using Serial interface
+        Report serial latencies, timeouts and refills into the metrics and expose the bed state with them.
+
+        :param metrics: telemetry_metrics.RunMetrics.
+        """
+        self.metrics = metrics
+        self.tool_controller.metrics = metrics
+        metrics.watch(self)
+
+    def configure_serial_connection(self, port='/dev/ttyUSB0', baudrate=115200, ready_timeout=10.0, record_path=None):
+        """
+        Connect to printer using Serial interface and wait until the firmware answers.
         If Serial object cannot be set, yeild an error.
+
+        :param ready_timeout: How long to wait for the firmware to answer (s).
+        :param record_path: Record all serial traffic (from the readiness handshake on) into this file, see
+            record_serial. None = no recording.
+        :return: True if the firmware answered within the timeout.
         """
+        import serial  # Imported here, so the rest of the controller can be used without pyserial
+
         ser = serial.Serial(port, baudrate, timeout=0)
-        time.sleep(2)
         if ser is None:
             raise Exception('Serial connection could not be established.')
 
-        print(f"Serial connection established on port {port} with baudrate {baudrate}")
+        logger.info("Serial connection established on port %s with baudrate %s", port, baudrate)
         self.serial = ser
+        if record_path:
+            self.record_serial(record_path)
+        ready = self.wait_until_ready(timeout=ready_timeout)
+        if not ready:
+            logger.warning("Printer did not answer within %s s, continuing anyway.", ready_timeout)
+            self.metrics.count_timeout("ready")
+        return ready
+
+    def record_serial(self, path):
+        """
+        Record every byte sent to and received from the printer, with timestamps, into a binary log that
+        controller_serial_log.ReplaySerial can replay.
+
+        :param path: File of the log.
+        """
+        self.serial = SerialRecorder(self.serial, path, clock=self.clock)
+        logger.info("Recording serial traffic to %s", path)
+
+    def wait_until_ready(self, timeout=10.0, probe_interval=0.25, quiet_time=0.05):
+        """
+        Readiness handshake. Opening the port usually resets the board and the firmware ignores commands while it
+        boots, so M115 is sent every `probe_interval` until the first "ok" arrives. Answers to the extra probes are
+        drained afterwards, so they are not mistaken for answers to later commands.
+
+        :param timeout: How long to wait for the firmware (s).
+        :param probe_interval: Time between two M115 probes (s).
+        :param quiet_time: How long the line has to stay silent after "ok" before the input is flushed (s).
+        :return: True if the firmware answered within the timeout.
+        """
+        deadline = self.clock() + timeout
+        next_probe = 0.0
+        buffer = b""
+        while self.clock() < deadline:
+            now = self.clock()
+            if now >= next_probe:
+                self.serial.write(b'M115\n')
+                next_probe = now + probe_interval
+
+            waiting = self.serial.in_waiting
+            if not waiting:
+                self.sleep(0.01)
+                continue
+            buffer += self.serial.read(waiting)
+            *lines, buffer = buffer.split(b'\n')
+            if any(line.strip().startswith(b'ok') for line in lines):
+                break
+        else:
+            return False
+
+        # Drain the rest of the answers
+        quiet_since = self.clock()
+        drain_deadline = quiet_since + probe_interval + 1.0
+        while self.clock() - quiet_since < quiet_time and self.clock() < drain_deadline:
+            if self.serial.in_waiting:
+                self.serial.read(self.serial.in_waiting)
+                quiet_since = self.clock()
+            else:
+                self.sleep(0.005)
+        self._resync()
+        self.last_target = None  # The board may have been reset by connecting
+        return True
+
+    @contextlib.contextmanager
+    def burst(self):
+        """
+        Coalesce the commands sent inside the block into as few writes as the firmware receive buffer allows, written
+        when the block ends (or earlier with a query). Blocks can be nested.
+        """
+        self.outbox.begin()
+        try:
+            yield
+        finally:
+            self.outbox.end(self.serial)
 
     def send_gcode(self, command):
         """
-        Send a G-code command to the printer and return the response.
+        Send a G-code command to the printer. Inside a burst it is written together with the other commands of the
+        burst. The "ok" replies are not waited for, they are consumed by the next query (M114, M400).
+        """
+        code = command.split(' ', 1)[0]
+        self.metrics.command_sent(code)
+        with self.tracer.span(code, "serial", command=command):
+            self.outbox.add(self.serial, (command + '\n').encode())
+
+    def _send_query(self, query):
+        """
+        Write a query (e.g. b"M114\n") together with the queued commands.
+        """
+        self.outbox.add(self.serial, query)
+        self.outbox.flush(self.serial)
+
+    def _receive(self):
+        """
+        Read what arrived and frame it into lines. Every "ok" acknowledges the oldest unacknowledged command.
+
+        :return: List of the complete lines received, empty if nothing arrived.
+        """
+        if not self.input_buffer.fill(self.serial):
+            return []
+        lines = self.input_buffer.lines()
+        for line in lines:
+            if line.startswith("ok"):
+                self.outbox.acknowledge()
+        return lines
+
+    def _make_room(self, size, timeout=30.0):
+        """
+        Read replies until `size` more bytes fit into the receive buffer of the firmware next to the unacknowledged
+        commands. If the "ok"s do not come (lost replies), the commands are assumed received after the timeout.
+        """
+        deadline = self.clock() + timeout
+        while self.outbox.unacknowledged_bytes + size > self.outbox.limit:
+            if self.clock() > deadline:
+                logger.warning("No \"ok\" from the printer within %s s, continuing.", timeout)
+                self.metrics.count_timeout("ok")
+                self._resync()
+                return
+            if not self._receive():
+                self.sleep(0.002)
+
+    def _resync(self):
+        """
+        Drop the unread input and consider every written command acknowledged, after a timeout or the handshake.
         """
-        self.serial.write((command + '\n').encode())
-        response = self.serial.readline().decode().strip()
-        return response
+        self.serial.reset_input_buffer()
+        self.input_buffer.clear()
+        self.outbox.forget()
 
     def update_current_coordinates(self):
         """
         Update current 3D printer coordinates by sending the M114 command
         and parsing the response.
         """
-        try:
-            self.serial.flushInput()
-            self.serial.flushOutput()
-            # Send the M114 command
-            self.serial.write(b'M114\n')
-            #time.sleep(0.5)  # Wait for the printer to respond # TODO
-
-            # Read the response
-            response_lines = []
-            start_time = time.time()
-            timeout = 5  # Timeout in seconds
-
-            while time.time() - start_time < timeout:
-                if self.serial.in_waiting > 0:
-                    line = self.serial.readline().decode('utf-8').strip()
-                    response_lines.append(line)
-                    if line == "ok":  # Stop when "ok" is received
-                        break
-                time.sleep(0.1)
-
-            # Combine response for debugging
-            # response = "\n".join(response_lines)
-            # print(f"Full response -> {response}")
-            # print("-----")
-
-            # Parse the coordinates from the response
-            for line in response_lines:
-                if 'X:' in line and 'Y:' in line and 'Z:' in line and 'E:' in line:
-                    parts = line.split(' ')
-                    self.curr_x = float(next((p[2:] for p in parts if p.startswith('X:')), 0))
-                    self.curr_y = float(next((p[2:] for p in parts if p.startswith('Y:')), 0))
-                    self.curr_z = float(next((p[2:] for p in parts if p.startswith('Z:')), 0))
-                    self.tool_controller.current_position = float(next((p[2:] for p in parts if p.startswith('E:')), 0))
-                    self.curr_x = max(0.0, self.curr_x)  # Ensure coordinates are non-negative
-                    self.curr_y = max(0.0, self.curr_y)
-                    self.curr_z = max(0.0, self.curr_z)
-                    # print(f"Updated Coordinates -> X: {self.curr_x}, Y: {self.curr_y}, Z: {self.curr_z}, E: {self.tool_controller.current_position}")
+        self.metrics.command_sent("M114")
+        with self.tracer.span("M114", "serial", command="M114"):
+            try:
+                self._send_query(b'M114\n')
+
+                # Read the response
+                start_time = self.clock()
+                timeout = 5  # Timeout in seconds
+                position_received = False
+
+                while self.clock() - start_time < timeout:
+                    lines = self._receive()
+                    if not lines:
+                        self.sleep(0.002)
+                        continue
+                    for line in lines:
+                        position_received = self._parse_position_line(line) or position_received
+                    # Done when every command is acknowledged, the last "ok" is the one of M114
+                    if position_received and not self.outbox.unacknowledged:
+                        self.metrics.observe_serial("M114", self.clock() - start_time)
+                        return
+                self._resync()
+                if position_received:
+                    self.metrics.observe_serial("M114", self.clock() - start_time)
                     return
+                self.metrics.count_timeout("M114")
+            except Exception as e:
+                logger.error("Error while updating coordinates: %s", e)
+                self.last_target = None  # The link may be lost, the next move is written again (and fails loudly)
+
+    def _parse_position_line(self, line):
+        """
+        Parse a position report of M114 ("X:10.00 Y:20.00 Z:30.00 E:-5.00 Count ...") into the current coordinates.
 
-            # If coordinates are not found
-            # print("Failed to parse coordinates from the response.")
-        except Exception as e:
-            print(f"Error while updating coordinates: {e}")
+        :return: True if the line was a position report.
+        """
+        if not ('X:' in line and 'Y:' in line and 'Z:' in line and 'E:' in line):
+            return False
+        parts = line.split(' ')
+        self.curr_x = float(next((p[2:] for p in parts if p.startswith('X:')), 0))
+        self.curr_y = float(next((p[2:] for p in parts if p.startswith('Y:')), 0))
+        self.curr_z = float(next((p[2:] for p in parts if p.startswith('Z:')), 0))
+        self.tool_controller.current_position = float(next((p[2:] for p in parts if p.startswith('E:')), 0))
+        self.curr_x = max(0.0, self.curr_x)  # Ensure coordinates are non-negative
+        self.curr_y = max(0.0, self.curr_y)
+        self.curr_z = max(0.0, self.curr_z)
+        self.motion.confirm((self.curr_x, self.curr_y, self.curr_z))
+        self.tool_controller.motion.confirm((self.tool_controller.current_position,))
+        # print(f"Updated Coordinates -> X: {self.curr_x}, Y: {self.curr_y}, Z: {self.curr_z}, E: {self.tool_controller.current_position}")
+        return True
+
+    def wait_for_moves(self, timeout=10.0):
+        """
+        Wait until all queued moves are finished. M400 blocks the firmware command queue until the planner is empty,
+        so the position reported by the M114 sent right after it is the final one. Only a single round trip is made,
+        written together with the queued commands.
+
+        :param timeout: How long to wait (s).
+        :return: True if the moves finished (and the coordinates were updated) within the timeout.
+        """
+        self.metrics.command_sent("M400")
+        self.metrics.command_sent("M114")
+        with self.tracer.span("M400", "serial", command="M400"):
+            try:
+                self._send_query(b'M400\nM114\n')
+                start_time = self.clock()
+                deadline = start_time + timeout
+                finished = False
+                while self.clock() < deadline:
+                    lines = self._receive()
+                    if not lines:
+                        self.sleep(0.002)
+                        continue
+                    for line in lines:
+                        if not finished and self._parse_position_line(line):
+                            finished = True
+                            self.metrics.observe_serial("M400", self.clock() - start_time)
+                            deadline = min(deadline, self.clock() + 0.5)
+                    if finished and not self.outbox.unacknowledged:
+                        return True  # "ok" of M114 consumed, later replies stay in sync
+                self._resync()
+                if finished:
+                    return True
+                logger.warning("Timeout while waiting for moves to finish (%s s).", timeout)
+                self.metrics.count_timeout("M400")
+            except Exception as e:
+                logger.error("Error while waiting for moves: %s", e)
+                self.last_target = None
+            return False
 
     def move_to_coordinates(self, x, y, z, speed=None, timeout=30, poll_interval=0.1):
         """
@@ -99,22 +327,29 @@ class PrinterController:
            y < 0 or \
            x > 310 or \
            y > 310:
-            print(f"Invalid coordinates: X={x}, Y={y}, Z={z}")
+            logger.warning("Invalid coordinates: X=%s, Y=%s, Z=%s", x, y, z)
             return
+        if self.last_target == (x, y, z):
+            return  # Already written, the state machine repeats the move on every poll until it arrives
 
-        if speed:
-            command = f"M203 X{self.max_speed} Y{self.max_speed} Z{self.max_speed_z} E{speed}"
-        else:
-            command = f"M203 X{self.max_speed} Y{self.max_speed} Z{self.max_speed_z} E{self.max_speed}"
-        self.send_gcode(command)
+        with self.burst():  # One write for the whole move
+            if speed:
+                command = f"M203 X{self.max_speed} Y{self.max_speed} Z{self.max_speed_z} E{speed}"
+            else:
+                command = f"M203 X{self.max_speed} Y{self.max_speed} Z{self.max_speed_z} E{self.max_speed}"
+            self.send_gcode(command)
 
-        command = "M302 S0"
-        self.send_gcode(command)
-        if speed:
-            self.send_gcode(f"G1 X{x} Y{y} Z{z} F{speed}")
-        else:
-            self.send_gcode(f"G1 X{x} Y{y} Z{z} F{self.max_speed}")
-        self.send_gcode(command)
+            command = "M302 S0"
+            self.send_gcode(command)
+            if speed:
+                self.send_gcode(f"G1 X{x} Y{y} Z{z} F{speed}")
+            else:
+                self.send_gcode(f"G1 X{x} Y{y} Z{z} F{self.max_speed}")
+            self.send_gcode(command)
+        self.last_target = (x, y, z)
+        self.motion.command_move((x, y, z), speed or self.max_speed)
+        _, end_time = self.motion.planned_end()
+        self.last_move_deadline = (self.clock() if end_time is None else end_time) + self.move_resend_margin
         
         # self.update_current_coordinates()
 
@@ -139,20 +374,30 @@ class PrinterController:
     #     self.send_gcode(command)
 
     def move_above_refilling_tank(self): # TODO
-        print("Moving above refilling tank...")
+        logger.info("Moving above refilling tank...")
         self.move_to_coordinates(self.bed_controller.refilling_tank[0], self.bed_controller.refilling_tank[1], self.bed_controller.safe_z)
         return True
 
     def is_at_position(self, x, y, z, tolerance=0.1):
         """
         Check if the printer has reached the specified position within a given tolerance.
+        While the move to the position is predicted to be in progress the printer is not queried (no M114). A move
+        that has not arrived `move_resend_margin` after its predicted end counts as lost (e.g. a garbled line), the
+        next move_to_coordinates writes it again.
         """
+        if self.motion.is_moving() and self.last_target == (x, y, z):
+            return False
         self.update_current_coordinates()  # Ensure current coordinates are up-to-date
-        return (
+        at_position = (
             abs(self.curr_x - x) <= tolerance and
             abs(self.curr_y - y) <= tolerance and
             abs(self.curr_z - z) <= tolerance
         )
+        if not at_position and self.last_target == (x, y, z) and self.clock() > self.last_move_deadline:
+            logger.warning("Move to X=%s, Y=%s, Z=%s did not arrive, sending it again.", x, y, z)
+            self.metrics.count_timeout("move")
+            self.last_target = None
+        return at_position
 
     def home(self):
         """
@@ -163,14 +408,37 @@ class PrinterController:
         self.curr_x = 0.0
         self.curr_y = 0.0
         self.curr_z = 0.0
+        self.last_target = None
+        self.motion.reset((0.0, 0.0, 0.0))
+
+    def estimated_position(self):
+        """
+        Get the dead-reckoned (x, y, z) of the toolhead without querying the printer.
+        Falls back to the last reported position, returns None if the position is unknown.
+        """
+        position = self.motion.estimate()
+        if position is None and self.curr_x is not None:
+            position = (self.curr_x, self.curr_y, self.curr_z)
+        return position
+
+    def commanded_position(self):
+        """
+        Get the (x, y, z) where the last commanded move ends, or None if the position is unknown.
+        """
+        position, _ = self.motion.planned_end()
+        return position
 
     def emergency_stop(self):
         """
         Send an emergency stop command to the printer.
         """
-        print("--- EMERGENCY STOP ---")
+        logger.critical("--- EMERGENCY STOP ---")
+        self.outbox.discard()  # Commands not written yet must not follow the stop
+        self.outbox.forget()  # M112 is written right away, without waiting for room in the receive buffer
         command = "M112"
         self.send_gcode(command)
+        self.last_target = None
+        self.motion.reset()
 
     ############################
     # ADDITIONAL FUNCTIONALITY #
@@ -193,6 +461,7 @@ class PrinterController:
         ]
 
         # Send each note to the printer
-        for frequency, duration in melody:
-            command = f"M300 S{frequency} P{duration} D10"
-            self.send_gcode(command)
+        with self.burst():
+            for frequency, duration in melody:
+                command = f"M300 S{frequency} P{duration} D10"
+                self.send_gcode(command)
@@ -0,0 +1,119 @@
+# This file implements the framing of the serial link of PrinterController.
+# Commands are not written one line at a time: send_gcode appends them to an outbox, and a burst (all commands of a
+# move, a plunger move, or commands followed by a query) is written with a single write call.
+# The bytes in flight never exceed the receive buffer of the firmware (Marlin RX_BUFFER_SIZE, 128 bytes by default):
+# the outbox remembers every written line until the firmware acknowledged it with "ok" (one "ok" per command, in
+# order) and before a write that would not fit next to the unacknowledged lines it lets the printer read replies until
+# enough "ok"s arrived (character counting). Longer bursts are split into writes that fit.
+# Replies are read in chunks (one read call returns everything that arrived) into a reusable LineBuffer that cuts
+# them into lines, instead of readline, which pyserial implements as one read per byte.
+
+from collections import deque
+
+RX_BUFFER_SIZE = 128  # Bytes the firmware can receive at once (Marlin default)
+READ_CHUNK_SIZE = 4096  # Largest read, more than the firmware sends between two polls
+
+
+class LineBuffer:
+    """
+    Received bytes not consumed yet, framed into lines.
+    """
+    def __init__(self):
+        self._data = bytearray()
+
+    def fill(self, serial):
+        """
+        Read everything that arrived (one read call, the port has timeout=0).
+
+        :return: Number of bytes read.
+        """
+        data = serial.read(READ_CHUNK_SIZE)
+        self._data += data
+        return len(data)
+
+    def lines(self):
+        """
+        Take the complete lines received so far, decoded and stripped. A partial last line stays in the buffer.
+        """
+        end = self._data.rfind(b"\n")
+        if end < 0:
+            return []
+        lines = self._data[:end].decode("utf-8", errors="replace").split("\n")
+        del self._data[:end + 1]
+        return [line.strip() for line in lines]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CommandOutbox:
+    """
+    Commands waiting to be written and written commands waiting for their "ok", see the top of this file.
+    """
+    def __init__(self, limit=RX_BUFFER_SIZE, make_room=None):
+        """
+        :param limit: Largest number of bytes in flight (written, not acknowledged yet).
+        :param make_room: Called with the size of the next write when it does not fit next to the unacknowledged
+                          lines, reads replies (acknowledge) until it fits. None = no flow control.
+        """
+        self.limit = limit
+        self.make_room = make_room
+        self._data = bytearray()
+        self._bursts = 0  # Depth of nested bursts, commands are written when the outermost one ends
+        self.unacknowledged = deque()  # Sizes (bytes) of the written lines without "ok" yet, oldest first
+        self.unacknowledged_bytes = 0
+
+    def add(self, serial, line):
+        """
+        Queue a command line (with its newline). Outside a burst it is written right away.
+        """
+        if self._data and len(self._data) + len(line) > self.limit:
+            self.flush(serial)
+        self._data += line
+        if not self._bursts:
+            self.flush(serial)
+
+    def flush(self, serial):
+        """
+        Write the queued commands with one write call, once they fit into the receive buffer of the firmware.
+        """
+        if not self._data:
+            return
+        if self.make_room is not None and self.unacknowledged_bytes + len(self._data) > self.limit:
+            self.make_room(len(self._data))
+        serial.write(bytes(self._data))
+        for line in self._data.split(b"\n")[:-1]:
+            self.unacknowledged.append(len(line) + 1)
+            self.unacknowledged_bytes += len(line) + 1
+        self._data.clear()
+
+    def acknowledge(self):
+        """
+        Record an "ok" of the firmware, it acknowledges the oldest unacknowledged line.
+        """
+        if self.unacknowledged:
+            self.unacknowledged_bytes -= self.unacknowledged.popleft()
+
+    def forget(self):
+        """
+        Consider all written lines acknowledged (the firmware was reset, or the replies were lost).
+        """
+        self.unacknowledged.clear()
+        self.unacknowledged_bytes = 0
+
+    def discard(self):
+        self._data.clear()
+
+    def begin(self):
+        self._bursts += 1
+
+    def end(self, serial):
+        self._bursts -= 1
+        if not self._bursts:
+            self.flush(serial)
+
+    def __len__(self):
+        return len(self._data)
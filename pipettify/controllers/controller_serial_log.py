@@ -0,0 +1,233 @@
+# This file implements recording and replaying of the serial traffic of a run.
+#
+# SerialRecorder wraps the serial object of PrinterController and writes every chunk sent and received, with the time
+# it was sent/read, into a compact binary log:
+#   header  "<4sHd"  magic b"PSRL", format version, wall-clock start time (time.time())
+#   record  "<dBI"   time since the start (s), kind (WRITE, READ, FLUSHED), payload length, followed by the payload
+# Bytes discarded by an input flush are read first and stored as FLUSHED, so the log holds everything the firmware
+# sent.
+#
+# ReplaySerial stands in for the serial object and feeds the recorded input back. Every received chunk is anchored to
+# the last command line written before it was read and becomes readable the recorded delay after the replayed run
+# writes that line - like the firmware, which answers a command a certain time after it arrives. The host's own
+# processing time therefore does not shift the replies. With the real clock the run replays at the recorded speed;
+# with a virtual clock (sequence_control.sequence_scheduler.VirtualClock, the host sleeps take no time) it replays as
+# fast as possible with the same timeline, so a production stall is reproduced with the firmware timing of the
+# recording.
+# Written commands are compared with the recorded ones and the first difference is reported, it shows where a changed
+# sequencer leaves the recorded run.
+
+import struct
+import time
+from collections import deque
+
+from pipettify.telemetry.telemetry_logging import get_logger
+
+logger = get_logger("controller_serial_log")
+
+MAGIC = b"PSRL"
+VERSION = 1
+HEADER = struct.Struct("<4sHd")
+RECORD = struct.Struct("<dBI")
+WRITE, READ, FLUSHED = 0, 1, 2
+
+
+def read_serial_log(path):
+    """
+    Read a serial log written by SerialRecorder.
+
+    :return: Tuple (wall-clock start time, [(time since the start, kind, payload)]).
+    :raises ValueError: If the file is not a serial log or is truncated in the header.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a serial log (too short).")
+    magic, version, started = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a serial log.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported serial log version {version} in {path}.")
+
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        timestamp, kind, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            break  # Last record cut off (recording interrupted), keep everything before it
+        records.append((timestamp, kind, data[offset:offset + length]))
+        offset += length
+    return started, records
+
+
+class SerialRecorder:
+    """
+    Serial-like wrapper recording all traffic of the wrapped serial object.
+    """
+    def __init__(self, serial, path, clock=time.monotonic, flush_interval=1.0):
+        """
+        :param serial: Serial object to wrap (pyserial, SimulatedPrinter, ...).
+        :param path: File the log is written to (overwritten).
+        :param clock: Function returning the current time (s), the clock of the printer controller.
+        :param flush_interval: Flush the log file at most this often (s), so an interrupted run keeps its log.
+        """
+        self.serial = serial
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.start = clock()
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._last_flush = self.start
+
+    def _record(self, kind, data):
+        if not data:
+            return
+        now = self.clock()
+        self.file.write(RECORD.pack(now - self.start, kind, len(data)))
+        self.file.write(data)
+        if now - self._last_flush >= self.flush_interval:
+            self.file.flush()
+            self._last_flush = now
+
+    def write(self, data):
+        self._record(WRITE, data)
+        return self.serial.write(data)
+
+    @property
+    def in_waiting(self):
+        return self.serial.in_waiting
+
+    def read(self, size=1):
+        data = self.serial.read(size)
+        self._record(READ, data)
+        return data
+
+    def readline(self):
+        data = self.serial.readline()
+        self._record(READ, data)
+        return data
+
+    def reset_input_buffer(self):
+        waiting = self.serial.in_waiting
+        if waiting:
+            self._record(FLUSHED, self.serial.read(waiting))
+        self.serial.reset_input_buffer()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def flushOutput(self):
+        self.serial.flushOutput()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        self.serial.close()
+
+
+class ReplaySerial:
+    """
+    Serial-like object replaying the input of a serial log.
+    """
+    def __init__(self, path, clock=time.monotonic, slack=0.005):
+        """
+        :param path: Serial log written by SerialRecorder.
+        :param clock: Function returning the current time (s). The real clock replays at the recorded speed, a virtual
+            clock as fast as possible. Use the same clock for the printer controller (PrinterController.use_clock).
+        :param slack: Make the input readable this much earlier (s). The recorded time is when the host read the
+            data, not when it arrived; without the slack a poll a little earlier than in the recording misses it and
+            every reply costs an extra polling interval.
+        """
+        self.clock = clock
+        self.slack = slack
+        _, records = read_serial_log(path)
+        self.recorded_duration = records[-1][0] if records else 0.0  # Length of the recording (s)
+
+        self._input = deque()  # [(lines written before, delay after the last of them (s), data)]
+        lines, line_time = 0, 0.0
+        for timestamp, kind, data in records:
+            if kind == WRITE:
+                if b"\n" in data:
+                    lines += data.count(b"\n")
+                    line_time = timestamp
+            else:
+                self._input.append((lines, timestamp - line_time, data))
+        self._expected = deque(b"".join(data for _, kind, data in records if kind == WRITE).split(b"\n"))
+        self._partial = b""
+        self._line_times = [clock()]  # Replay time at which the n-th command line was written, [0] = start
+        self.commands_written = 0
+        self.divergence = None  # (command number, expected, written) of the first command that differs
+
+    def _available(self, entry, now):
+        lines, delay, _ = entry
+        return lines <= self.commands_written and now >= self._line_times[lines] + delay - self.slack
+
+    def finished(self):
+        """
+        True once all recorded input was read.
+        """
+        return not self._input
+
+    def write(self, data):
+        self._partial += data
+        *lines, self._partial = self._partial.split(b"\n")
+        now = self.clock()
+        for line in lines:
+            self.commands_written += 1
+            self._line_times.append(now)
+            expected = self._expected.popleft() if self._expected else None
+            if self.divergence is None and line != expected:
+                self.divergence = (self.commands_written, expected, line)
+                logger.warning("Replay diverged at command %d: recorded %r, sent %r", self.commands_written,
+                               expected, line)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        now = self.clock()
+        waiting = 0
+        for entry in self._input:
+            if not self._available(entry, now):
+                break
+            waiting += len(entry[2])
+        return waiting
+
+    def read(self, size=1):
+        now = self.clock()
+        data = b""
+        while self._input and self._available(self._input[0], now) and len(data) < size:
+            lines, delay, chunk = self._input.popleft()
+            take = size - len(data)
+            data += chunk[:take]
+            if len(chunk) > take:
+                self._input.appendleft((lines, delay, chunk[take:]))
+        return data
+
+    def readline(self):
+        now = self.clock()
+        data = b""
+        while self._input and self._available(self._input[0], now):
+            lines, delay, chunk = self._input.popleft()
+            newline = chunk.find(b"\n")
+            if newline >= 0:
+                data += chunk[:newline + 1]
+                if newline + 1 < len(chunk):
+                    self._input.appendleft((lines, delay, chunk[newline + 1:]))
+                break
+            data += chunk
+        return data
+
+    def reset_input_buffer(self):
+        now = self.clock()
+        while self._input and self._available(self._input[0], now):
+            self._input.popleft()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,201 @@
+# This file implements masks of active slots. A mask is a bitmask over a grid (bit row * columns + column), stored in
+# a Python int, so union, intersection and difference of whole plates are single integer operations. Masks are built
+# from rectangles, row/column ranges, explicit lists or the old "first N slots" count, or parsed from a short text
+# specification, e.g. "A1:D6, 7:8, !B2" (rectangle A1-D6, columns 7 and 8, without B2).
+
+from pipettify.controllers.controller_deck import parse_slot_name, slot_name
+
+
+class SlotMask:
+    """
+    Set of active slots of a rows x columns grid.
+    """
+    def __init__(self, rows, columns, bits=0):
+        """
+        :param rows: Number of rows of the grid.
+        :param columns: Number of columns of the grid.
+        :param bits: Bitmask, bit (row * columns + column) is set for active slots.
+        """
+        self.rows = rows
+        self.columns = columns
+        self.bits = bits & ((1 << (rows * columns)) - 1)
+
+    ############################
+    # CONSTRUCTION
+    ############################
+
+    @classmethod
+    def full(cls, rows, columns):
+        return cls(rows, columns, (1 << (rows * columns)) - 1)
+
+    @classmethod
+    def first(cls, rows, columns, count):
+        """
+        First `count` slots in row-major order (the old "active slots" number).
+        """
+        count = max(0, min(count, rows * columns))
+        return cls(rows, columns, (1 << count) - 1)
+
+    @classmethod
+    def rectangle(cls, rows, columns, first_row, first_column, last_row, last_column):
+        """
+        Rectangle of slots, both corners included.
+        """
+        first_row, last_row = sorted((max(first_row, 0), min(last_row, rows - 1)))
+        first_column, last_column = sorted((max(first_column, 0), min(last_column, columns - 1)))
+        row_bits = ((1 << (last_column - first_column + 1)) - 1) << first_column
+        bits = 0
+        for row in range(first_row, last_row + 1):
+            bits |= row_bits << (row * columns)
+        return cls(rows, columns, bits)
+
+    @classmethod
+    def column_range(cls, rows, columns, first_column, last_column):
+        return cls.rectangle(rows, columns, 0, first_column, rows - 1, last_column)
+
+    @classmethod
+    def row_range(cls, rows, columns, first_row, last_row):
+        return cls.rectangle(rows, columns, first_row, 0, last_row, columns - 1)
+
+    @classmethod
+    def from_positions(cls, rows, columns, positions):
+        """
+        Mask of an explicit list of (row, col) positions.
+
+        :raises ValueError: If a position is outside of the grid.
+        """
+        bits = 0
+        for row, col in positions:
+            if not (0 <= row < rows and 0 <= col < columns):
+                raise ValueError(f"Slot {slot_name(row, col)} is outside of the {rows}x{columns} grid.")
+            bits |= 1 << (row * columns + col)
+        return cls(rows, columns, bits)
+
+    @classmethod
+    def parse(cls, rows, columns, spec):
+        """
+        Build a mask from its text specification. Items are separated by commas, "!" in front of an item removes it:
+            ""  or "all"  all slots
+            "36"          first 36 slots in row-major order (only as the whole specification)
+            "B3"          single slot
+            "A1:D6"       rectangle
+            "A:C"         rows A to C
+            "5:8"         columns 5 to 8, "5:5" is column 5
+        Items are applied left to right, e.g. "all, !A1:A12" is everything except row A.
+
+        :raises ValueError: If the specification is invalid.
+        """
+        if isinstance(spec, int):
+            return cls.first(rows, columns, spec)
+        spec = spec.strip()
+        if spec == "" or spec.lower() == "all":
+            return cls.full(rows, columns)
+        if spec.isdigit():
+            return cls.first(rows, columns, int(spec))
+
+        mask = cls(rows, columns)
+        for item in spec.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            exclude = item.startswith("!")
+            item_mask = cls._parse_item(rows, columns, item.lstrip("!").strip())
+            mask = mask - item_mask if exclude else mask | item_mask
+        return mask
+
+    @classmethod
+    def _parse_item(cls, rows, columns, item):
+        if item.lower() == "all":
+            return cls.full(rows, columns)
+        start, _, end = item.partition(":")
+        end = end or start
+        start, end = start.strip().upper(), end.strip().upper()
+        if start.isdigit() and end.isdigit():
+            first_column, last_column = int(start) - 1, int(end) - 1
+            cls._check(rows, columns, item, 0, first_column, 0, last_column)
+            return cls.column_range(rows, columns, first_column, last_column)
+        if start.isalpha() and end.isalpha():
+            first_row, last_row = parse_slot_name(start + "1")[0], parse_slot_name(end + "1")[0]
+            cls._check(rows, columns, item, first_row, 0, last_row, 0)
+            return cls.row_range(rows, columns, first_row, last_row)
+        first_row, first_column = parse_slot_name(start)
+        last_row, last_column = parse_slot_name(end)
+        cls._check(rows, columns, item, first_row, first_column, last_row, last_column)
+        return cls.rectangle(rows, columns, first_row, first_column, last_row, last_column)
+
+    @staticmethod
+    def _check(rows, columns, item, *corners):
+        first_row, first_column, last_row, last_column = corners
+        if not (0 <= first_row < rows and 0 <= last_row < rows and
+                0 <= first_column < columns and 0 <= last_column < columns):
+            raise ValueError(f"'{item}' is outside of the {rows}x{columns} grid.")
+
+    ############################
+    # SET OPERATIONS
+    ############################
+
+    def _same_grid(self, other):
+        if (self.rows, self.columns) != (other.rows, other.columns):
+            raise ValueError("Masks of different grids cannot be combined.")
+
+    def __or__(self, other):
+        self._same_grid(other)
+        return SlotMask(self.rows, self.columns, self.bits | other.bits)
+
+    def __and__(self, other):
+        self._same_grid(other)
+        return SlotMask(self.rows, self.columns, self.bits & other.bits)
+
+    def __sub__(self, other):
+        self._same_grid(other)
+        return SlotMask(self.rows, self.columns, self.bits & ~other.bits)
+
+    def __xor__(self, other):
+        self._same_grid(other)
+        return SlotMask(self.rows, self.columns, self.bits ^ other.bits)
+
+    def __invert__(self):
+        return SlotMask(self.rows, self.columns, ~self.bits)
+
+    def __eq__(self, other):
+        return (isinstance(other, SlotMask) and
+                (self.rows, self.columns, self.bits) == (other.rows, other.columns, other.bits))
+
+    def __hash__(self):
+        return hash((self.rows, self.columns, self.bits))
+
+    ############################
+    # QUERIES
+    ############################
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, position):
+        row, col = position
+        return 0 <= row < self.rows and 0 <= col < self.columns and bool(self.bits >> (row * self.columns + col) & 1)
+
+    def __iter__(self):
+        """
+        Iterate over active (row, col) positions in row-major order.
+        """
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            yield divmod(index, self.columns)
+            bits ^= lowest
+
+    def first_position(self):
+        """
+        Get the first active position in row-major order, or None if the mask is empty.
+        """
+        if not self.bits:
+            return None
+        return divmod((self.bits & -self.bits).bit_length() - 1, self.columns)
+
+    def __repr__(self):
+        return f"SlotMask({self.rows}x{self.columns}, {len(self)} active)"
@@ -1,42 +1,176 @@
+import contextlib
 import time
 
 from pipettify.controllers.controller_bed import BedController
+from pipettify.controllers.controller_liquid_class import default_liquid_classes, DEFAULT_LIQUID_CLASS
+from pipettify.controllers.motion_model import MotionEstimator
+from pipettify.telemetry.telemetry_logging import get_logger
+from pipettify.telemetry.telemetry_metrics import NULL_METRICS
+from pipettify.telemetry.telemetry_tracing import NULL_TRACER
+
+logger = get_logger("controller_tool")
 
 class EndEffectorController:
     """
     End effector controller class. This class is responsible for controlling the end effector.
     """
-    def __init__(self, send_gcode_func, update_current_coordinates, bed_controller: BedController):
+    def __init__(self, send_gcode_func, update_current_coordinates, bed_controller: BedController,
+                 wait_for_moves=None, burst=None):
         self.send_gcode = send_gcode_func
+        self.burst = burst or contextlib.nullcontext  # Coalesces the commands of a move into one write, optional
         self.update_current_coordinates = update_current_coordinates
+        self.wait_for_moves = wait_for_moves  # Blocks until the firmware finished all moves (M400), optional
         self.bed_controller = bed_controller
         self.neutral_position = 0.0
         self.current_position = None
         self.pushed_half_position_diff = -17.5  # -15.5 mm for half push
         self.pushed_position_diff = -30.5       # -31 mm for full push
+        self.nominal_volume = 0.0  # Volume (uL) aspirated between neutral and half push (first stop), 0 = unknown
+        self.channels = 1  # Number of channels (tips carried at once), 1 = single-channel pipette
+        self.channel_pitch = 9.0  # Distance between neighbouring channels (mm), negative = towards lower coordinates
+        self.channel_axis = "y"  # Deck axis the channels are lined up along ("x" or "y")
+        self.aspirated_volume = 0.0  # Liquid (uL) taken up by the last aspiration, see aspirate
         self.state = "neutral"  # Track the end effector state (push_button_pressed, tip_button_pressed, neutral)
         self.last_operation = None  # Track the last operation performed ("drop_tip", "refill")
+        self.feedrate = 500  # Plunger speed (mm/min) of moves without liquid (releasing the button in the air)
+        self.liquid_classes = default_liquid_classes()  # {name: LiquidClass} available for the run
+        self.liquid_class = self.liquid_classes[DEFAULT_LIQUID_CLASS]  # Liquid class of the run
+        self.active_liquid_class = self.liquid_class  # Liquid class of the current cycle (worklist rows may override)
+        self.acceleration = 500  # Plunger (E axis) acceleration (mm/s^2), lower than real is safe
+        self.motion = MotionEstimator(acceleration=self.acceleration)  # Predicts when plunger moves end
+        self.clock = time.monotonic  # Time source of the waits, see PrinterController.use_clock
+        self.sleep = time.sleep
+        self.tracer = NULL_TRACER  # See PrinterController.use_tracer
+        self.metrics = NULL_METRICS  # See PrinterController.use_metrics
+
+    def channel_offsets(self):
+        """
+        Get the (dx, dy) of every channel relative to the first one (mm). The first channel is the one positioned by
+        the printer coordinates.
+        """
+        if self.channel_axis == "x":
+            return [(index * self.channel_pitch, 0.0) for index in range(self.channels)]
+        return [(0.0, index * self.channel_pitch) for index in range(self.channels)]
+
+    def select_liquid_class(self, name=None):
+        """
+        Select the liquid class of the current cycle.
+
+        :param name: Name of the liquid class, None = liquid class of the run.
+        :raises KeyError: If the liquid class does not exist.
+        """
+        if name is None:
+            self.active_liquid_class = self.liquid_class
+        elif name in self.liquid_classes:
+            self.active_liquid_class = self.liquid_classes[name]
+        else:
+            raise KeyError(f"Unknown liquid class: {name}")
+        return self.active_liquid_class
+
+    def liquid_capacity(self):
+        """
+        Get the largest volume of liquid (uL) one aspiration takes up: the nominal volume minus the air gap of the
+        liquid class, 0 = unknown nominal volume.
+        """
+        if self.nominal_volume <= 0:
+            return 0.0
+        return max(self.nominal_volume - self.active_liquid_class.air_gap, 0.0)
+
+    def _holding_position(self, volume):
+        """
+        Get the plunger position at which `volume` of liquid (uL) and the air gap are in the tip, measured from the
+        first stop. Plunger travel between neutral and half push is proportional to the volume.
+        """
+        fraction = min(max((self.active_liquid_class.air_gap + volume) / self.nominal_volume, 0.0), 1.0)
+        return self.neutral_position + self.pushed_half_position_diff * (1.0 - fraction)
 
     def press_push_button_half(self, timeout=10, poll_interval=0.1):
         """
         Press push button halfway. It should keep the button pressed halfway.
         """
         # target_position = self._calculate_button_press_position("push")
-        result = self._move_and_wait(self.neutral_position + self.pushed_half_position_diff, timeout, poll_interval)
+        result = self._move_and_wait(self.neutral_position + self.pushed_half_position_diff, timeout, poll_interval,
+                                     feedrate=self.active_liquid_class.dispense_speed)
         if result:
             self.state = "push_button_pressed"
         return
 
+    def press_push_button_to_volume(self, dispensed_volume, timeout=10, poll_interval=0.1):
+        """
+        Press push button partially, so that `dispensed_volume` of the aspirated liquid is pushed out.
+        The push starts where the aspiration stopped, see aspirate.
+
+        :param dispensed_volume: Total volume (uL) dispensed since the aspiration, not just this portion.
+        """
+        if self.nominal_volume <= 0:
+            raise ValueError("Nominal volume of the pipette is not set.")
+        result = self._move_and_wait(self._holding_position(self.aspirated_volume - dispensed_volume),
+                                     timeout, poll_interval, feedrate=self.active_liquid_class.dispense_speed)
+        if result:
+            self.state = "push_button_pressed"
+        return result
+
     def press_push_button_full(self, timeout=10, poll_interval=0.1):
         """
         Press push button. It should keep the button pressed.
         """
         # target_position = self._calculate_button_press_position("push")
-        result = self._move_and_wait(self.neutral_position + self.pushed_position_diff, timeout, poll_interval)
+        result = self._move_and_wait(self.neutral_position + self.pushed_position_diff, timeout, poll_interval,
+                                     feedrate=self.active_liquid_class.dispense_speed)
         if result:
             self.state = "push_button_pressed"
         return result
 
+    def press_push_button_dispense(self, timeout=10, poll_interval=0.1):
+        """
+        Dispense everything that was aspirated: push to the second stop (blow-out) or only to the first stop,
+        depending on the liquid class.
+        """
+        if self.active_liquid_class.blow_out:
+            return self.press_push_button_full(timeout, poll_interval)
+        result = self._move_and_wait(self.neutral_position + self.pushed_half_position_diff, timeout, poll_interval,
+                                     feedrate=self.active_liquid_class.dispense_speed)
+        if result:
+            self.state = "push_button_pressed"
+        return result
+
+    def aspirate_air_gap(self, timeout=10, poll_interval=0.1):
+        """
+        With the button pressed halfway above the liquid, release it by the air gap of the liquid class,
+        so the air gap is aspirated before the liquid.
+        """
+        air_gap = self.active_liquid_class.air_gap
+        if air_gap <= 0:
+            return True
+        if self.nominal_volume <= 0:
+            logger.warning("Nominal volume of the pipette is not set, skipping the air gap.")
+            return True
+        fraction = max(1.0 - air_gap / self.nominal_volume, 0.0)
+        return self._move_and_wait(self.neutral_position + self.pushed_half_position_diff * fraction,
+                                   timeout, poll_interval, feedrate=self.active_liquid_class.aspirate_speed)
+
+    def aspirate(self, volume=None, timeout=10, poll_interval=0.1):
+        """
+        Release the button (pressed halfway, tip in the liquid) at the aspirate speed of the liquid class.
+        The refill is counted once the button is released, retries of a failed release are not counted again.
+
+        :param volume: Volume of liquid to aspirate (uL), at most liquid_capacity. None = release to neutral (full
+            stroke), also used when the nominal volume is unknown.
+        """
+        feedrate = self.active_liquid_class.aspirate_speed
+        if volume is None or self.nominal_volume <= 0:
+            if not self.move_to_neutral(timeout, poll_interval, feedrate=feedrate):
+                return False
+            self.aspirated_volume = self.liquid_capacity()
+        else:
+            volume = min(volume, self.liquid_capacity())
+            if not self._move_and_wait(self._holding_position(volume), timeout, poll_interval, feedrate=feedrate):
+                return False
+            self.state = "push_button_pressed"
+            self.aspirated_volume = volume
+        self.metrics.count_refill()
+        return True
+
     def press_drop_tip_button(self, timeout=10, poll_interval=0.1):
         """
         Press drop tip button.
@@ -49,32 +183,32 @@ class EndEffectorController:
         Perform drop tip operation. This means pressing drop tip button and getting back to neutral.
         """
         if not self.press_drop_tip_button(timeout, poll_interval):
-            print("Failed to press drop tip button.")
+            logger.warning("Failed to press drop tip button.")
             return False
         
         # Return to neutral after pressing drop tip button
         if not self.move_to_neutral(timeout, poll_interval):
-            print("Failed to return to neutral after dropping tip.")
+            logger.warning("Failed to return to neutral after dropping tip.")
             return False
         
-        print("Drop tip operation completed.")
+        logger.info("Drop tip operation completed.")
         return True
     
     def execute_refill(self, timeout=10, poll_interval=0.1): # TODO -> NO QA
         """
         Perform refill operation. This means pressing push button and getting back to neutral.
         """
-        print("EXECUTE REFILL")
+        logger.info("EXECUTE REFILL")
         if not self.press_push_button_full(timeout, poll_interval):
-            print("Failed to press push button.")
+            logger.warning("Failed to press push button.")
             return False
         
         # Return to neutral after pressing push button
         if not self.move_to_neutral(timeout, poll_interval):
-            print("Failed to return to neutral after refilling.")
+            logger.warning("Failed to return to neutral after refilling.")
             return False
 
-        print("Refill operation completed.")
+        logger.info("Refill operation completed.")
         self.last_operation = "refill"
         return True
     
@@ -82,59 +216,89 @@ class EndEffectorController:
         """
         Perform dispense operation. This means pressing push button and getting back to neutral.
         """
-        print(f"EXECUTE DISPENSE on probe {probe}")
+        logger.info("EXECUTE DISPENSE on probe %s", probe)
     
         # Press the push button to dispense
         if not self.press_push_button_full(timeout, poll_interval):
-            print("Failed to press push button for dispensing.")
+            logger.warning("Failed to press push button for dispensing.")
             return False
         
         # Return to neutral after pressing push button
         if not self.move_to_neutral(timeout, poll_interval):
-            print("Failed to return to neutral after dispensing.")
+            logger.warning("Failed to return to neutral after dispensing.")
             return False
 
         # Update the probe state to filled
         self.bed_controller.update_probe_state(probe[0], probe[1], True)
 
-        print(f"Dispense operation completed on probe {probe}.")
+        logger.info("Dispense operation completed on probe %s.", probe)
         self.last_operation = "dispense"
         return True
 
 
-    def move_to_neutral(self, timeout=10, poll_interval=0.1):
+    def move_to_neutral(self, timeout=10, poll_interval=0.1, feedrate=None):
         """
         No matter the motor position, move back to neutral. Choose the correct movement direction.
+
+        :param feedrate: Plunger speed (mm/min), None = speed of moves without liquid.
         """
-        result = self._move_and_wait(self.neutral_position, timeout, poll_interval)
+        result = self._move_and_wait(self.neutral_position, timeout, poll_interval, feedrate)
         if result:
             self.state = "neutral"
         return result
 
-    def move_to_position(self, position):
+    def move_to_position(self, position, feedrate=None):
         """
         Move the motor to the specified position.
+
+        :param feedrate: Plunger speed (mm/min), None = speed of moves without liquid.
         """
-        print(f"Moving motor to position: {position} mm")
-        self.send_gcode("M302 P1")  # Enable cold extrusion
-        # self.send_gcode("G92 E0")  # Reset extruder position to 0
-        self.send_gcode(f"G1 E{position} F500")  # Move extruder motor by 'position' (linear mm)
+        feedrate = feedrate or self.feedrate
+        logger.debug("Moving motor to position: %s mm", position)
+        with self.burst():
+            self.send_gcode("M302 P1")  # Enable cold extrusion
+            # self.send_gcode("G92 E0")  # Reset extruder position to 0
+            self.send_gcode(f"G1 E{position} F{feedrate:g}")  # Move extruder motor by 'position' (linear mm)
+        self.motion.command_move((position,), feedrate)
         return True
 
-    def _move_and_wait(self, target_position, timeout=10, poll_interval=0.1):
+    def _move_and_wait(self, target_position, timeout=10, poll_interval=0.1, feedrate=None):
         """
         Move the motor to the specified target position and wait until it reaches the position.
+        The end of the move is predicted from its length, feedrate and acceleration. After the predicted time a single
+        M400 confirms it, so the wait takes as long as the motion and no polling is needed.
+
+        :param timeout: How long to wait after the predicted end of the move (s), slow liquid classes get longer waits.
         """
-        self.move_to_position(target_position)
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if self._is_at_position(target_position):
-                print(f"Reached target position: {target_position} mm")
+        with self.tracer.span("plunger move", "plunger", target=target_position, feedrate=feedrate or self.feedrate,
+                              liquid_class=self.active_liquid_class.name):
+            self.move_to_position(target_position, feedrate)
+            predicted = self.motion.time_to_finish()
+            timeout += predicted
+            if self.wait_for_moves is not None:
+                start_time = self.clock()
+                self.sleep(predicted)
+                if not self.wait_for_moves(timeout - (self.clock() - start_time)):
+                    logger.warning("Timeout while moving to target position: %s mm", target_position)
+                    self.metrics.count_timeout("plunger")
+                    return False
+                if abs(self.current_position - target_position) > 0.1:
+                    logger.warning("Plunger stopped at %s mm instead of %s mm", self.current_position, target_position)
+                    return False
+                logger.debug("Reached target position: %s mm", target_position)
                 return True
-            time.sleep(poll_interval)
+
+            # No M400 support, poll the position
+            start_time = self.clock()
+            while self.clock() - start_time < timeout:
+                if self._is_at_position(target_position):
+                    logger.debug("Reached target position: %s mm", target_position)
+                    return True
+                self.sleep(poll_interval)
         
-        print(f"Timeout while moving to target position: {target_position} mm")
-        return False
+            logger.warning("Timeout while moving to target position: %s mm", target_position)
+            self.metrics.count_timeout("plunger")
+            return False
 
     def _is_at_position(self, target_position, tolerance=0.1):
         """
@@ -149,7 +313,7 @@ class EndEffectorController:
         """
         Calculate the target position for the specified button press type.
         """
-        print(f"Neutral position: {self.neutral_position}, type: {type(self.neutral_position)}")
+        logger.debug("Neutral position: %s, type: %s", self.neutral_position, type(self.neutral_position))
         if button_type == "push":
             return self.neutral_position + 5  # Example: 5 mm for push button
         elif button_type == "drop_tip":
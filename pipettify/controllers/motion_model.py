@@ -0,0 +1,194 @@
+# This file implements dead reckoning of the toolhead. Instead of asking the firmware for the position (M114) all the
+# time, we remember the moves we have commanded (target, feedrate) and estimate where the toolhead is at any moment with
+# a trapezoidal velocity profile (constant acceleration, cruise, constant deceleration). Positions reported by the
+# firmware are used as sparse confirmations that re-anchor the estimate.
+
+import math
+import time
+from collections import deque
+
+
+class MoveSegment:
+    """
+    Single commanded move with a trapezoidal velocity profile.
+    """
+    def __init__(self, start_time, start, target, feedrate, acceleration):
+        """
+        :param start_time: Time the move starts (clock seconds).
+        :param start: Tuple (x, y, z) where the move starts.
+        :param target: Tuple (x, y, z) where the move ends.
+        :param feedrate: Requested speed (mm/min, as in G1 F).
+        :param acceleration: Acceleration (mm/s^2).
+        """
+        self.start_time = start_time
+        self.start = start
+        self.target = target
+        self.feedrate = feedrate
+        self.distance = math.dist(start, target)
+
+        speed = feedrate / 60.0
+        if self.distance == 0 or speed <= 0:
+            self.accel_time = 0.0
+            self.cruise_time = 0.0
+            self.peak_speed = 0.0
+        elif speed * speed / acceleration >= self.distance:
+            # Triangular profile, cruise speed is never reached
+            self.accel_time = math.sqrt(self.distance / acceleration)
+            self.cruise_time = 0.0
+            self.peak_speed = acceleration * self.accel_time
+        else:
+            self.accel_time = speed / acceleration
+            self.cruise_time = (self.distance - speed * self.accel_time) / speed
+            self.peak_speed = speed
+        self.acceleration = acceleration
+        self.duration = 2 * self.accel_time + self.cruise_time
+        self.end_time = start_time + self.duration
+
+    def travelled(self, now):
+        """
+        Distance travelled along the move at the given time.
+        """
+        t = min(max(now - self.start_time, 0.0), self.duration)
+        if t <= self.accel_time:
+            return 0.5 * self.acceleration * t * t
+        accel_distance = 0.5 * self.acceleration * self.accel_time * self.accel_time
+        if t <= self.accel_time + self.cruise_time:
+            return accel_distance + self.peak_speed * (t - self.accel_time)
+        t_decel = t - self.accel_time - self.cruise_time
+        return (accel_distance + self.peak_speed * self.cruise_time +
+                self.peak_speed * t_decel - 0.5 * self.acceleration * t_decel * t_decel)
+
+    def position(self, now):
+        """
+        Estimated (x, y, z) at the given time.
+        """
+        if self.distance == 0 or now >= self.end_time:
+            return self.target
+        fraction = self.travelled(now) / self.distance
+        return tuple(s + (t - s) * fraction for s, t in zip(self.start, self.target))
+
+
+class MotionEstimator:
+    """
+    Dead-reckoned position of the toolhead.
+    1. Commanded moves are queued, each starts when the previous one ends (as in the firmware planner)
+    2. Position at any time is interpolated from the queued moves
+    3. Positions reported by the firmware re-anchor the estimate
+    """
+    def __init__(self, acceleration=1000.0, clock=time.monotonic, max_feedrates=None):
+        """
+        :param acceleration: Acceleration of the printer (mm/s^2).
+        :param clock: Function returning the current time in seconds.
+        :param max_feedrates: Tuple of the speed limits of the firmware per axis (mm/min), in the order of the move
+            targets, None = no limits.
+        """
+        self.acceleration = acceleration
+        self.clock = clock
+        self.max_feedrates = max_feedrates
+        self.segments = deque()  # Queued MoveSegments, oldest first
+        self.anchor = None  # (x, y, z) of the last known position with no move pending after it
+        self.confirmed_at = None  # Clock time of the last confirmation from the firmware
+
+    def planned_end(self):
+        """
+        Position and time where the last queued move ends.
+        """
+        if self.segments:
+            return self.segments[-1].target, self.segments[-1].end_time
+        return self.anchor, None
+
+    def _drop_finished(self, now):
+        while self.segments and self.segments[0].end_time <= now:
+            self.anchor = self.segments.popleft().target
+
+    def _limit_feedrate(self, start, target, feedrate):
+        """
+        Slow the whole move down so that no axis exceeds its speed limit, as the firmware planner does.
+        """
+        if self.max_feedrates is None:
+            return feedrate
+        distance = math.dist(start, target)
+        for begin, end, limit in zip(start, target, self.max_feedrates):
+            delta = abs(end - begin)
+            if delta > 0:
+                feedrate = min(feedrate, limit * distance / delta)
+        return feedrate
+
+    def command_move(self, target, feedrate, now=None):
+        """
+        Queue a commanded move.
+
+        :param target: Tuple (x, y, z) of the move target.
+        :param feedrate: Requested speed (mm/min), limited by max_feedrates.
+        """
+        now = self.clock() if now is None else now
+        self._drop_finished(now)
+        start, end_time = self.planned_end()
+        target = tuple(float(value) for value in target)
+        if start is None:
+            # Nothing known about the position yet, assume we are already there
+            self.anchor = target
+            return
+        start_time = now if end_time is None else max(now, end_time)
+        feedrate = self._limit_feedrate(start, target, feedrate)
+        self.segments.append(MoveSegment(start_time, start, target, feedrate, self.acceleration))
+
+    def confirm(self, position, now=None, tolerance=1.0):
+        """
+        Re-anchor the estimate on a position reported by the firmware. If the estimate is off by more than
+        `tolerance`, pending moves keep their targets and feedrates and are replanned from the reported position.
+
+        :param position: Tuple (x, y, z) reported by the firmware.
+        :param tolerance: Allowed difference between the estimate and the reported position (mm).
+        """
+        now = self.clock() if now is None else now
+        position = tuple(float(value) for value in position)
+        self.confirmed_at = now
+        self._drop_finished(now)
+        if not self.segments:
+            self.anchor = position
+            return
+        if math.dist(self.segments[0].position(now), position) <= tolerance:
+            return  # Estimate is good enough, keep the plan
+
+        pending = list(self.segments)
+        self.segments.clear()
+        self.anchor = position
+        start_time = now
+        for segment in pending:
+            start = self.segments[-1].target if self.segments else position
+            self.segments.append(MoveSegment(start_time, start, segment.target, segment.feedrate, self.acceleration))
+            start_time = self.segments[-1].end_time
+
+    def reset(self, position=None):
+        """
+        Forget all queued moves, e.g. after homing or emergency stop.
+        """
+        self.segments.clear()
+        self.anchor = tuple(float(value) for value in position) if position is not None else None
+
+    def estimate(self, now=None):
+        """
+        Estimated (x, y, z) of the toolhead, or None if the position is unknown.
+        """
+        now = self.clock() if now is None else now
+        self._drop_finished(now)
+        if self.segments:
+            return self.segments[0].position(now)
+        return self.anchor
+
+    def is_moving(self, now=None):
+        """
+        Check if any commanded move is still expected to be in progress.
+        """
+        now = self.clock() if now is None else now
+        self._drop_finished(now)
+        return bool(self.segments)
+
+    def time_to_finish(self, now=None):
+        """
+        Seconds until all queued moves are expected to be finished.
+        """
+        now = self.clock() if now is None else now
+        _, end_time = self.planned_end()
+        return max(end_time - now, 0.0) if end_time is not None else 0.0
@@ -1,22 +1,74 @@
+import math
 import tkinter as tk
+from collections import deque
 from tkinter import messagebox
 
+from pipettify.controllers.controller_deck import calculate_grid_coordinates, slot_name
+from pipettify.gui.gui_viewport import Viewport
+
+# Canvas layers, bottom to top. Static layer (bed, grid lines, labware outlines, tanks) is drawn once and only redrawn
+# when the viewport or the deck layout changes, dynamic layers are updated in place.
+STATIC_LAYER = "layer_static"
+WELLS_LAYER = "layer_wells"
+TRAIL_LAYER = "layer_trail"
+TOOL_LAYER = "layer_tool"
+
+TRAIL_LENGTH = 60  # Number of tool positions kept in the trail
+TRAIL_STEP = 2.0  # Minimal distance (mm) between two trail points
+
 class GuiGridVisualization:
     def __init__(self, canvas, bed_controller, printer_controller):
         self.bed_controller = bed_controller
         self.bed_canvas = canvas
-        self.canvas_size = 400
-        self.margin = 30 # Space around the bed
-        self.bed_width = 220
-        self.bed_height = 220
+        self.viewport = Viewport(canvas_size=400, margin=30, bed_width=220, bed_height=220)
         self.printer_controller = printer_controller
+        self.grid_items = {}  # {tag: {(row, col): [canvas_item_id, coordinates, filled, visible]}}
+        self.grid_viewports = {}  # {tag: viewport version used to draw the items of the tag}
+        self.bed_changes = bed_controller.change_cursor()  # Changes of probes/tips not drawn yet
+        self.last_tool_position = None  # Canvas (x, y) of the drawn tool marker
+        self.tool_item = None  # Canvas item of the tool marker
+        self.trail_item = None  # Canvas item of the tool trail
+        self.trail = deque(maxlen=TRAIL_LENGTH)  # Last tool positions in mm
+        self.static_signature = None  # What the static layer was drawn for
+        self.pan_start = None  # Canvas (x, y) where panning started
+        self.bed_canvas.bind("<Button-1>", self.on_canvas_click)
+
+        # Zoom with the mouse wheel, pan by dragging with the right mouse button
+        self.bed_canvas.bind("<MouseWheel>", self.on_mouse_wheel)  # Windows / macOS
+        self.bed_canvas.bind("<Button-4>", self.on_mouse_wheel)  # Linux scroll up
+        self.bed_canvas.bind("<Button-5>", self.on_mouse_wheel)  # Linux scroll down
+        self.bed_canvas.bind("<ButtonPress-3>", self.on_pan_start)
+        self.bed_canvas.bind("<B3-Motion>", self.on_pan_move)
+
+    @property
+    def canvas_size(self):
+        return self.viewport.canvas_size
+
+    @property
+    def margin(self):
+        return self.viewport.margin
+
+    @property
+    def bed_width(self):
+        return self.viewport.bed_width
+
+    @bed_width.setter
+    def bed_width(self, value):
+        self.viewport.set_bed_size(value, self.viewport.bed_height)
+
+    @property
+    def bed_height(self):
+        return self.viewport.bed_height
+
+    @bed_height.setter
+    def bed_height(self, value):
+        self.viewport.set_bed_size(self.viewport.bed_width, value)
 
     def load_new_bed(self, width_field, height_field):
-        try:            
+        try:
             # Update bed dimensions
-            self.bed_width = int(width_field.get())
-            self.bed_height = int(height_field.get())
-            self.draw_bed_grid()
+            self.viewport.set_bed_size(int(width_field.get()), int(height_field.get()))
+            self.redraw_view()
         except ValueError:
             messagebox.showerror("Error", "Please enter valid numbers for bed dimensions.")
 
@@ -24,82 +76,270 @@ class GuiGridVisualization:
         """
         Invert the Y-coordinate for the canvas to flip the Y-axis.
         """
-        return self.canvas_size - y
+        return self.viewport.invert_y(y)
+
+    def canvas_to_bed(self, canvas_x, canvas_y):
+        """
+        Convert canvas coordinates (e.g. mouse click) to bed coordinates in mm.
+        """
+        return self.viewport.to_bed(canvas_x, canvas_y)
+
+    def on_canvas_click(self, event):
+        """
+        Show which deck slot was clicked, using the deck spatial index.
+        """
+        x_mm, y_mm = self.canvas_to_bed(event.x, event.y)
+        self.bed_canvas.delete("hit_label")
+        hit = self.bed_controller.deck.slot_at(x_mm, y_mm)
+        if hit is None:
+            return
+        labware_name, position = hit
+        self.bed_canvas.create_text(event.x, event.y - 12,
+                                    text=f"{labware_name} {slot_name(*position)}",
+                                    fill="black", tag="hit_label")
+
+    ############################
+    # ZOOM AND PAN
+    ############################
+
+    def on_mouse_wheel(self, event):
+        """
+        Zoom in/out around the mouse pointer.
+        """
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            factor = 1.25
+        else:
+            factor = 1 / 1.25
+        version = self.viewport.version
+        self.viewport.zoom_at(factor, event.x, event.y)
+        if self.viewport.version != version:
+            self.redraw_view()
+
+    def on_pan_start(self, event):
+        self.pan_start = (event.x, event.y)
+
+    def on_pan_move(self, event):
+        """
+        Move the view together with the mouse pointer.
+        """
+        if self.pan_start is None:
+            return
+        self.viewport.pan_by(event.x - self.pan_start[0], event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.redraw_view()
+
+    def reset_view(self):
+        """
+        Go back to the whole bed fitted into the canvas.
+        """
+        version = self.viewport.version
+        self.viewport.reset()
+        if self.viewport.version != version:
+            self.redraw_view()
+
+    def redraw_view(self):
+        """
+        Redraw everything after the viewport changed. Slots are moved (not recreated) and off-screen ones are hidden.
+        """
+        self.bed_canvas.delete("hit_label")
+        self.draw_static_layer()
+        self.bed_changes.reset()
+        self.refresh_grids()
+        self.last_tool_position = None
+        self.draw_tool_position()
+
+    ############################
+    # DRAWING
+    ############################
+
+    def _static_layer_signature(self):
+        """
+        Everything the static layer depends on. Computed only on viewport or deck layout changes, not per frame.
+        """
+        labware = tuple((labware.name, labware.kind, labware.bounding_box())
+                        for labware in self.bed_controller.deck.labware.values())
+        return (self.viewport.version, labware, self.bed_controller.probes_mask, self.bed_controller.tips_mask)
+
+    def draw_static_layer(self, force=False):
+        """
+        Draw the static layer: bed outline, grid lines, scale, labware outlines and tanks.
+        Nothing is done if the viewport and the deck layout did not change since the last call.
+        """
+        signature = self._static_layer_signature()
+        if not force and signature == self.static_signature:
+            return
+        self.static_signature = signature
+
+        self.bed_canvas.delete(STATIC_LAYER)
+        self.draw_bed_grid()
+        if self.bed_controller.deck.labware:  # Nothing to show before the first configuration is applied
+            self.draw_labware_outlines()
+            self.draw_inactive_slots()
+            self.draw_tank_position()
+            self.draw_disposal_tank_position()
+        self.bed_canvas.tag_lower(STATIC_LAYER)
+
+    def draw_labware_outlines(self):
+        """
+        Draw a rectangle around every plate and tip rack on the deck.
+        """
+        self.bed_canvas.delete("labware_outline")
+        for labware in self.bed_controller.deck.labware.values():
+            if labware.kind not in ("plate", "tip_rack"):
+                continue
+            box = labware.bounding_box()
+            if box is None:
+                continue
+            x0, y0 = self.viewport.to_canvas(box[0], box[1])
+            x1, y1 = self.viewport.to_canvas(box[2], box[3])
+            self.bed_canvas.create_rectangle(x0, y0, x1, y1, outline="gray", dash=(4, 2),
+                                             tags=("labware_outline", STATIC_LAYER))
+            self.bed_canvas.create_text(x0, y1 - 2, text=labware.name, fill="gray", anchor="sw",
+                                        tags=("labware_outline", STATIC_LAYER))
+
+    def draw_inactive_slots(self):
+        """
+        Draw slots outside of the active masks as faint circles, so partial plates and half-used racks are visible.
+        """
+        self.bed_canvas.delete("inactive_slot")
+        bed = self.bed_controller
+        grids = ((bed.probes_mask, (bed.probes_top_left, bed.probes_top_right,
+                                    bed.probes_bottom_left, bed.probes_bottom_right), bed.probe_diameter),
+                 (bed.tips_mask, (bed.tips_top_left, bed.tips_top_right,
+                                  bed.tips_bottom_left, bed.tips_bottom_right), bed.tip_diameter))
+        for mask, corners, diameter in grids:
+            inactive = {position: {"coordinates": None} for position in ~mask}
+            if not inactive:
+                continue
+            calculate_grid_coordinates(inactive, *corners, mask.rows, mask.columns)
+            for slot in inactive.values():
+                x_mm, y_mm = slot["coordinates"]
+                if self.viewport.is_visible(x_mm, y_mm, diameter / 2):
+                    self.bed_canvas.create_oval(*self.viewport.circle_box(x_mm, y_mm, diameter / 2),
+                                                outline="lightgray", tags=("inactive_slot", STATIC_LAYER))
 
     def draw_bed_grid(self):
         """
         Draw the bed grid outline on the canvas with an inverted Y-axis.
         """
         self.bed_canvas.delete("grid_line", "bed_outline", "scale_text")
-        
-        # Calculate scaling
-        max_width = self.canvas_size - 2 * self.margin
-        max_height = self.canvas_size - 2 * self.margin
-        scale = min(max_width / self.bed_width, max_height / self.bed_height)
 
         # Define bed boundaries
-        bed_outline_width = self.bed_width * scale
-        bed_outline_height = self.bed_height * scale
-        x0 = (self.canvas_size - bed_outline_width) / 2
-        y0 = (self.canvas_size - bed_outline_height) / 2
-        x1 = x0 + bed_outline_width
-        y1 = y0 + bed_outline_height
+        x0, y0 = self.viewport.to_canvas(0, 0)
+        x1, y1 = self.viewport.to_canvas(self.bed_width, self.bed_height)
 
         # Draw the bed outline with inverted Y
-        self.bed_canvas.create_rectangle(x0, self.invert_y(y0), x1, self.invert_y(y1), outline="blue", width=2, tag="bed_outline")
+        self.bed_canvas.create_rectangle(x0, y0, x1, y1, outline="blue", width=2, tags=("bed_outline", STATIC_LAYER))
 
         # Draw the grid lines
         step = 30 #max(max_height, max_width) // 10
         for i in range(0, int(self.bed_width) + step, step):
-            x = x0 + i * scale
-            if x < x1:
-                self.bed_canvas.create_line(x, self.invert_y(y0), x, self.invert_y(y1), fill="gray", dash=(2, 2), tag="grid_line")
-                self.bed_canvas.create_text(x, self.invert_y(y0) + 5, text=str(i), fill="blue", tag="scale_text", anchor="n")
+            if i < self.bed_width:
+                x, _ = self.viewport.to_canvas(i, 0)
+                self.bed_canvas.create_line(x, y0, x, y1, fill="gray", dash=(2, 2), tags=("grid_line", STATIC_LAYER))
+                self.bed_canvas.create_text(x, y0 + 5, text=str(i), fill="blue", tags=("scale_text", STATIC_LAYER), anchor="n")
 
         for i in range(0, int(self.bed_height) + step, step):
-            y = y0 + i * scale
-            if y < y1:
-                self.bed_canvas.create_line(x0, self.invert_y(y), x1, self.invert_y(y), fill="gray", dash=(2, 2), tag="grid_line")
-                self.bed_canvas.create_text(x0 - 5, self.invert_y(y), text=str(i), fill="blue", tag="scale_text", anchor="e")
+            if i < self.bed_height:
+                _, y = self.viewport.to_canvas(0, i)
+                self.bed_canvas.create_line(x0, y, x1, y, fill="gray", dash=(2, 2), tags=("grid_line", STATIC_LAYER))
+                self.bed_canvas.create_text(x0 - 5, y, text=str(i), fill="blue", tags=("scale_text", STATIC_LAYER), anchor="e")
 
-    def draw_grid(self, grid, rows, columns, outline_color, tag, taken_key):
+    def refresh_grids(self):
         """
-        Draw the probes or tips grid with an inverted Y-axis.
+        Redraw probes and tips that changed since the last refresh, using the BedController change log.
+        Does nothing (no canvas calls, no scan of the grids) if nothing changed.
         """
-        # print("WOLOLOLOLO")
-        # print(grid)
-        self.bed_canvas.delete(tag)
-        # rows = self.bed_controller.probes_rows
-        # columns = self.bed_controller.probes_columns
+        if not self.bed_changes.pending():
+            return
+        changes = self.bed_changes.drain()
+        if changes is None or ("grid", None) in changes:
+            self.draw_static_layer()  # Labware or tanks may have moved
+        for tag, (grid, outline_color, taken_key) in self._grid_styles().items():
+            if changes is None or ("grid", None) in changes:
+                self.draw_grid(grid, 0, 0, outline_color, tag, taken_key)
+                continue
+            positions = [position for name, position in changes if name == tag]
+            if positions:
+                self.draw_grid(grid, 0, 0, outline_color, tag, taken_key, positions=positions)
+
+    def _grid_styles(self):
+        return {
+            "probes": (self.bed_controller.probes, "black", "filled"),
+            "tips": (self.bed_controller.tips, "red", "taken"),
+        }
+
+    def draw_grid(self, grid, rows, columns, outline_color, tag, taken_key, positions=None):
+        """
+        Draw the probes or tips grid with an inverted Y-axis.
+        Canvas items are created once per slot and kept in self.grid_items. On later calls only slots whose state
+        or coordinates changed since the last frame are updated, slots that disappeared from the grid are deleted.
+        Slots outside the viewport are hidden (or not created at all until they scroll into view).
 
+        :param positions: Optional list of (row, col) positions to check, all slots are checked if None.
+        """
         outline_diameter = 8  # Diameter of the probe outline
+        radius_mm = outline_diameter / 2
+        viewport = self.viewport
+
+        # Viewport changed (bed size, zoom, pan) - every item has to be moved
+        viewport_changed = self.grid_viewports.get(tag) != viewport.version
+        if viewport_changed:
+            self.grid_viewports[tag] = viewport.version
+            positions = None
+        items = self.grid_items.setdefault(tag, {})
+        created = False
+
+        if positions is None:
+            slots = grid.items()
+        else:
+            slots = [(position, grid[position]) for position in positions if position in grid]
+
+        # Draw probes with inverted Y
+        for position, slot in slots:
+            coordinates = slot["coordinates"]
+            filled = slot[taken_key]
+            cached = items.get(position)
+            if cached is not None and not viewport_changed and cached[1] == coordinates and cached[2] == filled:
+                continue  # Nothing changed since the last frame
 
-        max_width = self.canvas_size - 2 * self.margin
-        max_height = self.canvas_size - 2 * self.margin
-        scale = min(max_width / self.bed_width, max_height / self.bed_height)
-        x0 = (self.canvas_size - max_width) / 2
-        y0 = (self.canvas_size - max_height) / 2
-
-        # print(f"x0 type: {type(x0)}")
-        
-        # Draw probes with inverted Y        
-        for row in range(rows):
-            for col in range(columns):
-                if (row, col) in grid:
-                    probe_x = x0 + (grid[(row, col)]["coordinates"][0]) * scale
-                    probe_y = y0 + (grid[(row, col)]["coordinates"][1]) * scale
-                    filled = grid[(row, col)][taken_key]
-                    color = "red" if filled else "white"
-                    self.bed_canvas.create_oval(
-                        probe_x - outline_diameter * scale / 2,
-                        self.invert_y(probe_y + outline_diameter * scale / 2),
-                        probe_x + outline_diameter * scale / 2,
-                        self.invert_y(probe_y - outline_diameter * scale / 2),
-                        outline=outline_color,
-                        fill=color,
-                        width=2,
-                        tag=tag,
-                    )
+            visible = viewport.is_visible(coordinates[0], coordinates[1], radius_mm)
+            color = "red" if filled else "white"
+
+            if cached is None:
+                if visible:  # Off-screen slots are created once they scroll into view
+                    item = self.bed_canvas.create_oval(*viewport.circle_box(coordinates[0], coordinates[1], radius_mm),
+                                                       outline=outline_color, fill=color, width=2,
+                                                       tags=(tag, WELLS_LAYER))
+                    items[position] = [item, coordinates, filled, True]
+                    created = True
+                continue
+
+            if not visible:
+                if cached[3]:
+                    self.bed_canvas.itemconfig(cached[0], state="hidden")
+                    cached[3] = False
+                continue
+
+            if viewport_changed or cached[1] != coordinates:
+                self.bed_canvas.coords(cached[0], *viewport.circle_box(coordinates[0], coordinates[1], radius_mm))
+                cached[1] = coordinates
+            if cached[2] != filled:
+                self.bed_canvas.itemconfig(cached[0], fill=color)
+                cached[2] = filled
+            if not cached[3]:
+                self.bed_canvas.itemconfig(cached[0], state="normal")
+                cached[3] = True
+
+        # Remove slots that are no longer part of the grid
+        if positions is None:
+            for position in [position for position in items if position not in grid]:
+                self.bed_canvas.delete(items.pop(position)[0])
+
+        # New items are created on top, keep the trail and the tool above the wells
+        if created:
+            self.bed_canvas.tag_raise(TRAIL_LAYER)
+            self.bed_canvas.tag_raise(TOOL_LAYER)
 
 
     def draw_tool_position(self):
@@ -107,36 +347,40 @@ class GuiGridVisualization:
         Draw the tool position on the bed canvas with an inverted Y-axis.
         """
         try:
-            x_mm = self.printer_controller.curr_x
-            y_mm = self.printer_controller.curr_y
-
-            # Scale the coordinates to fit the canvas
-            max_width = self.canvas_size - 2 * self.margin
-            max_height = self.canvas_size - 2 * self.margin
-            scale = min(max_width / self.bed_width, max_height / self.bed_height)
-            bed_outline_width = self.bed_width * scale
-            bed_outline_height = self.bed_height * scale
-            x0 = (self.canvas_size - bed_outline_width) / 2
-            y0 = (self.canvas_size - bed_outline_height) / 2
+            position = self.printer_controller.estimated_position()  # Dead-reckoned, no serial query
+            if position is None:
+                return  # Position not known yet
+            x_mm, y_mm = position[0], position[1]
 
             # Convert tool position to canvas coordinates with inverted Y
-            tool_x = x0 + x_mm * scale
-            tool_y = y0 + y_mm * scale
+            tool_x, tool_y = self.viewport.to_canvas(x_mm, y_mm)
+            if self.last_tool_position == (tool_x, tool_y):
+                return  # Tool did not move since the last frame
+            self.last_tool_position = (tool_x, tool_y)
+            if not self.trail or math.dist(self.trail[-1], (x_mm, y_mm)) >= TRAIL_STEP:
+                self.trail.append((x_mm, y_mm))
 
-            # Clear the previous tool position
-            self.bed_canvas.delete("tool_position")
-
-            # Draw a new tool position (as a blue circle)
+            # Move the tool marker (as a blue circle), it is created only once
             radius = 5  # Radius of the tool indicator
-            self.bed_canvas.create_oval(
-                tool_x - radius, self.invert_y(tool_y) - radius,
-                tool_x + radius, self.invert_y(tool_y) + radius,
-                fill="blue", tag="tool_position"
-            )
+            box = (tool_x - radius, tool_y - radius, tool_x + radius, tool_y + radius)
+            if self.tool_item is None:
+                self.tool_item = self.bed_canvas.create_oval(*box, fill="blue", tags=("tool_position", TOOL_LAYER))
+            else:
+                self.bed_canvas.coords(self.tool_item, *box)
+
+            # Trail of the last positions, a single line item
+            if len(self.trail) >= 2:
+                points = [coordinate for x, y in self.trail for coordinate in self.viewport.to_canvas(x, y)]
+                if self.trail_item is None:
+                    self.trail_item = self.bed_canvas.create_line(*points, fill="lightblue", width=2,
+                                                                  tags=("tool_trail", TRAIL_LAYER))
+                    self.bed_canvas.tag_raise(TOOL_LAYER)
+                else:
+                    self.bed_canvas.coords(self.trail_item, *points)
         except Exception as e:
             print(f"Error updating tool position: {e}")
-            
-    
+
+
     def draw_tank_position(self):
         """
         Draw the tank position on the bed canvas with an inverted Y-axis.
@@ -145,18 +389,8 @@ class GuiGridVisualization:
             x_mm = self.bed_controller.refilling_tank[0]
             y_mm = self.bed_controller.refilling_tank[1]
 
-            # Scale the coordinates to fit the canvas
-            max_width = self.canvas_size - 2 * self.margin
-            max_height = self.canvas_size - 2 * self.margin
-            scale = min(max_width / self.bed_width, max_height / self.bed_height)
-            bed_outline_width = self.bed_width * scale
-            bed_outline_height = self.bed_height * scale
-            x0 = (self.canvas_size - bed_outline_width) / 2
-            y0 = (self.canvas_size - bed_outline_height) / 2
-
             # Convert tank position to canvas coordinates with inverted Y
-            tank_x = x0 + x_mm * scale
-            tank_y = y0 + y_mm * scale
+            tank_x, tank_y = self.viewport.to_canvas(x_mm, y_mm)
 
             # Clear the previous tank position
             self.bed_canvas.delete("tank_position")
@@ -164,20 +398,20 @@ class GuiGridVisualization:
             # Draw a new tank position (as a green circle)
             radius = 20  # Radius of the tank indicator
             self.bed_canvas.create_oval(
-                tank_x - radius, self.invert_y(tank_y) - radius,
-                tank_x + radius, self.invert_y(tank_y) + radius,
-                fill="green", tag="tank_position"
+                tank_x - radius, tank_y - radius,
+                tank_x + radius, tank_y + radius,
+                fill="green", tags=("tank_position", STATIC_LAYER)
             )
-            
+
             # Add text to the tank position "Refilling Tank"
             self.bed_canvas.create_text(
-                tank_x, self.invert_y(tank_y) - 30,
-                text="Refilling Tank", fill="green", tag="tank_position"
+                tank_x, tank_y - 30,
+                text="Refilling Tank", fill="green", tags=("tank_position", STATIC_LAYER)
             )
         except Exception as e:
             print(f"Error updating tank position: {e}")
-            
-            
+
+
     def draw_disposal_tank_position(self):
         """
         Draw the disposal tank position on the bed canvas with an inverted Y-axis.
@@ -186,18 +420,8 @@ class GuiGridVisualization:
             x_mm = self.bed_controller.disposal_tank[0]
             y_mm = self.bed_controller.disposal_tank[1]
 
-            # Scale the coordinates to fit the canvas
-            max_width = self.canvas_size - 2 * self.margin
-            max_height = self.canvas_size - 2 * self.margin
-            scale = min(max_width / self.bed_width, max_height / self.bed_height)
-            bed_outline_width = self.bed_width * scale
-            bed_outline_height = self.bed_height * scale
-            x0 = (self.canvas_size - bed_outline_width) / 2
-            y0 = (self.canvas_size - bed_outline_height) / 2
-
             # Convert tank position to canvas coordinates with inverted Y
-            tank_x = x0 + x_mm * scale
-            tank_y = y0 + y_mm * scale
+            tank_x, tank_y = self.viewport.to_canvas(x_mm, y_mm)
 
             # Clear the previous tank position
             self.bed_canvas.delete("disposal_tank_position")
@@ -205,15 +429,15 @@ class GuiGridVisualization:
             # Draw a new tank position (as a red circle)
             radius = 20  # Radius of the tank indicator
             self.bed_canvas.create_oval(
-                tank_x - radius, self.invert_y(tank_y) - radius,
-                tank_x + radius, self.invert_y(tank_y) + radius,
-                fill="red", tag="disposal_tank_position"
+                tank_x - radius, tank_y - radius,
+                tank_x + radius, tank_y + radius,
+                fill="red", tags=("disposal_tank_position", STATIC_LAYER)
             )
-            
+
             # Add text to the tank position "Disposal Tank"
             self.bed_canvas.create_text(
-                tank_x, self.invert_y(tank_y) - 30,
-                text="Disposal Tank", fill="red", tag="disposal_tank_position"
+                tank_x, tank_y - 30,
+                text="Disposal Tank", fill="red", tags=("disposal_tank_position", STATIC_LAYER)
             )
         except Exception as e:
             print(f"Error updating disposal tank position: {e}")
@@ -1,51 +1,110 @@
-import json
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
 
+from pipettify.controllers.controller_config import BedConfig
+
 class ConfigImportExport:
     def __init__(self, interface):
         """
-        Initialize the import/export utility.
+        Initialize the import/export utility. The configuration itself lives in BedConfig, the entries of the
+        interface only show and edit it.
         :param interface: Reference to the PrinterGUI instance for accessing field values.
         """
         self.interface = interface
 
+    def _entries(self):
+        """
+        Map of dotted configuration paths to the entries showing them.
+        """
+        interface = self.interface
+        return {
+            "bed_width": interface.bed_width_entry,
+            "bed_height": interface.bed_height_entry,
+            "probes_rows": interface.probes_rows_entry,
+            "probes_columns": interface.probes_columns_entry,
+            "probes.top_left.0": interface.probe_tl_x_entry,
+            "probes.top_left.1": interface.probe_tl_y_entry,
+            "probes.top_right.0": interface.probe_tr_x_entry,
+            "probes.top_right.1": interface.probe_tr_y_entry,
+            "probes.bottom_left.0": interface.probe_bl_x_entry,
+            "probes.bottom_left.1": interface.probe_bl_y_entry,
+            "probes.bottom_right.0": interface.probe_br_x_entry,
+            "probes.bottom_right.1": interface.probe_br_y_entry,
+            "active_probe_slots": interface.active_probe_slots_entry,
+            "tips_rows": interface.tips_rows_entry,
+            "tips_columns": interface.tips_columns_entry,
+            "tips.top_left.0": interface.tip_tl_x_entry,
+            "tips.top_left.1": interface.tip_tl_y_entry,
+            "tips.top_right.0": interface.tip_tr_x_entry,
+            "tips.top_right.1": interface.tip_tr_y_entry,
+            "tips.bottom_left.0": interface.tip_bl_x_entry,
+            "tips.bottom_left.1": interface.tip_bl_y_entry,
+            "tips.bottom_right.0": interface.tip_br_x_entry,
+            "tips.bottom_right.1": interface.tip_br_y_entry,
+            "active_tip_slots": interface.active_tip_slots_entry,
+            "refilling_tank.0": interface.refilling_tank_x_entry,
+            "refilling_tank.1": interface.refilling_tank_y_entry,
+            "disposal_tank.0": interface.disposal_tank_x_entry,
+            "disposal_tank.1": interface.disposal_tank_y_entry,
+            "z_heights.safe_z": interface.safe_z_height_entry,
+            "z_heights.dispensing_z": interface.dispensing_height_entry,
+            "z_heights.change_tip_z": interface.change_tip_height_entry,
+            "z_heights.drop_tip_z": interface.drop_tip_height_entry,
+            "z_heights.refilling_z": interface.refilling_height_entry,
+            "probe_volume": interface.probe_volume_entry,
+            "nominal_volume": interface.nominal_volume_entry,
+            "liquid_class": interface.liquid_class_entry,
+            "channels": interface.channels_entry,
+        }
+
+    @staticmethod
+    def _format(value):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    def show_config(self, config):
+        """
+        Fill the entries from a BedConfig.
+        """
+        data = config.to_dict()
+        for path, entry in self._entries().items():
+            value = data
+            for key in path.split("."):
+                value = value[int(key)] if key.isdigit() else value[key]
+            entry.delete(0, tk.END)
+            entry.insert(0, self._format(value))
+
+    def config_from_entries(self):
+        """
+        Build a BedConfig from the values typed into the entries. Fields without an entry (liquid class definitions)
+        are taken from the applied configuration.
+
+        :raises ValueError: If any value is invalid.
+        """
+        data = self.interface.config.to_dict()
+        for path, entry in self._entries().items():
+            keys = path.split(".")
+            index = int(keys.pop()) if keys[-1].isdigit() else None  # X/Y entry of a point
+            target = data
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            if index is None:
+                target[keys[-1]] = entry.get()
+            else:
+                target.setdefault(keys[-1], [None, None])[index] = entry.get()
+        return BedConfig.from_dict(data)
+
     def export_config(self):
         """
         Export the current configuration to a JSON file.
         """
-        config = {
-            "bed_width": self.interface.bed_width_entry.get(),
-            "bed_height": self.interface.bed_height_entry.get(),
-            "probes_rows": self.interface.probes_rows_entry.get(),
-            "probes_columns": self.interface.probes_columns_entry.get(),
-            "probes": {
-                "top_left": (self.interface.probe_tl_x_entry.get(), self.interface.probe_tl_y_entry.get()),
-                "top_right": (self.interface.probe_tr_x_entry.get(), self.interface.probe_tr_y_entry.get()),
-                "bottom_left": (self.interface.probe_bl_x_entry.get(), self.interface.probe_bl_y_entry.get()),
-                "bottom_right": (self.interface.probe_br_x_entry.get(), self.interface.probe_br_y_entry.get()),
-            },
-            "active_probe_slots": self.interface.active_probe_slots_entry.get(),
-            "tips_rows": self.interface.tips_rows_entry.get(),
-            "tips_columns": self.interface.tips_columns_entry.get(),
-            "tips": {
-                "top_left": (self.interface.tip_tl_x_entry.get(), self.interface.tip_tl_y_entry.get()),
-                "top_right": (self.interface.tip_tr_x_entry.get(), self.interface.tip_tr_y_entry.get()),
-                "bottom_left": (self.interface.tip_bl_x_entry.get(), self.interface.tip_bl_y_entry.get()),
-                "bottom_right": (self.interface.tip_br_x_entry.get(), self.interface.tip_br_y_entry.get()),
-            },
-            "active_tip_slots": self.interface.active_tip_slots_entry.get(),
-            "refilling_tank": (self.interface.refilling_tank_x_entry.get(), self.interface.refilling_tank_y_entry.get()),
-            "disposal_tank": (self.interface.disposal_tank_x_entry.get(), self.interface.disposal_tank_y_entry.get()),
-            "z_heights": {
-                "safe_z": self.interface.safe_z_height_entry.get(),
-                "dispensing_z": self.interface.dispensing_height_entry.get(),
-                "change_tip_z": self.interface.change_tip_height_entry.get(),
-                "drop_tip_z": self.interface.drop_tip_height_entry.get(),
-                "refilling_z": self.interface.refilling_height_entry.get(),
-            }
-        }
+        try:
+            config = self.config_from_entries()
+        except ValueError as e:
+            messagebox.showerror("Export Error", str(e))
+            return
 
         # Save to a file
         file_path = filedialog.asksaveasfilename(
@@ -55,15 +114,14 @@ class ConfigImportExport:
         )
         if file_path:
             try:
-                with open(file_path, 'w') as file:
-                    json.dump(config, file, indent=4)
+                config.to_json_file(file_path)
                 messagebox.showinfo("Export Configuration", "Configuration exported successfully!")
             except Exception as e:
                 messagebox.showerror("Export Error", f"Failed to export configuration: {e}")
 
     def import_config(self):
         """
-        Import a configuration from a JSON file and update GUI fields.
+        Import a configuration from a JSON file, apply it and update GUI fields.
         """
         # Load from a file
         file_path = filedialog.askopenfilename(
@@ -72,92 +130,9 @@ class ConfigImportExport:
         )
         if file_path:
             try:
-                with open(file_path, 'r') as file:
-                    config = json.load(file)
-
-                # Update GUI fields
-                self.interface.bed_width_entry.delete(0, tk.END)
-                self.interface.bed_width_entry.insert(0, config["bed_width"])
-                self.interface.bed_height_entry.delete(0, tk.END)
-                self.interface.bed_height_entry.insert(0, config["bed_height"])
-
-                self.interface.probes_rows_entry.delete(0, tk.END)
-                self.interface.probes_rows_entry.insert(0, config["probes_rows"])
-                self.interface.probes_columns_entry.delete(0, tk.END)
-                self.interface.probes_columns_entry.insert(0, config["probes_columns"])
-
-                self.interface.probe_tl_x_entry.delete(0, tk.END)
-                self.interface.probe_tl_x_entry.insert(0, config["probes"]["top_left"][0])
-                self.interface.probe_tl_y_entry.delete(0, tk.END)
-                self.interface.probe_tl_y_entry.insert(0, config["probes"]["top_left"][1])
-
-                self.interface.probe_tr_x_entry.delete(0, tk.END)
-                self.interface.probe_tr_x_entry.insert(0, config["probes"]["top_right"][0])
-                self.interface.probe_tr_y_entry.delete(0, tk.END)
-                self.interface.probe_tr_y_entry.insert(0, config["probes"]["top_right"][1])
-
-                self.interface.probe_bl_x_entry.delete(0, tk.END)
-                self.interface.probe_bl_x_entry.insert(0, config["probes"]["bottom_left"][0])
-                self.interface.probe_bl_y_entry.delete(0, tk.END)
-                self.interface.probe_bl_y_entry.insert(0, config["probes"]["bottom_left"][1])
-
-                self.interface.probe_br_x_entry.delete(0, tk.END)
-                self.interface.probe_br_x_entry.insert(0, config["probes"]["bottom_right"][0])
-                self.interface.probe_br_y_entry.delete(0, tk.END)
-                self.interface.probe_br_y_entry.insert(0, config["probes"]["bottom_right"][1])
-
-                self.interface.active_probe_slots_entry.delete(0, tk.END)
-                self.interface.active_probe_slots_entry.insert(0, config["active_probe_slots"])
-
-                self.interface.tips_rows_entry.delete(0, tk.END)
-                self.interface.tips_rows_entry.insert(0, config["tips_rows"])
-                self.interface.tips_columns_entry.delete(0, tk.END)
-                self.interface.tips_columns_entry.insert(0, config["tips_columns"])
-
-                self.interface.tip_tl_x_entry.delete(0, tk.END)
-                self.interface.tip_tl_x_entry.insert(0, config["tips"]["top_left"][0])
-                self.interface.tip_tl_y_entry.delete(0, tk.END)
-                self.interface.tip_tl_y_entry.insert(0, config["tips"]["top_left"][1])
-
-                self.interface.tip_tr_x_entry.delete(0, tk.END)
-                self.interface.tip_tr_x_entry.insert(0, config["tips"]["top_right"][0])
-                self.interface.tip_tr_y_entry.delete(0, tk.END)
-                self.interface.tip_tr_y_entry.insert(0, config["tips"]["top_right"][1])
-
-                self.interface.tip_bl_x_entry.delete(0, tk.END)
-                self.interface.tip_bl_x_entry.insert(0, config["tips"]["bottom_left"][0])
-                self.interface.tip_bl_y_entry.delete(0, tk.END)
-                self.interface.tip_bl_y_entry.insert(0, config["tips"]["bottom_left"][1])
-
-                self.interface.tip_br_x_entry.delete(0, tk.END)
-                self.interface.tip_br_x_entry.insert(0, config["tips"]["bottom_right"][0])
-                self.interface.tip_br_y_entry.delete(0, tk.END)
-                self.interface.tip_br_y_entry.insert(0, config["tips"]["bottom_right"][1])
-
-                self.interface.refilling_tank_x_entry.delete(0, tk.END)
-                self.interface.refilling_tank_x_entry.insert(0, config["refilling_tank"][0])
-                self.interface.refilling_tank_y_entry.delete(0, tk.END)
-                self.interface.refilling_tank_y_entry.insert(0, config["refilling_tank"][1])
-
-                self.interface.disposal_tank_x_entry.delete(0, tk.END)
-                self.interface.disposal_tank_x_entry.insert(0, config["disposal_tank"][0])
-                self.interface.disposal_tank_y_entry.delete(0, tk.END)
-                self.interface.disposal_tank_y_entry.insert(0, config["disposal_tank"][1])
-                
-                self.interface.active_tip_slots_entry.delete(0, tk.END)
-                self.interface.active_tip_slots_entry.insert(0, config["active_tip_slots"])
-
-                self.interface.safe_z_height_entry.delete(0, tk.END)
-                self.interface.safe_z_height_entry.insert(0, config["z_heights"]["safe_z"])
-                self.interface.dispensing_height_entry.delete(0, tk.END)
-                self.interface.dispensing_height_entry.insert(0, config["z_heights"]["dispensing_z"])
-                self.interface.change_tip_height_entry.delete(0, tk.END)
-                self.interface.change_tip_height_entry.insert(0, config["z_heights"]["change_tip_z"])
-                self.interface.drop_tip_height_entry.delete(0, tk.END)
-                self.interface.drop_tip_height_entry.insert(0, config["z_heights"]["drop_tip_z"])
-                self.interface.refilling_height_entry.delete(0, tk.END)
-                self.interface.refilling_height_entry.insert(0, config["z_heights"]["refilling_z"])
-
+                config = BedConfig.from_json_file(file_path)
+                self.interface.apply_config(config)
+                self.show_config(config)
                 messagebox.showinfo("Import Configuration", "Configuration imported successfully!")
             except Exception as e:
                 messagebox.showerror("Import Error", f"Failed to import configuration: {e}")
@@ -1,15 +1,37 @@
+import math
 import threading
 import tkinter as tk
+from tkinter import filedialog
 from tkinter import messagebox
 from pipettify.controllers.controller_printer import PrinterController
 from pipettify.controllers.controller_bed import BedController
+from pipettify.controllers.controller_config import BedConfig
 from pipettify.gui.gui_manual_movement import ManualMovementWindow
 from pipettify.gui.gui_tool_calibration import CalibrateToolWindow
 from pipettify.gui.gui_grid_visualization import GuiGridVisualization
 from pipettify.gui.gui_import_export_config import ConfigImportExport
+from pipettify.sequence_control.sequence_worklist import Worklist
+from pipettify.telemetry.telemetry_logging import ring_buffer
 
 from functools import partial
 
+# Configuration shown when the app starts
+DEFAULT_CONFIG = {
+    "bed_width": 300,
+    "bed_height": 300,
+    "probes_rows": 5,
+    "probes_columns": 5,
+    "probes": {"top_left": [42, 10], "top_right": [250, 10], "bottom_left": [42, 150], "bottom_right": [250, 150]},
+    "active_probe_slots": 25,
+    "tips_rows": 5,
+    "tips_columns": 5,
+    "tips": {"top_left": [200, 200], "top_right": [280, 200], "bottom_left": [200, 280], "bottom_right": [280, 280]},
+    "active_tip_slots": 25,
+    "refilling_tank": [120, 250],
+    "disposal_tank": [40, 250],
+    "z_heights": {"safe_z": 50, "dispensing_z": 40, "change_tip_z": 40, "drop_tip_z": 40, "refilling_z": 40},
+}
+
 class PrinterGUI(tk.Tk):
     def __init__(self, printer_controller, bed_controller, state_machine):
         super().__init__()
@@ -23,6 +45,12 @@ class PrinterGUI(tk.Tk):
         # State machine variables
         self.stop_flag = threading.Event()
         self.state_machine_polling_interval = 300  # Poll every 100ms
+        self._polling_job = None  # Tk "after" id of the next state machine poll
+        self.tool_animation_interval = 33  # Redraw the dead-reckoned tool marker ~30 times per second
+        self.tool_confirmation_interval = 5000  # Confirm the tool position with M114 every 5 s when idle
+        self.log_refresh_interval = 500  # Append new log messages to the log tail every 500 ms
+        self.log_tail_lines = 200  # Lines kept in the log tail
+        self._log_sequence = 0  # Sequence number of the last message shown
 
         # Add "Manual Movement" button
         tk.Button(self, text="Manual Movement", command=self.open_manual_movement).pack(pady=10)
@@ -64,6 +92,7 @@ class PrinterGUI(tk.Tk):
         self.bed_height_entry.grid(row=1, column=1)
         
         tk.Button(bed_dim_frame, text="Load New Bed Dimensions", command=lambda: self.gui_grid_visualization.load_new_bed(self.bed_width_entry, self.bed_height_entry)).grid(row=2, column=0, columnspan=2, pady=5)
+        tk.Button(bed_dim_frame, text="Reset View", command=self.gui_grid_visualization.reset_view).grid(row=3, column=0, columnspan=2)
         self.gui_grid_visualization.load_new_bed(self.bed_width_entry, self.bed_height_entry) # Draw the bed grid at the start
 
         # Right Panel (Configuration Controls)
@@ -182,10 +211,10 @@ class PrinterGUI(tk.Tk):
         # Active slots calibration
         ##############################
         tk.Label(slot_pos_frame, text="Active Slots:").grid(row=7, column=0, sticky="w")
-        self.active_probe_slots_entry = tk.Entry(slot_pos_frame, width=5)
-        self.active_probe_slots_entry.grid(row=7, column=1)
-        self.active_tip_slots_entry = tk.Entry(slot_pos_frame, width=5, )
-        self.active_tip_slots_entry.grid(row=7, column=4, padx=(slot_pos_frame_padding_x, 0))
+        self.active_probe_slots_entry = tk.Entry(slot_pos_frame, width=10)
+        self.active_probe_slots_entry.grid(row=7, column=1, columnspan=2, sticky="we")  # Count or mask, e.g. "A1:D6"
+        self.active_tip_slots_entry = tk.Entry(slot_pos_frame, width=10)
+        self.active_tip_slots_entry.grid(row=7, column=4, columnspan=2, sticky="we", padx=(slot_pos_frame_padding_x, 0))
 
         ##############################
         # Z height calibration
@@ -224,6 +253,25 @@ class PrinterGUI(tk.Tk):
         self.drop_tip_height_entry.grid(row=5, column=1)
         tk.Button(z_height_frame, text="set", command=partial(self.calibrate_slot, "drop_tip_z")).grid(row=5, column=3, sticky="e")
 
+        ##############################
+        # Volumes
+        ##############################
+        tk.Label(z_height_frame, text="Probe volume (uL):").grid(row=6, column=0, sticky="w")
+        self.probe_volume_entry = tk.Entry(z_height_frame, width=5)
+        self.probe_volume_entry.grid(row=6, column=1)
+
+        tk.Label(z_height_frame, text="Pipette volume (uL):").grid(row=7, column=0, sticky="w")
+        self.nominal_volume_entry = tk.Entry(z_height_frame, width=5)
+        self.nominal_volume_entry.grid(row=7, column=1)
+
+        tk.Label(z_height_frame, text="Liquid class:").grid(row=8, column=0, sticky="w")
+        self.liquid_class_entry = tk.Entry(z_height_frame, width=10)
+        self.liquid_class_entry.grid(row=8, column=1, columnspan=2, sticky="w")
+
+        tk.Label(z_height_frame, text="Channels:").grid(row=9, column=0, sticky="w")
+        self.channels_entry = tk.Entry(z_height_frame, width=5)
+        self.channels_entry.grid(row=9, column=1)
+
         # Move to Coordinates Section
         move_frame = tk.Frame(right_panel)
         move_frame.pack(anchor="w", pady=5)
@@ -245,6 +293,13 @@ class PrinterGUI(tk.Tk):
         tk.Button(config_button_frame, text="Export Configuration", command=self.gui_import_export.export_config).grid(row=0, column=1)
         tk.Button(config_button_frame, text="Apply Configuration", command=self.load_new_config).grid(row=0, column=2)
 
+        # Log tail, recent messages of the logging ring buffer
+        log_frame = tk.Frame(right_panel)
+        log_frame.pack(anchor="w", fill="x", pady=5)
+        tk.Label(log_frame, text="Log", font=("Arial", 12, "bold")).pack(anchor="w")
+        self.log_text = tk.Text(log_frame, height=8, width=80, state="disabled", wrap="none")
+        self.log_text.pack(fill="x")
+
         # Home XYZ button
         tk.Button(move_frame, text="Home", command=self.printer_controller.home).grid(row=0, column=5)
 
@@ -263,46 +318,22 @@ class PrinterGUI(tk.Tk):
         self.run_button = tk.Button(controls_frame, text="Run", fg="green", command=self.run_state_machine_execution)
         self.run_button.pack(side="left", padx=5)
 
-        self.probes_rows_entry.insert(0, 5)
-        self.probes_columns_entry.insert(0, 5)
-
-        self.probe_tl_x_entry.insert(0, 42)
-        self.probe_tl_y_entry.insert(0, 10)
-        self.probe_tr_x_entry.insert(0, 250)
-        self.probe_tr_y_entry.insert(0, 10)
-        self.probe_bl_x_entry.insert(0, 42)
-        self.probe_bl_y_entry.insert(0, 150)
-        self.probe_br_x_entry.insert(0, 250)
-        self.probe_br_y_entry.insert(0, 150)
-
-        self.tips_rows_entry.insert(0, 5)
-        self.tips_columns_entry.insert(0, 5)
-
-        self.tip_tl_x_entry.insert(0, 200)
-        self.tip_tl_y_entry.insert(0, 200)
-        self.tip_tr_x_entry.insert(0, 280)
-        self.tip_tr_y_entry.insert(0, 200)
-        self.tip_bl_x_entry.insert(0, 200)
-        self.tip_bl_y_entry.insert(0, 280)
-        self.tip_br_x_entry.insert(0, 280)
-        self.tip_br_y_entry.insert(0, 280)
-        
-        self.active_probe_slots_entry.insert(0, 25)
-        self.active_tip_slots_entry.insert(0, 25)
+        self.worklist_button = tk.Button(controls_frame, text="Load Worklist", command=self.load_worklist)
+        self.worklist_button.pack(side="left", padx=5)
 
-        self.refilling_tank_x_entry.insert(0, 120)
-        self.refilling_tank_y_entry.insert(0, 250)
-        self.disposal_tank_x_entry.insert(0, 40)
-        self.disposal_tank_y_entry.insert(0, 250)
+        self.new_plate_button = tk.Button(controls_frame, text="New Plate", command=self.new_plate)
+        self.new_plate_button.pack(side="left", padx=5)
 
-        self.safe_z_height_entry.insert(0, 50)
-        self.dispensing_height_entry.insert(0, 40)
-        self.change_tip_height_entry.insert(0, 40)
-        self.drop_tip_height_entry.insert(0, 40)
-        self.refilling_height_entry.insert(0, 40)
+        self.new_tip_rack_button = tk.Button(controls_frame, text="New Tip Rack", command=self.new_tip_rack)
+        self.new_tip_rack_button.pack(side="left", padx=5)
+
+        self.config = BedConfig.from_dict(DEFAULT_CONFIG)  # Applied configuration, entries only show/edit it
+        self.gui_import_export.show_config(self.config)
 
         self.refresh_display()
+        self.animate_tool_position()
         self.refresh_tool_position()
+        self.refresh_log_tail()
         self.start_state_machine_polling()
 
     def update_state_display(self):
@@ -313,106 +344,90 @@ class PrinterGUI(tk.Tk):
 
     def load_new_config(self):
         """
-        Update ProbeGrid.
+        Apply the configuration typed into the entries.
         """
         print("LOAD NEW CONFIG")
         try:
-            probes_rows = int(self.probes_rows_entry.get())
-            probes_columns = int(self.probes_columns_entry.get())
-            probes_top_left_x = float(self.probe_tl_x_entry.get())
-            probes_top_left_y = float(self.probe_tl_y_entry.get())
-            probes_top_right_x = float(self.probe_tr_x_entry.get())
-            probes_top_right_y = float(self.probe_tr_y_entry.get())
-            probes_bottom_left_x = float(self.probe_bl_x_entry.get())
-            probes_bottom_left_y = float(self.probe_bl_y_entry.get())
-            probes_bottom_right_x = float(self.probe_br_x_entry.get())
-            probes_bottom_right_y = float(self.probe_br_y_entry.get())
-
-            tips_rows = int(self.tips_rows_entry.get())
-            tips_columns = int(self.tips_columns_entry.get())
-            tips_top_left_x = float(self.tip_tl_x_entry.get())
-            tips_top_left_y = float(self.tip_tl_y_entry.get())
-            tips_top_right_x = float(self.tip_tr_x_entry.get())
-            tips_top_right_y = float(self.tip_tr_y_entry.get())
-            tips_bottom_left_x = float(self.tip_bl_x_entry.get())
-            tips_bottom_left_y = float(self.tip_bl_y_entry.get())
-            tips_bottom_right_x = float(self.tip_br_x_entry.get())
-            tips_bottom_right_y = float(self.tip_br_y_entry.get())
-
-            refilling_tank_x = float(self.refilling_tank_x_entry.get())
-            refilling_tank_y = float(self.refilling_tank_y_entry.get())
-            disposal_tank_x = float(self.disposal_tank_x_entry.get())
-            disposal_tank_y = float(self.disposal_tank_y_entry.get())
-
-            probes_active_slots = int(self.active_probe_slots_entry.get())
-            tips_active_slots = int(self.active_tip_slots_entry.get())
-
-            safe_z = float(self.safe_z_height_entry.get())
-            dispensing_z = float(self.dispensing_height_entry.get())
-            change_tip_z = float(self.change_tip_height_entry.get())
-            drop_tip_z = float(self.drop_tip_height_entry.get())
-            refilling_z = float(self.refilling_height_entry.get())
-
-
-            # Update ProbeGrid
-            self.bed_controller.make_new_grid(
-                probes_rows=probes_rows,
-                probes_columns=probes_columns,
-                probes_top_left= (probes_top_left_x, probes_top_left_y),
-                probes_top_right = (probes_top_right_x, probes_top_right_y),
-                probes_bottom_left = (probes_bottom_left_x, probes_bottom_left_y),
-                probes_bottom_right=(probes_bottom_right_x, probes_bottom_right_y),
-                tips_rows=tips_rows,
-                tips_columns=tips_columns,
-                tips_top_left=(tips_top_left_x, tips_top_left_y),
-                tips_top_right=(tips_top_right_x, tips_top_right_y),
-                tips_bottom_left=(tips_bottom_left_x, tips_bottom_left_y),
-                tips_bottom_right=(tips_bottom_right_x, tips_bottom_right_y),
-                refilling_tank=(refilling_tank_x, refilling_tank_y),
-                disposal_tank=(disposal_tank_x, disposal_tank_y),
-                probes_number=probes_active_slots,
-                tips_number=tips_active_slots,
-                safe_z = safe_z,
-                dispensing_z = dispensing_z,
-                change_tip_z = change_tip_z,
-                drop_tip_z = drop_tip_z,
-                refilling_z = refilling_z
-            )
-
-            self.gui_grid_visualization.draw_tank_position()
-            self.gui_grid_visualization.draw_disposal_tank_position()
-
-            messagebox.showinfo("Load Config", "New configuration loaded!")
-        except ValueError:
-            messagebox.showerror("Error", "Please enter valid numbers for configuration settings.")
-    
+            config = self.gui_import_export.config_from_entries()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        changed = self.apply_config(config)
+        if changed:
+            messagebox.showinfo("Load Config", f"New configuration loaded! Changed: {', '.join(sorted(changed))}.")
+        else:
+            messagebox.showinfo("Load Config", "Configuration did not change.")
+
+    def apply_config(self, config):
+        """
+        Apply a BedConfig to the bed and tool controllers and redraw the bed view.
+
+        :param config: BedConfig to apply.
+        :return: Set of what changed, see BedController.make_new_grid.
+        """
+        changed = config.apply_to(self.bed_controller, self.printer_controller.tool_controller)
+        self.config = config
+        self.gui_grid_visualization.viewport.set_bed_size(config.bed_width, config.bed_height)
+        self.gui_grid_visualization.redraw_view()
+        return changed
+
+    def new_plate(self):
+        """
+        Mark all probes as empty, e.g. after a new plate was placed on the bed.
+        """
+        if messagebox.askyesno("New Plate", "Mark all probes as empty?"):
+            self.bed_controller.clear_slot_states(probes=True, tips=False)
+
+    def new_tip_rack(self):
+        """
+        Mark all tips as available, e.g. after the tip rack was refilled.
+        """
+        if messagebox.askyesno("New Tip Rack", "Mark all tips as available?"):
+            self.bed_controller.clear_slot_states(probes=False, tips=True)
+
     def refresh_display(self):
         """
-        Refresh the display to show the current state of the grid and tool position. Do it every second.
+        Refresh the display to show the current state of the grid. Do it every 300 ms.
         # # """
-        # print(f"Refreshing display, tool position -> X: {self.printer_controller.curr_x}, Y: {self.printer_controller.curr_y}")
-        self.gui_grid_visualization.draw_grid(grid = self.bed_controller.probes,
-                                              rows = self.bed_controller.probes_rows,
-                                              columns = self.bed_controller.probes_columns,
-                                              outline_color = "black",
-                                              tag="probes",
-                                              taken_key="filled")
-
-        self.gui_grid_visualization.draw_grid(grid = self.bed_controller.tips,
-                                              rows = self.bed_controller.tips_rows,
-                                              columns = self.bed_controller.tips_columns,
-                                              outline_color = "red",
-                                              tag="tips",
-                                              taken_key="taken")
-        self.gui_grid_visualization.draw_tool_position()
+        self.gui_grid_visualization.refresh_grids()
         self.after(300, self.refresh_display)
-        
+
+    def animate_tool_position(self):
+        """
+        Move the tool marker to the dead-reckoned position, ~30 frames per second. No serial communication is done.
+        """
+        self.gui_grid_visualization.draw_tool_position()
+        self.after(self.tool_animation_interval, self.animate_tool_position)
+
     def refresh_tool_position(self):
         """
-        Refresh the tool position by sending request through printer controller Do it every 500 ms.
+        Confirm the dead-reckoned tool position by sending M114 through printer controller.
+        While a sequence runs, the state machine already queries the position, so it is only done when the machine is
+        idle or completed and the estimate expects no movement.
         """
-        self.printer_controller.update_current_coordinates()
-        self.after(400, self.refresh_tool_position)
+        state_id = self.state_machine.current_state.id
+        if state_id in ("idle", "completed") and not self.printer_controller.motion.is_moving():
+            self.printer_controller.update_current_coordinates()
+        self.after(self.tool_confirmation_interval, self.refresh_tool_position)
+
+    def refresh_log_tail(self):
+        """
+        Append the log messages logged since the last refresh to the log tail. Only new messages are inserted, the
+        oldest lines are removed once the tail is full.
+        """
+        buffer = ring_buffer()
+        if buffer is not None:
+            records = buffer.tail(self.log_tail_lines, since=self._log_sequence)
+            if records:
+                self._log_sequence = records[-1][0]
+                self.log_text.config(state="normal")
+                self.log_text.insert(tk.END, "".join(f"{message}\n" for _, _, message in records))
+                excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.log_tail_lines
+                if excess > 0:
+                    self.log_text.delete("1.0", f"{excess + 1}.0")
+                self.log_text.see(tk.END)
+                self.log_text.config(state="disabled")
+        self.after(self.log_refresh_interval, self.refresh_log_tail)
 
     def calibrate_slot(self, slot: str):
         """
@@ -532,8 +547,46 @@ class PrinterGUI(tk.Tk):
         if self.stop_flag.is_set():
             return
 
+        if self._polling_job is not None:
+            self.after_cancel(self._polling_job)  # Restarted (Run button), keep a single polling chain
         state_completed = self.state_machine.poll()
-        self.after(self.state_machine_polling_interval, self.start_state_machine_polling)
+        # Next poll after the polling interval, or right at the end of a dwell (the Tk loop keeps running meanwhile)
+        delay = self.state_machine.next_poll_delay(self.state_machine_polling_interval / 1000)
+        self._polling_job = self.after(max(1, math.ceil(delay * 1000)), self._poll_state_machine)
+
+    def _poll_state_machine(self):
+        self._polling_job = None
+        self.start_state_machine_polling()
+
+    def load_worklist(self):
+        """
+        Load a worklist (CSV/JSON transfer list) that drives the next run. Apply the configuration first,
+        the worklist is validated against the current deck.
+        """
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Worklists", "*.csv *.json *.jsonl *.ndjson"), ("All files", "*.*")],
+            title="Load Worklist"
+        )
+        if not file_path:
+            return
+        try:
+            worklist = Worklist(file_path, self.bed_controller,
+                                liquid_classes=self.printer_controller.tool_controller.liquid_classes)
+        except ValueError as e:
+            messagebox.showerror("Worklist Error", str(e))
+            return
+
+        errors = worklist.validate()
+        if errors:
+            messagebox.showerror("Worklist Error", "\n".join(errors[:10]))
+            return
+
+        try:
+            self.state_machine.load_worklist(worklist)
+        except ValueError as e:
+            messagebox.showerror("Worklist Error", str(e))
+            return
+        messagebox.showinfo("Load Worklist", f"Worklist loaded, starting at row {worklist.completed}.")
 
     def run_state_machine_execution(self):
         """
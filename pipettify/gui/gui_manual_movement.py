@@ -59,47 +59,35 @@ class ManualMovementWindow(tk.Toplevel):
         self.z_entry.grid(row=4, column=3)
         tk.Button(frame, text="Move to", command=self.move_to_coordinates).grid(row=4, column=4)
 
+    def jog(self, dx=0.0, dy=0.0, dz=0.0):
+        """
+        Move relative to where the last commanded move ends, so quick repeated clicks add up without waiting for the
+        printer to report its position.
+        """
+        position = self.printer_controller.commanded_position()
+        if position is None:
+            self.printer_controller.update_current_coordinates()
+            position = (self.printer_controller.curr_x, self.printer_controller.curr_y, self.printer_controller.curr_z)
+        x, y, z = position
+        self.printer_controller.move_to_coordinates(x + dx, y + dy, z + dz)
+
     def move_y_positive(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x,
-            self.printer_controller.curr_y + self.step_size,
-            self.printer_controller.curr_z
-        )
+        self.jog(dy=self.step_size)
 
     def move_y_negative(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x,
-            self.printer_controller.curr_y - self.step_size,
-            self.printer_controller.curr_z
-        )
+        self.jog(dy=-self.step_size)
 
     def move_x_negative(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x - self.step_size,
-            self.printer_controller.curr_y,
-            self.printer_controller.curr_z
-        )
+        self.jog(dx=-self.step_size)
 
     def move_x_positive(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x + self.step_size,
-            self.printer_controller.curr_y,
-            self.printer_controller.curr_z
-        )
+        self.jog(dx=self.step_size)
 
     def move_up_z(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x,
-            self.printer_controller.curr_y,
-            self.printer_controller.curr_z + self.step_size
-        )
+        self.jog(dz=self.step_size)
 
     def move_down_z(self):
-        self.printer_controller.move_to_coordinates(
-            self.printer_controller.curr_x,
-            self.printer_controller.curr_y,
-            self.printer_controller.curr_z - self.step_size
-        )
+        self.jog(dz=-self.step_size)
 
     def set_step_size(self):
         try:
@@ -0,0 +1,171 @@
+# This file implements the viewport of the bed view - the transform between bed coordinates (mm) and canvas
+# coordinates (pixels, Y axis inverted). The transform is computed once and cached, it is only invalidated when the bed
+# size, the canvas size, the zoom or the pan changes. Every invalidation increases `version`, so the drawing code can
+# tell whether items drawn earlier are still in the right place.
+
+class Viewport:
+    """
+    Cached bed -> canvas transform with zoom, pan and visibility checks for off-screen culling.
+    """
+    def __init__(self, canvas_size=400, margin=30, bed_width=220, bed_height=220):
+        """
+        :param canvas_size: Size of the (square) canvas in pixels.
+        :param margin: Space around the bed in pixels, at zoom 1.
+        :param bed_width: Bed width in mm.
+        :param bed_height: Bed height in mm.
+        """
+        self.canvas_size = canvas_size
+        self.margin = margin
+        self.bed_width = bed_width
+        self.bed_height = bed_height
+        self.min_zoom = 1.0
+        self.max_zoom = 20.0
+
+        self.zoom = 1.0
+        self.pan_x = 0.0  # Pan in pixels, relative to the fitted (zoom 1) position
+        self.pan_y = 0.0
+        self.version = 0  # Increased on every change of the transform
+        self._transform = None  # Cached (scale, x0, y0)
+
+    ############################
+    # CHANGES
+    ############################
+
+    def _invalidate(self):
+        self._transform = None
+        self.version += 1
+
+    def set_bed_size(self, bed_width, bed_height):
+        """
+        Update bed dimensions (mm). Zoom and pan are reset, the old ones would not point at the same place.
+        """
+        if (bed_width, bed_height) == (self.bed_width, self.bed_height):
+            return
+        self.bed_width = bed_width
+        self.bed_height = bed_height
+        self.zoom = 1.0
+        self.pan_x = 0.0
+        self.pan_y = 0.0
+        self._invalidate()
+
+    def set_canvas_size(self, canvas_size):
+        """
+        Update canvas size (pixels).
+        """
+        if canvas_size == self.canvas_size:
+            return
+        self.canvas_size = canvas_size
+        self._invalidate()
+
+    def zoom_at(self, factor, canvas_x, canvas_y):
+        """
+        Zoom by `factor`, keeping the bed point under (canvas_x, canvas_y) in place.
+        """
+        new_zoom = min(max(self.zoom * factor, self.min_zoom), self.max_zoom)
+        if new_zoom == self.zoom:
+            return
+        x_mm, y_mm = self.to_bed(canvas_x, canvas_y)
+        self.zoom = new_zoom
+        self._invalidate()
+
+        # Move the zoomed point back under the cursor
+        new_x, new_y = self.to_canvas(x_mm, y_mm)
+        self.pan_by(canvas_x - new_x, canvas_y - new_y)
+
+    def pan_by(self, dx, dy):
+        """
+        Move the view by (dx, dy) pixels.
+        """
+        if dx == 0 and dy == 0:
+            return
+        self.pan_x += dx
+        self.pan_y += dy
+        self._invalidate()
+
+    def reset(self):
+        """
+        Go back to the whole bed fitted into the canvas.
+        """
+        if self.zoom == 1.0 and self.pan_x == 0.0 and self.pan_y == 0.0:
+            return
+        self.zoom = 1.0
+        self.pan_x = 0.0
+        self.pan_y = 0.0
+        self._invalidate()
+
+    ############################
+    # TRANSFORM
+    ############################
+
+    @property
+    def transform(self):
+        """
+        Get the cached transform (scale, x0, y0): canvas_x = x0 + x_mm * scale, canvas_y = invert(y0 + y_mm * scale).
+        """
+        if self._transform is None:
+            max_width = self.canvas_size - 2 * self.margin
+            max_height = self.canvas_size - 2 * self.margin
+            fit_scale = min(max_width / self.bed_width, max_height / self.bed_height)
+            x0 = (self.canvas_size - self.bed_width * fit_scale) / 2
+            y0 = (self.canvas_size - self.bed_height * fit_scale) / 2
+
+            # Zoom around the canvas centre, then pan (pan_y is in canvas pixels, Y axis is inverted)
+            center = self.canvas_size / 2
+            scale = fit_scale * self.zoom
+            x0 = center + (x0 - center) * self.zoom + self.pan_x
+            y0 = center + (y0 - center) * self.zoom - self.pan_y
+            self._transform = (scale, x0, y0)
+        return self._transform
+
+    @property
+    def scale(self):
+        return self.transform[0]
+
+    def invert_y(self, y):
+        """
+        Invert the Y-coordinate for the canvas to flip the Y-axis.
+        """
+        return self.canvas_size - y
+
+    def to_canvas(self, x_mm, y_mm):
+        """
+        Convert bed coordinates (mm) to canvas coordinates (pixels).
+        """
+        scale, x0, y0 = self.transform
+        return x0 + x_mm * scale, self.canvas_size - (y0 + y_mm * scale)
+
+    def to_bed(self, canvas_x, canvas_y):
+        """
+        Convert canvas coordinates (pixels) to bed coordinates (mm).
+        """
+        scale, x0, y0 = self.transform
+        return (canvas_x - x0) / scale, (self.canvas_size - canvas_y - y0) / scale
+
+    def circle_box(self, x_mm, y_mm, radius_mm):
+        """
+        Get the canvas bounding box (x0, y0, x1, y1) of a circle given in bed coordinates.
+        """
+        center_x, center_y = self.to_canvas(x_mm, y_mm)
+        radius = radius_mm * self.transform[0]
+        return center_x - radius, center_y - radius, center_x + radius, center_y + radius
+
+    ############################
+    # CULLING
+    ############################
+
+    def visible_bed_rect(self):
+        """
+        Get the part of the bed visible on the canvas, (min_x, min_y, max_x, max_y) in mm.
+        """
+        left, top = self.to_bed(0, 0)
+        right, bottom = self.to_bed(self.canvas_size, self.canvas_size)
+        return min(left, right), min(top, bottom), max(left, right), max(top, bottom)
+
+    def is_visible(self, x_mm, y_mm, radius_mm=0.0):
+        """
+        Check if a circle given in bed coordinates is at least partially visible on the canvas.
+        """
+        center_x, center_y = self.to_canvas(x_mm, y_mm)
+        radius = radius_mm * self.transform[0]
+        return (-radius <= center_x <= self.canvas_size + radius and
+                -radius <= center_y <= self.canvas_size + radius)
@@ -0,0 +1,226 @@
+#####################
+### HEADLESS APP ####
+#####################
+
+# Runs the pipetting sequence without the GUI, e.g. from scripts:
+#   python -m pipettify.headless_app demo_config.json --port /dev/ttyUSB0 [--worklist transfers.csv]
+# With a source plate in the configuration, --replicate copies every source well into the same probe well and
+# --order-transfers reorders the transfers (replication or worklist) to shorten the travel.
+# A run can be recorded (--record-serial run.bin) and replayed offline without a printer (--replay-serial run.bin),
+# at the recorded speed or as fast as possible (--replay-speed fast).
+#
+# Only the standard library and the configuration are imported at module level. Controllers (numpy), the state machine
+# (statemachine) and pyserial are imported once the arguments and the config are checked, tkinter is never imported.
+
+import argparse
+import sys
+import time
+
+from pipettify.controllers.controller_config import BedConfig
+from pipettify.telemetry.telemetry_logging import configure_logging, get_logger, shutdown_logging
+
+logger = get_logger("headless_app")
+
+
+def print_progress(start_time, state_name, bed_controller):
+    """
+    Log a single progress line: elapsed time, state and filled probes.
+    """
+    filled = sum(1 for probe in bed_controller.probes.values() if probe["filled"])
+    logger.info("[%8.1fs] %-22s probes %d/%d", time.monotonic() - start_time, state_name, filled,
+                len(bed_controller.probes))
+
+
+def run(args):
+    """
+    Connect to the printer, apply the configuration and poll the state machine until the sequence is completed.
+    Log messages are written until the end of the run, also when it fails.
+
+    :return: Process exit code.
+    """
+    start_time = time.monotonic()
+    try:
+        configure_logging(args.log_level, args.log_file)
+    except (OSError, ValueError) as e:
+        print(f"Could not configure logging: {e}", file=sys.stderr)
+        return 2
+    try:
+        return _run(args, start_time)
+    finally:
+        shutdown_logging()
+
+
+def _run(args, start_time):
+    try:
+        bed_config = BedConfig.from_json_file(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Could not load configuration {args.config}: {e}", file=sys.stderr)
+        return 2
+
+    # Heavy imports only now, after the cheap checks passed
+    from pipettify.controllers.controller_geometry_cache import GeometryCache
+    from pipettify.controllers.controller_printer import PrinterController
+    from pipettify.sequence_control.sequence_scheduler import DwellScheduler, VirtualClock, run_until_completed
+    from pipettify.sequence_control.sequence_state_machine import PipettifyStateMachine
+
+    printer = PrinterController()
+    if args.replay_serial and args.replay_speed == "fast":
+        clock = VirtualClock()
+        printer.use_clock(clock, clock.sleep)
+    clock = printer.clock
+    if args.trace:
+        from pipettify.telemetry.telemetry_tracing import Tracer
+
+        printer.use_tracer(Tracer(clock=clock))
+    metrics_server = None
+    if args.metrics_port is not None or args.metrics_file:
+        from pipettify.telemetry.telemetry_metrics import MetricsServer, RunMetrics
+
+        printer.use_metrics(RunMetrics(clock=clock))
+        if args.metrics_port is not None:
+            try:
+                metrics_server = MetricsServer(printer.metrics, port=args.metrics_port).start()
+            except OSError as e:
+                print(f"Could not start the metrics server on port {args.metrics_port}: {e}", file=sys.stderr)
+                return 2
+            logger.info("Metrics at http://127.0.0.1:%d/metrics", metrics_server.port)
+    bed_controller = printer.bed_controller
+    bed_controller.geometry_cache = GeometryCache()
+    bed_config.apply_to(bed_controller, printer.tool_controller)
+
+    state_machine = PipettifyStateMachine(printer_controller=printer,
+                                          pipette_controller=printer.tool_controller,
+                                          bed_controller=bed_controller,
+                                          scheduler=DwellScheduler(clock=clock, sleep=printer.sleep))
+    worklist = None
+    if args.worklist:
+        from pipettify.sequence_control.sequence_worklist import Worklist
+
+        worklist = Worklist(args.worklist, bed_controller, liquid_classes=printer.tool_controller.liquid_classes)
+        errors = worklist.validate()
+        if errors:
+            for error in errors:
+                print(error, file=sys.stderr)
+            return 2
+    elif args.replicate:
+        if not bed_controller.has_source_plate():
+            print("--replicate needs a source plate in the configuration.", file=sys.stderr)
+            return 2
+        from pipettify.sequence_control.sequence_transfer import TransferList, replicate_transfers
+
+        worklist = TransferList(replicate_transfers(bed_controller))
+    if worklist is not None and args.order_transfers:
+        from pipettify.sequence_control.sequence_transfer import TransferList, order_transfers, travel_distance
+
+        entries = list(worklist)  # A reordered worklist is not resumable, its progress is not saved
+        ordered = order_transfers(entries, bed_controller)
+        logger.info("Transfers ordered, travel %.0f mm instead of %.0f mm.", travel_distance(ordered, bed_controller),
+                    travel_distance(entries, bed_controller))
+        worklist = TransferList(ordered)
+    if worklist is not None:
+        try:
+            state_machine.load_worklist(worklist)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    replay_timeout = None
+    if args.replay_serial:
+        from pipettify.controllers.controller_serial_log import ReplaySerial
+
+        try:
+            printer.serial = ReplaySerial(args.replay_serial, clock=clock)
+        except (OSError, ValueError) as e:
+            print(f"Could not load the serial log {args.replay_serial}: {e}", file=sys.stderr)
+            return 2
+        replay_timeout = printer.serial.recorded_duration + 60.0  # A diverged replay stops once the recorded input is over
+        printer.wait_until_ready(timeout=args.ready_timeout)
+    else:
+        try:
+            printer.configure_serial_connection(port=args.port, baudrate=args.baudrate,
+                                                ready_timeout=args.ready_timeout, record_path=args.record_serial)
+        except Exception as e:
+            print(f"Could not connect to the printer: {e}", file=sys.stderr)
+            return 1
+    if args.home:
+        printer.home()
+    printer.update_current_coordinates()
+    logger.info("Ready after %.2fs", time.monotonic() - start_time)
+
+    scheduler = state_machine.scheduler
+    if args.progress_interval > 0:
+        # Heartbeat, keeps reporting during long waits
+        scheduler.call_every(args.progress_interval,
+                             lambda: print_progress(start_time, state_machine.current_state.name, bed_controller))
+
+    if args.metrics_file:
+        scheduler.call_every(args.metrics_interval, printer.metrics.write_textfile, args.metrics_file)
+
+    state_machine.start_pipetting()
+    try:
+        completed = run_until_completed(state_machine, args.poll_interval,
+                                        on_change=lambda: print_progress(start_time, state_machine.current_state.name,
+                                                                         bed_controller),
+                                        timeout=replay_timeout)
+    except KeyboardInterrupt:
+        printer.emergency_stop()
+        print("Interrupted.", file=sys.stderr)
+        return 130
+    finally:
+        if args.trace:
+            printer.tracer.export_chrome_trace(args.trace)
+            print(f"Trace written to {args.trace}", file=sys.stderr)
+        if args.metrics_file:
+            printer.metrics.write_textfile(args.metrics_file)
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.record_serial and printer.serial is not None:
+            printer.serial.close()
+
+    print_progress(start_time, state_machine.current_state.name, bed_controller)
+    if args.replay_serial:
+        divergence = printer.serial.divergence
+        if divergence is None:
+            logger.info("Replay followed the recording (%d commands).", printer.serial.commands_written)
+        else:
+            logger.warning("Replay diverged at command %d: recorded %r, sent %r", *divergence)
+    return 0 if completed else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipetting sequence without the GUI.")
+    parser.add_argument("config", help="Configuration JSON exported from the GUI.")
+    parser.add_argument("--port", default="/dev/ttyUSB0", help="Serial port of the printer.")
+    parser.add_argument("--baudrate", type=int, default=115200, help="Serial baudrate.")
+    job = parser.add_mutually_exclusive_group()
+    job.add_argument("--worklist", help="Optional worklist (CSV/JSON/JSONL) driving the run.")
+    job.add_argument("--replicate", action="store_true",
+                     help="Copy every well of the source plate into the same well of the probes plate.")
+    parser.add_argument("--order-transfers", action="store_true",
+                        help="Reorder the transfers to shorten the travel (the worklist progress is not saved).")
+    parser.add_argument("--home", action="store_true", help="Home the printer before the run.")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="State machine polling interval (s).")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Print the progress at least this often (s), 0 = only on changes.")
+    parser.add_argument("--trace", help="Write a Chrome trace (chrome://tracing, Perfetto) of the run to this file.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics during the run.")
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics to this file during the run.")
+    parser.add_argument("--metrics-interval", type=float, default=15.0,
+                        help="How often the metrics file is rewritten (s), must be positive.")
+    parser.add_argument("--record-serial", help="Record all serial traffic of the run into this binary log.")
+    parser.add_argument("--replay-serial", help="Replay a recorded serial log instead of connecting to the printer.")
+    parser.add_argument("--replay-speed", choices=("recorded", "fast"), default="recorded",
+                        help="Replay at the recorded speed or as fast as possible (virtual clock).")
+    parser.add_argument("--log-level", default="INFO", help="Lowest level logged (DEBUG, INFO, WARNING, ...).")
+    parser.add_argument("--log-file", help="Also write the log to this file.")
+    parser.add_argument("--ready-timeout", type=float, default=10.0,
+                        help="How long to wait for the firmware to answer after connecting (s).")
+    args = parser.parse_args(argv)
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be positive")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
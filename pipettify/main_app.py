@@ -2,13 +2,11 @@
 ### MAIN APP ####
 #################
 
-from pipettify.controllers.controller_printer import PrinterController
-from pipettify.controllers.controller_bed import BedController
-from pipettify.gui.gui_main import PrinterGUI
-from pipettify.sequence_control.sequence_state_machine import PipettifyStateMachine
-
+import argparse
 import time
 
+# For runs without the GUI, see pipettify.headless_app
+
 
 # def main():
 #     printer = PrinterController()
@@ -32,11 +30,39 @@ import time
 #     #                  bed_controller = bed_controller,
 #     #                  state_machine = state_machine)
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipettify GUI.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics while the GUI runs.")
+    parser.add_argument("--log-level", default="INFO", help="Lowest level logged (DEBUG, INFO, WARNING, ...).")
+    parser.add_argument("--log-file", help="Also write the log to this file.")
+    args = parser.parse_args(argv)
+
+    from pipettify.telemetry.telemetry_logging import configure_logging, shutdown_logging
+
+    try:
+        configure_logging(args.log_level, args.log_file)
+    except (OSError, ValueError) as e:
+        parser.error(f"Could not configure logging: {e}")
+
+    # Imported here, so importing this module does not pull in tkinter and the controllers
+    from pipettify.controllers.controller_geometry_cache import GeometryCache
+    from pipettify.controllers.controller_printer import PrinterController
+    from pipettify.gui.gui_main import PrinterGUI
+    from pipettify.sequence_control.sequence_state_machine import PipettifyStateMachine
+
     printer = PrinterController()
+    metrics_server = None
+    if args.metrics_port is not None:
+        from pipettify.telemetry.telemetry_metrics import MetricsServer, RunMetrics
+
+        printer.use_metrics(RunMetrics())
+        metrics_server = MetricsServer(printer.metrics, port=args.metrics_port).start()
+        print(f"Metrics at http://127.0.0.1:{metrics_server.port}/metrics")
     printer.configure_serial_connection()
 
     bed_controller = printer.bed_controller
+    bed_controller.geometry_cache = GeometryCache()
     
     # print("KEK")
     # printer.update_current_coordinates()
@@ -55,6 +81,9 @@ def main():
                      state_machine = state_machine)
 
     app.mainloop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    shutdown_logging()
 
 if __name__ == "__main__":
     main()
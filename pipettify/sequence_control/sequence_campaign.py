@@ -0,0 +1,358 @@
+# This file implements campaigns - one large job shared by several printers connected to the same host.
+# The transfers of the job (worklist rows, or "fill every active probe") are split into units of work, e.g. one unit
+# per destination plate or per plate column. Every printer starts with a contiguous share of the units, so it works
+# on neighbouring wells. Each printer pulls its transfers through a CampaignLane, which looks like a Worklist to its
+# PipettifyStateMachine (next_entry / mark_done).
+# The lanes rebalance the work while the campaign runs:
+#   - a printer whose queue runs empty steals the last queued unit of the printer with the most work left (work
+#     stealing), so machines that finish early keep working until the whole job is done
+#   - a printer that faults gives back its queue and the unfinished transfers of its current unit, the remaining
+#     printers take them over
+# Completed transfers are recorded in a progress index shared by all lanes and protected by a lock, next to the
+# BedController state of the printer that did them.
+#
+# All printers must have the same deck layout (configuration), the transfers are addressed by labware and slot.
+
+import threading
+from collections import deque, namedtuple
+
+from pipettify.sequence_control.sequence_scheduler import run_until_completed
+from pipettify.sequence_control.sequence_worklist import WorklistEntry
+from pipettify.telemetry.telemetry_logging import get_logger
+
+logger = get_logger("sequence_campaign")
+
+SPLITS = ("plate", "column", "row", "transfer")
+IDLE_CHECK_INTERVAL = 1.0  # How often (s) a printer without work checks whether another printer failed
+
+WorkUnit = namedtuple("WorkUnit", ["key", "entries"])
+"""
+Group of transfers handed out together.
+key - (labware_name,) for plates, (labware_name, col) for columns, (labware_name, row) for rows, (index,) for transfers
+entries - deque of WorklistEntry not handed out yet
+"""
+
+
+def unit_key(entry, split):
+    """
+    Get the key of the unit a transfer belongs to.
+
+    :param entry: WorklistEntry.
+    :param split: One of SPLITS.
+    """
+    labware_name, (row, col) = entry.destination
+    if split == "plate":
+        return (labware_name,)
+    if split == "column":
+        return labware_name, col
+    if split == "row":
+        return labware_name, row
+    return (entry.index,)
+
+
+def fill_entries(bed_controller, source="refilling_tank"):
+    """
+    Get the transfers filling every active probe of the bed that still needs liquid, in route order: the remaining
+    volume when the bed tracks volumes, otherwise one full dispense (volume 0) per unfilled probe.
+
+    :param bed_controller: BedController with the configured grid.
+    :param source: Labware the liquid is aspirated from (single slot).
+    :return: List of WorklistEntry.
+    """
+    source_slot = (source, next(iter(bed_controller.deck.get_labware(source).slots)))
+    if bed_controller.tracks_volumes():
+        positions = [tuple(int(value) for value in position) for position in bed_controller.wells_below_target()]
+        volumes = [float(bed_controller.target_volumes[row, col] - bed_controller.dispensed_volumes[row, col])
+                   for row, col in positions]
+    else:
+        positions = [position for position, probe in bed_controller.probes.items() if not probe["filled"]]
+        volumes = [0.0] * len(positions)
+    return [WorklistEntry(index, source_slot, ("probes", position), volume)
+            for index, (position, volume) in enumerate(zip(positions, volumes))]
+
+
+class Campaign:
+    """
+    Shared, thread-safe queues of work units of several printers.
+    """
+    def __init__(self, entries, printers, split="column"):
+        """
+        :param entries: Iterable of WorklistEntry, the whole job (e.g. a Worklist or fill_entries()).
+        :param printers: Names of the printers, e.g. their serial ports.
+        :param split: How the job is split into units: "plate", "column", "row" (of the destination labware) or
+            "transfer" (every transfer is a unit).
+        :raises ValueError: If the split is unknown or there are no printers.
+        """
+        if split not in SPLITS:
+            raise ValueError(f"Unknown split {split!r}, expected one of {', '.join(SPLITS)}.")
+        printers = list(printers)
+        if not printers:
+            raise ValueError("A campaign needs at least one printer.")
+        if len(set(printers)) != len(printers):
+            raise ValueError("Printer names of a campaign must be unique.")
+        self.split = split
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Notified when transfers are completed or handed over
+
+        units = {}  # {key: WorkUnit}, in the order of the first transfer of every unit
+        for entry in entries:
+            key = unit_key(entry, split)
+            if key not in units:
+                units[key] = WorkUnit(key, deque())
+            units[key].entries.append(entry)
+        units = list(units.values())
+        self.total = sum(len(unit.entries) for unit in units)
+
+        # Contiguous shares, the first printers get one unit more if the units do not divide evenly
+        self.queues = {}  # {printer: deque of WorkUnit}
+        start = 0
+        for number, printer in enumerate(printers):
+            count = len(units) // len(printers) + (1 if number < len(units) % len(printers) else 0)
+            self.queues[printer] = deque(units[start:start + count])
+            start += count
+        self.current = {printer: None for printer in printers}  # {printer: WorkUnit in progress}
+        self.in_flight = {printer: {} for printer in printers}  # {printer: {index: entry handed out, not done}}
+        self.progress = {}  # {entry index: printer}, the shared progress index of the completed transfers
+        self.steals = {printer: 0 for printer in printers}  # Units taken over from other printers
+        self.failed = set()
+        self.stopped = False  # Set by stop(), no more transfers are handed out
+
+    def lane(self, printer):
+        """
+        Get the worklist-like view of the campaign for one printer, see PipettifyStateMachine.load_worklist.
+        """
+        if printer not in self.queues:
+            raise KeyError(f"Printer {printer} is not part of the campaign.")
+        return CampaignLane(self, printer)
+
+    ############################
+    # DISTRIBUTION
+    ############################
+
+    @staticmethod
+    def _queued(queue):
+        return sum(len(unit.entries) for unit in queue)
+
+    def _remaining_of(self, printer):
+        current = self.current[printer]
+        return self._queued(self.queues[printer]) + (len(current.entries) if current is not None else 0)
+
+    def next_entry(self, printer):
+        """
+        Hand out the next transfer of a printer: from its current unit, its own queue, or stolen from the queue of the
+        printer with the most work left. With nothing left to take but other printers still working, it waits: one of
+        them may fail and hand its work over.
+
+        :return: WorklistEntry, or None if the campaign has no work left for the printer or was stopped.
+        """
+        with self.changed:
+            while printer not in self.failed and not self.stopped:
+                unit = self.current[printer]
+                if unit is None or not unit.entries:
+                    unit = self._take_unit(printer)
+                    self.current[printer] = unit
+                if unit is not None:
+                    entry = unit.entries.popleft()
+                    self.in_flight[printer][entry.index] = entry
+                    return entry
+                if not self._others_working(printer):
+                    return None
+                self.changed.wait(IDLE_CHECK_INTERVAL)
+            return None
+
+    def _others_working(self, printer):
+        for other in self.queues:
+            if other == printer or other in self.failed:
+                continue
+            current = self.current[other]
+            if self.in_flight[other] or (current is not None and current.entries):
+                return True
+        return False
+
+    def _take_unit(self, printer):
+        queue = self.queues[printer]
+        if queue:
+            return queue.popleft()
+        victims = [other for other in self.queues if other != printer and self.queues[other]]
+        if not victims:
+            return None
+        # The unit furthest from where the victim works now, so the two printers do not meet in the same plate area
+        victim = max(victims, key=lambda other: self._queued(self.queues[other]))
+        unit = self.queues[victim].pop()
+        self.steals[printer] += 1
+        logger.info("%s took over %s from %s.", printer, _describe(unit.key), victim)
+        return unit
+
+    def stop(self):
+        """
+        Stop handing out transfers, printers waiting for work are woken up. Transfers in progress can still complete.
+        """
+        with self.changed:
+            self.stopped = True
+            self.changed.notify_all()
+
+    def complete(self, printer, entry):
+        """
+        Record a completed transfer in the progress index.
+        """
+        with self.changed:
+            self.in_flight[printer].pop(entry.index, None)
+            self.progress[entry.index] = printer
+            self.changed.notify_all()
+
+    def fail(self, printer):
+        """
+        Take a faulted printer out of the campaign. Its queued units, the rest of its current unit and the transfer it
+        was doing go to the remaining printers, the printer with the least work left first.
+
+        :return: Number of transfers handed over.
+        """
+        with self.changed:
+            if printer in self.failed:
+                return 0
+            self.failed.add(printer)
+            self.changed.notify_all()
+            units = list(self.queues[printer])
+            self.queues[printer].clear()
+            current = self.current[printer]
+            self.current[printer] = None
+            unfinished = deque(sorted(self.in_flight[printer].values(), key=lambda entry: entry.index))
+            self.in_flight[printer].clear()
+            if current is not None:
+                unfinished.extend(current.entries)
+                if unfinished:
+                    units.insert(0, WorkUnit(current.key, unfinished))
+            elif unfinished:
+                units.insert(0, WorkUnit(unit_key(unfinished[0], self.split), unfinished))
+
+            handed_over = sum(len(unit.entries) for unit in units)
+            alive = [other for other in self.queues if other not in self.failed]
+            if not alive:
+                self.queues[printer].extend(units)  # Nobody left, keep the work for remaining()
+                logger.error("%s failed, no printer is left to take over %d transfers.", printer, handed_over)
+                return 0
+            for unit in units:
+                receiver = min(alive, key=self._remaining_of)
+                self.queues[receiver].append(unit)
+            self.changed.notify_all()
+            logger.warning("%s failed, %d transfers handed over to %s.", printer, handed_over, ", ".join(alive))
+            return handed_over
+
+    ############################
+    # PROGRESS
+    ############################
+
+    def completed(self, printer=None):
+        """
+        Get the number of completed transfers, of one printer or of all of them.
+        """
+        with self.lock:
+            if printer is None:
+                return len(self.progress)
+            return sum(1 for done_by in self.progress.values() if done_by == printer)
+
+    def remaining(self):
+        """
+        Get the number of transfers not completed yet (queued, in progress or left by failed printers).
+        """
+        with self.lock:
+            return self.total - len(self.progress)
+
+    def is_finished(self):
+        return self.remaining() == 0
+
+    def summary(self):
+        """
+        Get the progress per printer.
+
+        :return: Dictionary {printer: {"completed": .., "remaining": .., "steals": .., "failed": ..}}.
+        """
+        with self.lock:
+            done = {printer: 0 for printer in self.queues}
+            for printer in self.progress.values():
+                done[printer] += 1
+            return {printer: {"completed": done[printer],
+                              "remaining": self._remaining_of(printer) + len(self.in_flight[printer]),
+                              "steals": self.steals[printer],
+                              "failed": printer in self.failed}
+                    for printer in self.queues}
+
+
+def _describe(key):
+    if len(key) == 1:
+        return f"transfer {key[0]}" if isinstance(key[0], int) else f"plate {key[0]}"
+    return f"{key[0]} {key[1]}"
+
+
+class CampaignLane:
+    """
+    Worklist interface of one printer of a campaign.
+    """
+    def __init__(self, campaign, printer):
+        self.campaign = campaign
+        self.printer = printer
+
+    def next_entry(self):
+        return self.campaign.next_entry(self.printer)
+
+    def mark_done(self, entry):
+        self.campaign.complete(self.printer, entry)
+
+    @property
+    def completed(self):
+        return self.campaign.completed(self.printer)
+
+
+############################
+# RUNNING
+############################
+
+def run_campaign(campaign, state_machines, poll_interval=0.1, on_change=None, stop_event=None):
+    """
+    Run the campaign, every printer polled by its own thread (the serial I/O of one printer never waits for another).
+    An exception in the polling loop of a printer (lost connection, ...) takes it out of the campaign and the other
+    printers finish its work.
+    On KeyboardInterrupt the threads are stopped and joined before it is re-raised, so the caller is the only one
+    using the printers afterwards (e.g. for an emergency stop).
+
+    :param campaign: Campaign of the printers.
+    :param state_machines: Dictionary {printer: PipettifyStateMachine}, the printers connected and configured, with
+        single-channel pipettes (the transfers are single wells).
+    :param poll_interval: State machine polling interval (s).
+    :param on_change: Called with (printer, state machine) after every poll that changed its state or bed.
+    :param stop_event: threading.Event stopping all threads once set (after their current poll), None = a new one.
+    :return: True if every transfer of the campaign was completed.
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def run_lane(printer, state_machine):
+        try:
+            state_machine.load_worklist(campaign.lane(printer))
+            state_machine.start_pipetting()
+            run_until_completed(state_machine, poll_interval,
+                                on_change=None if on_change is None else lambda: on_change(printer, state_machine),
+                                stop_event=stop_event)
+        except Exception:
+            logger.exception("%s stopped with an error.", printer)
+            campaign.fail(printer)
+            try:
+                state_machine.printer_controller.emergency_stop()
+            except Exception:
+                pass  # The connection is the likely cause, nothing more to do for this printer
+
+    threads = [threading.Thread(target=run_lane, args=(printer, state_machine), name=f"campaign-{printer}",
+                                daemon=True)
+               for printer, state_machine in state_machines.items()]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        campaign.stop()
+        for thread in threads:
+            thread.join()
+        raise
+    return campaign.is_finished()
@@ -0,0 +1,183 @@
+# This file implements the scheduler of timed waits. The state machine is polled, so a settling delay must not block
+# (time.sleep would freeze the Tk loop) and should not be busy-polled either. Instead a wait registers a callback with
+# a monotonic deadline; the GUI or the headless runner asks the scheduler when the next deadline is, sleeps (or
+# schedules the Tk "after" callback) until then and runs the due callbacks. Unrelated periodic work (progress output,
+# telemetry, rendering) can be registered with the same scheduler and keeps running during the waits.
+# run_until_completed is the polling loop of runs without the GUI (headless runner, campaigns, benchmarks).
+
+import heapq
+import itertools
+import time
+
+
+class VirtualClock:
+    """
+    Clock that only advances when somebody sleeps on it (simulations, fast replays of serial logs).
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        self.slept = 0.0  # Total time slept (s)
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+            self.slept += seconds
+
+
+class ScheduledCall:
+    """
+    Handle of a scheduled callback, used to cancel it.
+    """
+    def __init__(self, deadline, callback, args, interval=None):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.interval = interval  # Repeat period (s) of periodic calls, None = run once
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DwellScheduler:
+    """
+    Min-heap of callbacks ordered by their monotonic deadlines.
+    """
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param clock: Function returning the current time (s), injectable for simulations.
+        :param sleep: Function blocking for the given time (s), used by the headless runner between polls.
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self._heap = []  # [(deadline, sequence number, ScheduledCall)]
+        self._sequence = itertools.count()  # Keeps calls with equal deadlines in FIFO order
+
+    ############################
+    # SCHEDULING
+    ############################
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Run `callback(*args)` once the clock reaches `deadline`.
+
+        :return: ScheduledCall handle.
+        """
+        call = ScheduledCall(deadline, callback, args)
+        heapq.heappush(self._heap, (deadline, next(self._sequence), call))
+        return call
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run `callback(*args)` after `delay` seconds.
+
+        :return: ScheduledCall handle.
+        """
+        return self.call_at(self.clock() + max(delay, 0.0), callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """
+        Run `callback(*args)` every `interval` seconds, the first time after one interval.
+
+        :return: ScheduledCall handle, cancelling it stops the repetition.
+        """
+        if interval <= 0:
+            raise ValueError("Interval of a periodic call must be positive.")
+        call = ScheduledCall(self.clock() + interval, callback, args, interval)
+        heapq.heappush(self._heap, (call.deadline, next(self._sequence), call))
+        return call
+
+    @staticmethod
+    def cancel(call):
+        """
+        Cancel a scheduled call. Cancelled calls are dropped lazily when they reach the top of the heap.
+        """
+        if call is not None:
+            call.cancel()
+
+    ############################
+    # RUNNING
+    ############################
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """
+        Get the earliest deadline, or None if nothing is scheduled.
+        """
+        self._drop_cancelled()
+        return self._heap[0][0] if self._heap else None
+
+    def time_until_next(self, maximum=None):
+        """
+        Get how long the caller may sleep before the next callback is due.
+
+        :param maximum: Upper bound (s), e.g. the regular polling interval. None = no bound.
+        :return: Seconds (>= 0), or `maximum` if nothing is scheduled.
+        """
+        deadline = self.next_deadline()
+        if deadline is None:
+            return maximum
+        remaining = max(deadline - self.clock(), 0.0)
+        return remaining if maximum is None else min(remaining, maximum)
+
+    def run_due(self):
+        """
+        Run all callbacks whose deadline has passed, in deadline order.
+
+        :return: Number of callbacks run.
+        """
+        now = self.clock()
+        count = 0
+        while True:
+            self._drop_cancelled()
+            if not self._heap or self._heap[0][0] > now:
+                return count
+            _, _, call = heapq.heappop(self._heap)
+            if call.interval is not None:
+                # Next run relative to the planned one, so periodic work does not drift. Missed runs are skipped.
+                call.deadline += call.interval
+                if call.deadline <= now:
+                    call.deadline = now + call.interval
+                heapq.heappush(self._heap, (call.deadline, next(self._sequence), call))
+            call.callback(*call.args)
+            count += 1
+
+    def __len__(self):
+        return sum(1 for _, _, call in self._heap if not call.cancelled)
+
+
+def run_until_completed(state_machine, poll_interval, on_change=None, timeout=None, stop_event=None):
+    """
+    Poll the state machine until the sequence is completed. Between polls it sleeps (on the clock of its scheduler)
+    until the next poll is useful, see PipettifyStateMachine.next_poll_delay.
+
+    :param poll_interval: State machine polling interval (s).
+    :param on_change: Called after every poll that changed the state or the bed.
+    :param timeout: Give up after this time (s), None = never.
+    :param stop_event: threading.Event, polling stops once it is set (checked before every poll), None = never.
+    :return: True if the sequence was completed.
+    """
+    scheduler = state_machine.scheduler
+    bed_controller = state_machine.bed_controller
+    deadline = None if timeout is None else scheduler.clock() + timeout
+    last_state = None
+    last_version = None
+    while state_machine.current_state != state_machine.completed:
+        if deadline is not None and scheduler.clock() > deadline:
+            return False
+        if stop_event is not None and stop_event.is_set():
+            return False
+        state_machine.poll()
+        if state_machine.current_state.id != last_state or bed_controller.version != last_version:
+            last_state = state_machine.current_state.id
+            last_version = bed_controller.version
+            if on_change is not None:
+                on_change()
+        scheduler.sleep(state_machine.next_poll_delay(poll_interval))
+    return True
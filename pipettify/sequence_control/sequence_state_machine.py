@@ -1,6 +1,13 @@
 from statemachine import StateMachine, State
 from pipettify.controllers.controller_printer import PrinterController
 from pipettify.controllers.controller_bed import BedController
+from pipettify.controllers.controller_deck import slot_name
+from pipettify.sequence_control.sequence_scheduler import DwellScheduler
+from pipettify.sequence_control.sequence_transfer import SOURCE_PLATE
+from pipettify.telemetry.telemetry_logging import get_logger
+from pipettify.telemetry.telemetry_tracing import NULL_TRACER
+
+logger = get_logger("sequence_state_machine")
 
 class PipettifyStateMachine(StateMachine):
     # States
@@ -23,9 +30,10 @@ class PipettifyStateMachine(StateMachine):
     finish_refill = refilling.to(moving_to_next_probe)
     arrive_at_probe = moving_to_next_probe.to(dispensing)
     finish_dispensing = dispensing.to(moving_to_disposal)
+    dispense_next = dispensing.to(moving_to_next_probe)  # Multi-dispense, the same aspiration serves the next probe
     arrive_at_disposal = moving_to_disposal.to(disposing_tip)
     finish_disposing_tip = disposing_tip.to(moving_to_next_tip)
-    complete_pipetting = dispensing.to(completed)
+    complete_pipetting = dispensing.to(completed) | moving_to_next_tip.to(completed)
     reset_to_idle = (
         moving_to_next_tip.to(idle) |
         changing_tip.to(idle) |
@@ -39,12 +47,28 @@ class PipettifyStateMachine(StateMachine):
         idle.to(idle)
     )
 
-    def __init__(self, printer_controller, pipette_controller, bed_controller):
+    def __init__(self, printer_controller, pipette_controller, bed_controller, scheduler=None, tracer=None):
+        """
+        :param scheduler: DwellScheduler of the timed waits, shared with other periodic work of the caller.
+        :param tracer: telemetry_tracing.Tracer recording a span per state and sub-step, None = the tracer of
+                       the printer controller.
+        """
         self.printer_controller = printer_controller
         self.pipette_controller = pipette_controller
         self.bed_controller = bed_controller
         self.current_probe = None
         self.current_tip = None
+        self.probe_block = []  # Probes under all channels in the current cycle, [current_probe] for one channel
+        self.tip_block = []  # Tips picked up by all channels in the current cycle, [current_tip] for one channel
+        self.worklist = None  # Optional Worklist driving the run instead of "fill all active probes"
+        self.current_entry = None  # WorklistEntry processed in the current cycle
+        self.dispense_plan = []  # [((row, col), volume), ...] still to be served by the current aspiration
+        self.dispensed_batch = []  # [((row, col), volume), ...] already served by the current aspiration
+        self.scheduler = scheduler if scheduler is not None else DwellScheduler()
+        self.dwell_calls = {}  # {flag: ScheduledCall} of the waits in progress
+        self.tracer = tracer if tracer is not None else getattr(printer_controller, "tracer", NULL_TRACER)
+        self._traced_state = None  # State and sub-step (flag) whose spans are open
+        self._traced_step = None
         self.flags = {
             "moving_to_next_tip_moved_up_to_safe_z": False,
             "moving_to_next_tip_moved": False,
@@ -54,6 +78,7 @@ class PipettifyStateMachine(StateMachine):
             "moving_to_refill_moved": False,
             "refilling_waited_before_moving_down": False,
             "refilling_pressed_button": False,
+            "refilling_aspirated_air_gap": False,
             "refilling_moved_down": False,
             "refilling_released_button": False,
             "refilling_waited_before_moving_up": False,
@@ -73,16 +98,293 @@ class PipettifyStateMachine(StateMachine):
         
     # If there is a state change - update the GUI (display)
 
+    def load_worklist(self, worklist):
+        """
+        Drive the run from a worklist. Pass None to go back to filling all active probes.
+
+        :param worklist: Worklist, or another source of WorklistEntry rows with next_entry / mark_done (TransferList,
+                         CampaignLane).
+        :raises ValueError: If the pipette has more than one channel, worklist rows are single transfers.
+        """
+        if worklist is not None and self._multi_channel():
+            raise ValueError("Worklists need a single-channel pipette, "
+                             f"the configured pipette has {self.pipette_controller.channels} channels.")
+        self.worklist = worklist
+        self.current_entry = None
+
+    def _next_job(self):
+        """
+        Pick the job for the next cycle.
+
+        :return: False if there is nothing left to do.
+        """
+        if self.worklist is not None:
+            self.current_entry = self.worklist.next_entry()
+            if self.current_entry is None:
+                return False
+            self.pipette_controller.select_liquid_class(self.current_entry.liquid_class)
+            return True
+        self.pipette_controller.select_liquid_class(None)
+        if self._multi_channel():
+            if self.bed_controller.next_probe_block(self.pipette_controller.channel_offsets()) is not None:
+                return True
+            self._report_unreachable_probes()
+            return False
+        if self.bed_controller.tracks_volumes():
+            return len(self.bed_controller.wells_below_target()) > 0
+        return self.bed_controller.next_probe() is not None
+
+    def _multi_channel(self):
+        return self.pipette_controller.channels > 1
+
+    def _probe_block(self, head):
+        """
+        Get the probes under all channels when the first channel is above `head`.
+        """
+        if not self._multi_channel():
+            return [head]
+        return self.bed_controller.channel_block("probes", head, self.pipette_controller.channel_offsets())
+
+    def _report_unreachable_probes(self):
+        """
+        Warn about probes a multi-channel pipette cannot fill: no complete set of empty probes lies under its channels
+        (partially filled columns, inactive neighbours or a plate pitch different from the channel pitch).
+        """
+        if self.bed_controller.tracks_volumes():
+            left = len(self.bed_controller.wells_below_target())
+        else:
+            left = sum(1 for probe in self.bed_controller.probes.values() if not probe["filled"])
+        if left:
+            logger.warning("%d probes cannot be filled by the %d-channel pipette, no complete set of them is under "
+                           "its channels.", left, self.pipette_controller.channels)
+
+    def _plan_dispenses(self):
+        """
+        Decide which probes the liquid aspirated in this cycle is dispensed to. Only used when the bed tracks volumes,
+        otherwise every aspiration serves the next unfilled probe.
+        """
+        self.dispensed_batch = []
+        self.dispense_plan = []
+        if self.current_entry is not None or not self.bed_controller.tracks_volumes():
+            return
+
+        capacity = self.pipette_controller.liquid_capacity()  # The air gap takes up part of the tip
+        if self._multi_channel():
+            # Plan entries are the probes under the first channel, _probe_block gives the rest
+            offsets = self.pipette_controller.channel_offsets()
+            blocks = self.bed_controller.probe_blocks_per_aspiration(capacity if capacity > 0 else float("inf"), offsets)
+            self.dispense_plan = [(block[0], volume) for block, volume in blocks]
+            if capacity <= 0:
+                self.dispense_plan = self.dispense_plan[:1]
+        elif capacity > 0:
+            self.dispense_plan = self.bed_controller.probes_per_aspiration(capacity)
+        else:
+            # Unknown pipette volume, assume a full push fills the next probe
+            self.dispense_plan = self.bed_controller.probes_per_aspiration(float("inf"))[:1]
+
+    def _aspiration_volume(self):
+        """
+        Get the volume of liquid (uL) aspirated in the current cycle: what the worklist row or the dispense plan needs,
+        so the last dispense pushes out exactly the volume that is recorded.
+
+        :return: Volume (uL), None = full stroke (volumes are not tracked or the pipette volume is unknown).
+        """
+        if self.pipette_controller.nominal_volume <= 0:
+            return None
+        if self.current_entry is not None:
+            volume = self.current_entry.volume
+            if volume > self.pipette_controller.liquid_capacity():
+                logger.warning("Worklist row %s needs %g uL, the pipette takes up only %g uL.",
+                               self.current_entry.index, volume, self.pipette_controller.liquid_capacity())
+            return volume if volume > 0 else None
+        if self.dispense_plan:
+            return sum(volume for _, volume in self.dispense_plan)
+        return None
+
+    def _source_coordinates(self):
+        """
+        Get (x, y) of the place the liquid is aspirated from in the current cycle.
+        """
+        if self.current_entry is not None:
+            return self.bed_controller.deck.slot_coordinates(*self.current_entry.source)
+        return self.bed_controller.refilling_tank
+
+    def _next_destination(self):
+        """
+        Get the slot the liquid is dispensed to in the current cycle.
+
+        :return: Tuple (position, (x, y)).
+        """
+        if self.current_entry is not None:
+            labware_name, position = self.current_entry.destination
+            self.probe_block = [position]
+            return position, self.bed_controller.deck.slot_coordinates(labware_name, position)
+        if self.dispense_plan:
+            position = self.dispense_plan[0][0]
+            self.probe_block = self._probe_block(position)
+        elif self._multi_channel():
+            self.probe_block = self.bed_controller.next_probe_block(self.pipette_controller.channel_offsets())
+            position = self.probe_block[0]
+        else:
+            position = self.bed_controller.next_probe()
+            self.probe_block = [position]
+        return position, self.bed_controller.probes[position]["coordinates"]
+
+    def _mark_dispensed(self):
+        """
+        Mark the destination of the current cycle as filled (and the worklist row as done).
+        """
+        if self.current_entry is not None:
+            labware_name, position = self.current_entry.destination
+            if labware_name == "probes" and self.current_entry.volume > 0:
+                volume = self.current_entry.volume
+                if self.pipette_controller.nominal_volume > 0:
+                    volume = self.pipette_controller.aspirated_volume  # Capped at the capacity of the pipette
+                self.bed_controller.record_dispenses([position], [volume])
+            self.bed_controller.update_slot_state(labware_name, position[0], position[1], True)
+            source_name, (source_row, source_column) = self.current_entry.source
+            if source_name == SOURCE_PLATE:
+                self.bed_controller.update_slot_state(source_name, source_row, source_column, True)
+            self.worklist.mark_done(self.current_entry)
+        elif self.dispense_plan:
+            self.dispensed_batch.append(self.dispense_plan.pop(0))
+            positions, volumes = [], []
+            for head, volume in self.dispensed_batch:
+                block = self._probe_block(head)
+                positions.extend(block)
+                volumes.extend([volume] * len(block))
+            self.bed_controller.record_dispenses(positions, volumes)
+            self.dispensed_batch = []
+        else:
+            for row, column in self.probe_block:
+                self.bed_controller.update_probe_state(row, column, True)
+
+    def _dispense_to_next_probe(self):
+        """
+        Current probe got its portion, continue with the next probe of the plan using the same aspiration.
+        """
+        self.dispensed_batch.append(self.dispense_plan.pop(0))
+        for flag in self.flags:
+            if flag.startswith("dispensing_") or flag == "moving_to_next_probe_moved":
+                self.flags[flag] = False
+                self.scheduler.cancel(self.dwell_calls.pop(flag, None))
+        self.dispense_next()
+
+    def _dwell(self, flag, seconds, message):
+        """
+        Wait without blocking: the first call schedules marking the flag after `seconds`, the scheduler marks it
+        once the deadline passes. The caller does not need to poll the state machine until then, see next_poll_delay.
+
+        :param flag: Flag marked once the wait is over.
+        :param seconds: Length of the wait (s), 0 = no wait.
+        :param message: Logged when the wait starts.
+        :return: True if the wait is over.
+        """
+        if self.flags[flag]:
+            return True
+        if flag not in self.dwell_calls:
+            logger.info(message)
+            if seconds <= 0:
+                self.flags[flag] = True
+                return True
+            self.dwell_calls[flag] = self.scheduler.call_later(seconds, self._finish_dwell, flag)
+        return False
+
+    def _finish_dwell(self, flag):
+        """
+        Scheduler callback, the wait of `flag` is over.
+        """
+        self.dwell_calls.pop(flag, None)
+        self.flags[flag] = True
+
+    def is_dwelling(self):
+        """
+        Check if the sequence only waits for a dwell deadline (polling it would do nothing).
+        """
+        return bool(self.dwell_calls)
+
+    def next_poll_delay(self, interval):
+        """
+        Get how long the caller may wait before the next poll.
+
+        :param interval: Regular polling interval (s).
+        :return: Time (s) until the next scheduled callback, at most `interval`. While a move of the printer is
+                 predicted to be in progress, at most the time until its predicted end instead (polls before it do
+                 not query the printer, see PrinterController.is_at_position). While dwelling, the time until the
+                 dwell is over (the poll interval does not apply, the sequence continues right at the deadline).
+        """
+        if self.is_dwelling():
+            return self.scheduler.time_until_next()
+        moving = self.printer_controller.motion.time_to_finish()
+        return self.scheduler.time_until_next(moving or interval)
+
     def clear_flags(self):
         """
         Clear all flags.
         """
         for flag in self.flags:
             self.flags[flag] = False
+        for call in self.dwell_calls.values():
+            self.scheduler.cancel(call)
+        self.dwell_calls.clear()
+
+    def _trace_args(self):
+        """
+        Arguments attached to the spans: well, tip, worklist row and liquid class of the current cycle.
+        """
+        args = {}
+        if self.current_probe is not None:
+            args["well"] = slot_name(*self.current_probe)
+            if len(self.probe_block) > 1:
+                args["wells"] = [slot_name(*position) for position in self.probe_block]
+        if self.current_tip is not None:
+            args["tip"] = slot_name(*self.current_tip)
+        if self.current_entry is not None:
+            args["row"] = self.current_entry.index
+            source_name, source_position = self.current_entry.source
+            args["source"] = f"{source_name}:{slot_name(*source_position)}"
+        args["liquid_class"] = self.pipette_controller.active_liquid_class.name
+        return args
+
+    def _trace_progress(self):
+        """
+        Keep a span open for the current state and for its current sub-step (the first flag of the state not marked
+        yet), ending them when the state machine moves on.
+        """
+        if not self.tracer.enabled:
+            return
+        state = self.current_state.id
+        step = None
+        if state not in ("idle", "completed"):
+            step = next((flag for flag, done in self.flags.items() if not done and flag.startswith(state + "_")), None)
+        if state != self._traced_state:
+            self.tracer.end("step", **self._trace_args())
+            self.tracer.end("state", **self._trace_args())
+            self._traced_step = None
+            if state != "idle":
+                self.tracer.begin("state", self.current_state.name, "state", **self._trace_args())
+            self._traced_state = state
+        if step != self._traced_step:
+            self.tracer.end("step", **self._trace_args())
+            if step is not None:
+                self.tracer.begin("step", step[len(state) + 1:], "step", **self._trace_args())
+            self._traced_step = step
 
     def poll(self):
         """
-        Periodic polling logic. Calls the current state's polling method.
+        Periodic polling logic. Runs the due scheduled callbacks and calls the current state's polling method.
+        """
+        self.scheduler.run_due()
+        if self.is_dwelling():
+            return False
+        self._trace_progress()
+        result = self._poll_state()
+        self._trace_progress()
+        return result
+
+    def _poll_state(self):
+        """
+        Call the polling method of the current state.
         """
         if self.current_state == self.idle:
             return False
@@ -109,10 +411,15 @@ class PipettifyStateMachine(StateMachine):
         """
         Logic for polling the 'moving_to_tip_rack' state.
         """
-        print("Polling moving to next tip.")
+        logger.debug("Polling moving to next tip.")
         
         if not self.flags["moving_to_next_tip_moved_up_to_safe_z"]:
-            print("Moving up to safe z.")
+            if not self._next_job():
+                logger.info("Nothing left to dispense, transitioning to completed state.")
+                self.complete_pipetting()
+                return True
+
+            logger.info("Moving up to safe z.")
             self.printer_controller.move_to_coordinates(self.printer_controller.curr_x,
                                                         self.printer_controller.curr_y,
                                                         self.bed_controller.safe_z)
@@ -122,7 +429,17 @@ class PipettifyStateMachine(StateMachine):
         
         # Condition to move to the next state
         if not self.flags["moving_to_next_tip_moved"]:
-            self.current_tip = self.bed_controller.next_tip()
+            if self._multi_channel():
+                self.tip_block = self.bed_controller.next_tip_block(self.pipette_controller.channel_offsets())
+                if self.tip_block is None:
+                    logger.warning("No set of %d tips left for the multi-channel pipette, transitioning to completed "
+                                   "state.", self.pipette_controller.channels)
+                    self.complete_pipetting()
+                    return True
+                self.current_tip = self.tip_block[0]
+            else:
+                self.current_tip = self.bed_controller.next_tip()
+                self.tip_block = [self.current_tip]
             next_tip_x = self.bed_controller.tips[self.current_tip]["coordinates"][0]
             next_tip_y = self.bed_controller.tips[self.current_tip]["coordinates"][1]
 
@@ -134,12 +451,12 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(next_tip_x,
                                                       next_tip_y,
                                                       self.bed_controller.safe_z):
-                print("Printer moved to next tip position.")
+                logger.info("Printer moved to next tip position.")
                 self.flags["moving_to_next_tip_moved"] = True
                 
             return False
 
-        print("All moving to refill satte flags are marked, transitioning to refilling state.")
+        logger.info("All moving to refill satte flags are marked, transitioning to refilling state.")
         self.arrive_at_tip()
         return True  # State completed
         
@@ -151,7 +468,7 @@ class PipettifyStateMachine(StateMachine):
         2. Move Up
         """
         if not self.flags["changing_tip_moved_down_first_step"]:
-            print("Moving down to change tip.")
+            logger.info("Moving down to change tip.")
             self.printer_controller.move_to_coordinates(
                 self.bed_controller.tips[self.current_tip]["coordinates"][0],
                 self.bed_controller.tips[self.current_tip]["coordinates"][1],
@@ -161,13 +478,13 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.bed_controller.tips[self.current_tip]["coordinates"][0],
                                                       self.bed_controller.tips[self.current_tip]["coordinates"][1],
                                                       self.bed_controller.change_tip_z + 10):
-                print("Printer moved down right above  position.")
+                logger.info("Printer moved down right above  position.")
                 self.flags["changing_tip_moved_down_first_step"] = True
 
             return False
         
         if not self.flags["changing_tip_moved_down"]:
-            print("Moving down to change tip.")
+            logger.info("Moving down to change tip.")
             self.printer_controller.move_to_coordinates(
                 self.bed_controller.tips[self.current_tip]["coordinates"][0],
                 self.bed_controller.tips[self.current_tip]["coordinates"][1],
@@ -178,13 +495,13 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.bed_controller.tips[self.current_tip]["coordinates"][0],
                                                       self.bed_controller.tips[self.current_tip]["coordinates"][1],
                                                       self.bed_controller.change_tip_z):
-                print("Printer moved down to tip position.")
+                logger.info("Printer moved down to tip position.")
                 self.flags["changing_tip_moved_down"] = True
 
             return False
         
         if not self.flags["changing_tip_moved_up"]:
-            print("Moving up after changing tip.")
+            logger.info("Moving up after changing tip.")
             self.printer_controller.move_to_coordinates(
                 self.bed_controller.tips[self.current_tip]["coordinates"][0],
                 self.bed_controller.tips[self.current_tip]["coordinates"][1],
@@ -194,13 +511,14 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.bed_controller.tips[self.current_tip]["coordinates"][0],
                                                       self.bed_controller.tips[self.current_tip]["coordinates"][1],
                                                       self.bed_controller.safe_z):
-                print("Printer moved up to safe position.")
+                logger.info("Printer moved up to safe position.")
                 self.flags["changing_tip_moved_up"] = True
 
             return False
         
-        self.bed_controller.update_tip_state(self.current_tip[0], self.current_tip[1], True)
-        print("All changing tip state flags are marked, transitioning to moving_to_refill state.")
+        for row, column in self.tip_block:
+            self.bed_controller.update_tip_state(row, column, True)
+        logger.info("All changing tip state flags are marked, transitioning to moving_to_refill state.")
         self.finish_changing_tip()
         return True
 
@@ -211,20 +529,20 @@ class PipettifyStateMachine(StateMachine):
         """
         # Condition to move to the next state
         if not self.flags["moving_to_refill_moved"]:
-            target_x = self.bed_controller.refilling_tank[0]
-            target_y = self.bed_controller.refilling_tank[1]
+            target_x, target_y = self._source_coordinates()
             safe_z = self.bed_controller.safe_z
 
             self.printer_controller.move_to_coordinates(target_x, target_y, safe_z)
 
             # Condition to mark a flag
             if self.printer_controller.is_at_position(target_x, target_y, safe_z):
-                print("Printer moved to refill position.")
+                logger.info("Printer moved to refill position.")
                 self.flags["moving_to_refill_moved"] = True
                 
             return False
 
-        print("All moving to refill satte flags are marked, transitioning to refilling state.")
+        logger.info("All moving to refill satte flags are marked, transitioning to refilling state.")
+        self._plan_dispenses()  # Before the refill, it aspirates only the planned volume
         self.arrive_at_refill()
         return True  # State completed
 
@@ -234,68 +552,73 @@ class PipettifyStateMachine(StateMachine):
         Logic for polling the 'refilling' state.
         """
         if not self.flags["refilling_waited_before_moving_down"]:
-            print("Waiting before moving down.")
-            self.flags["refilling_waited_before_moving_down"] = True # TODO -> For now there is no delay.
+            self._dwell("refilling_waited_before_moving_down", self.pipette_controller.active_liquid_class.pre_dwell,
+                        "Waiting before moving down.")
             return False
         
         if not self.flags["refilling_pressed_button"]:
-            print("Pressing button to refill.")
+            logger.info("Pressing button to refill.")
             self.pipette_controller.press_push_button_half()
             
             if self.pipette_controller.state == "push_button_pressed":
-                print("Button pressed.")
+                logger.info("Button pressed.")
                 self.flags["refilling_pressed_button"] = True
                 
             return False
+
+        if not self.flags["refilling_aspirated_air_gap"]:
+            if self.pipette_controller.aspirate_air_gap():
+                self.flags["refilling_aspirated_air_gap"] = True
+            return False
         
         if not self.flags["refilling_moved_down"]:
-            print("Moving down to refill.")
+            logger.info("Moving down to refill.")
+            source_x, source_y = self._source_coordinates()
             self.printer_controller.move_to_coordinates(
-                self.bed_controller.refilling_tank[0],
-                self.bed_controller.refilling_tank[1],
+                source_x,
+                source_y,
                 self.bed_controller.refilling_z
             )
             
-            if self.printer_controller.is_at_position(self.bed_controller.refilling_tank[0],
-                                                      self.bed_controller.refilling_tank[1],
+            if self.printer_controller.is_at_position(source_x,
+                                                      source_y,
                                                       self.bed_controller.refilling_z):
-                print("Printer moved to refill position.")
+                logger.info("Printer moved to refill position.")
                 self.flags["refilling_moved_down"] = True
 
             return False
         
         if not self.flags["refilling_released_button"]:
-            print("Releasing button after refilling.")
-            self.pipette_controller.move_to_neutral()
-            
-            if self.pipette_controller.state == "neutral":
-                print("Button released.")
+            logger.info("Releasing button after refilling.")
+            if self.pipette_controller.aspirate(self._aspiration_volume()):
+                logger.info("Button released.")
                 self.flags["refilling_released_button"] = True
                 
             return False
         
         if not self.flags["refilling_waited_before_moving_up"]:
-            print("Waiting before moving up.")
-            self.flags["refilling_waited_before_moving_up"] = True # TODO -> For now there is no delay.
+            self._dwell("refilling_waited_before_moving_up", self.pipette_controller.active_liquid_class.post_dwell,
+                        "Waiting before moving up.")
             return False
         
         if not self.flags["refilling_moved_up"]:
-            print("Moving up after refilling.")
+            logger.info("Moving up after refilling.")
+            source_x, source_y = self._source_coordinates()
             self.printer_controller.move_to_coordinates(
-                self.bed_controller.refilling_tank[0],
-                self.bed_controller.refilling_tank[1],
+                source_x,
+                source_y,
                 self.bed_controller.safe_z
             )
             
-            if self.printer_controller.is_at_position(self.bed_controller.refilling_tank[0],
-                                                      self.bed_controller.refilling_tank[1],
+            if self.printer_controller.is_at_position(source_x,
+                                                      source_y,
                                                       self.bed_controller.safe_z):
-                print("Printer moved to safe position.")
+                logger.info("Printer moved to safe position.")
                 self.flags["refilling_moved_up"] = True
 
             return False
         
-        print("All refilling state flags are marked, transitioning to moving_to_the_next_probe state.")
+        logger.info("All refilling state flags are marked, transitioning to moving_to_the_next_probe state.")
         self.finish_refill()
         return True
 
@@ -303,12 +626,10 @@ class PipettifyStateMachine(StateMachine):
         """
         Move to the next probe position.
         """
-        print("Polling moving to next probe.")
+        logger.debug("Polling moving to next probe.")
         # Condition to move to the next state
         if not self.flags["moving_to_next_probe_moved"]:
-            self.current_probe = self.bed_controller.next_probe()
-            next_probe_x = self.bed_controller.probes[self.current_probe]["coordinates"][0]
-            next_probe_y = self.bed_controller.probes[self.current_probe]["coordinates"][1]
+            self.current_probe, (next_probe_x, next_probe_y) = self._next_destination()
 
             self.printer_controller.move_to_coordinates(next_probe_x,
                                                         next_probe_y,
@@ -318,12 +639,12 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(next_probe_x,
                                                       next_probe_y,
                                                       self.bed_controller.safe_z):
-                print("Printer moved to next probe position.")
+                logger.info("Printer moved to next probe position.")
                 self.flags["moving_to_next_probe_moved"] = True
                 
             return False
 
-        print("All moving to refill satte flags are marked, transitioning to refilling state.")
+        logger.info("All moving to refill satte flags are marked, transitioning to refilling state.")
         self.arrive_at_probe()
         return True  # State completed
     
@@ -333,12 +654,12 @@ class PipettifyStateMachine(StateMachine):
         """
         # Condition to move to the next state
         if not self.flags["dispensing_waited_before_moving_down"]:
-            print("Waiting before moving down.")
-            self.flags["dispensing_waited_before_moving_down"] = True # TODO -> For now there is no delay.
+            self._dwell("dispensing_waited_before_moving_down", self.pipette_controller.active_liquid_class.pre_dwell,
+                        "Waiting before moving down.")
             return False
         
         if not self.flags["dispensing_moved_down"]:
-            print("Moving down to dispense.")
+            logger.info("Moving down to dispense.")
             
             self.printer_controller.move_to_coordinates(
                 self.printer_controller.curr_x,
@@ -349,28 +670,34 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.printer_controller.curr_x,
                                                       self.printer_controller.curr_y,
                                                       self.bed_controller.dispensing_z):
-                print("Printer moved to dispense position.")
+                logger.info("Printer moved to dispense position.")
                 self.flags["dispensing_moved_down"] = True
 
             return False
         
         if not self.flags["dispensing_pressed_button"]:
-            print("Pressing button to dispense.")
-            self.pipette_controller.press_push_button_full()
-            
-            if self.pipette_controller.state == "push_button_pressed":
-                print("Button pressed.")
+            logger.info("Pressing button to dispense.")
+            if len(self.dispense_plan) > 1:
+                # More probes are served by this aspiration, push out only this probe's portion
+                dispensed_volume = sum(volume for _, volume in self.dispensed_batch) + self.dispense_plan[0][1]
+                pressed = self.pipette_controller.press_push_button_to_volume(dispensed_volume)
+            else:
+                # The aspiration took up only the planned volume, the last probe gets the rest
+                pressed = self.pipette_controller.press_push_button_dispense()
+
+            if pressed:
+                logger.info("Button pressed.")
                 self.flags["dispensing_pressed_button"] = True
                 
             return False
         
         if not self.flags["dispensing_waited_before_moving_up"]:
-            print("Waiting before moving up.")
-            self.flags["dispensing_waited_before_moving_up"] = True # `TODO -> For now there is no delay.
+            self._dwell("dispensing_waited_before_moving_up", self.pipette_controller.active_liquid_class.post_dwell,
+                        "Waiting before moving up.")
             return False
         
         if not self.flags["dispensing_moved_up"]:
-            print("Moving up after dispensing.")
+            logger.info("Moving up after dispensing.")
             self.printer_controller.move_to_coordinates(
                 self.printer_controller.curr_x,
                 self.printer_controller.curr_y,
@@ -380,23 +707,28 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.printer_controller.curr_x,
                                                       self.printer_controller.curr_y,
                                                       self.bed_controller.safe_z):
-                print("Printer moved to safe position.")
+                logger.info("Printer moved to safe position.")
                 self.flags["dispensing_moved_up"] = True
 
             return False
+
+        if len(self.dispense_plan) > 1:
+            logger.info("Portion dispensed, transitioning to moving_to_next_probe state.")
+            self._dispense_to_next_probe()
+            return True
         
         if not self.flags["dispensing_released_button"]:
-            print("Releasing button after dispensing.")
+            logger.info("Releasing button after dispensing.")
             self.pipette_controller.move_to_neutral()
             
             if self.pipette_controller.state == "neutral":
-                print("Button released.")
+                logger.info("Button released.")
                 self.flags["dispensing_released_button"] = True
                 
             return False
         
-        print("All dispensing state flags are marked, transitioning to moving_to_the_next_probe state.")
-        self.bed_controller.update_probe_state(self.current_probe[0], self.current_probe[1], True)
+        logger.info("All dispensing state flags are marked, transitioning to moving_to_the_next_probe state.")
+        self._mark_dispensed()
         self.finish_dispensing()
         return True
 
@@ -405,7 +737,7 @@ class PipettifyStateMachine(StateMachine):
         Logic for polling the 'moving_to_disposal' state.
         """
         if not self.flags["moving_to_disposal_moved"]:
-            print("Moving to disposal...")
+            logger.info("Moving to disposal...")
             self.printer_controller.move_to_coordinates(self.bed_controller.disposal_tank[0],
                                                         self.bed_controller.disposal_tank[1],
                                                         self.bed_controller.safe_z)
@@ -413,11 +745,11 @@ class PipettifyStateMachine(StateMachine):
             if self.printer_controller.is_at_position(self.bed_controller.disposal_tank[0],
                                                       self.bed_controller.disposal_tank[1],
                                                       self.bed_controller.safe_z):
-                print("Printer moved to disposal position.")
+                logger.info("Printer moved to disposal position.")
                 self.flags["moving_to_disposal_moved"] = True
             return False
         
-        print("All moving to disposal state flags are marked, transitioning to disposing_tip state.")
+        logger.info("All moving to disposal state flags are marked, transitioning to disposing_tip state.")
         self.arrive_at_disposal()
         return True
 
@@ -426,30 +758,30 @@ class PipettifyStateMachine(StateMachine):
         Logic for polling the 'disposing_tip' state.
         """
         if not self.flags["disposing_tip_moved_up"]:
-            print("Moving up after disposing tip...")
+            logger.info("Moving up after disposing tip...")
             self.printer_controller.move_to_coordinates(self.bed_controller.disposal_tank[0],
                                                         self.bed_controller.disposal_tank[1],
                                                         self.bed_controller.drop_tip_z)
             if self.printer_controller.is_at_position(self.bed_controller.disposal_tank[0],
                                                       self.bed_controller.disposal_tank[1],
                                                       self.bed_controller.drop_tip_z):
-                print("Printer moved up to safe position.")
+                logger.info("Printer moved up to safe position.")
                 self.flags["disposing_tip_moved_up"] = True
             return False
         
         if not self.flags["disposing_tip_moved_down"]:
-            print("Moving down to dispose tip...")
+            logger.info("Moving down to dispose tip...")
             self.printer_controller.move_to_coordinates(self.bed_controller.disposal_tank[0],
                                                         self.bed_controller.disposal_tank[1],
                                                         self.bed_controller.safe_z)
             if self.printer_controller.is_at_position(self.bed_controller.disposal_tank[0],
                                                       self.bed_controller.disposal_tank[1],
                                                       self.bed_controller.safe_z):
-                print("Printer moved down to disposal position.")
+                logger.info("Printer moved down to disposal position.")
                 self.flags["disposing_tip_moved_down"] = True
             return False
         
-        print("All disposing tip state flags are marked, transitioning to moving_to_next_tip state.")
+        logger.info("All disposing tip state flags are marked, transitioning to moving_to_next_tip state.")
         self.clear_flags() # THE LAST STEP - CLEAR ALL FLAGS AND REPEAT THE CYCLE
         self.finish_disposing_tip()
         return True
@@ -459,5 +791,8 @@ class PipettifyStateMachine(StateMachine):
         Reset the state machine to the idle state.
         """
         self.clear_flags()
+        self.dispense_plan = []
+        self.dispensed_batch = []
         self.reset_to_idle()
+        self._trace_progress()
         return True
\ No newline at end of file
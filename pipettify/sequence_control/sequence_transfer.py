@@ -0,0 +1,133 @@
+# This file implements plate-to-plate transfers - every cycle aspirates from a well of the source plate instead of
+# the refilling tank and dispenses into a well of the destination plate (the probes). Transfers are WorklistEntry
+# rows, so they come either from a worklist (reformatting, "source_plate:A1" -> "probes:C5") or are generated here
+# (replication, every source well into the same well of the destination plate).
+#
+# Every cycle takes a new tip, goes to the source, to the destination and to the disposal tank. The tips are taken
+# in a fixed order and the source -> destination and destination -> disposal legs do not depend on the order of the
+# transfers, so the order only changes the tip -> source leg. order_transfers assigns every cycle the transfer whose
+# source is nearest to the tip of that cycle (nearest neighbour) and improves the assignment by swapping transfers
+# between cycles, which keeps the pick-up-to-aspirate travel short.
+
+import numpy as np
+
+from pipettify.sequence_control.sequence_worklist import WorklistEntry
+
+SOURCE_PLATE = "source_plate"
+
+
+def replicate_transfers(bed_controller, volume=None, source=SOURCE_PLATE, destination="probes"):
+    """
+    Get the transfers copying every well of the source plate into the same well (row, column) of the destination
+    plate. Wells missing on either plate (inactive slots) are skipped, filled destination wells too.
+
+    :param bed_controller: BedController with the source plate on its deck (see BedController.set_source_plate).
+    :param volume: Volume of every transfer (uL), None = the probe volume of the bed (0 = full dispense).
+    :param source: Name of the source labware.
+    :param destination: Name of the destination labware.
+    :return: List of WorklistEntry, in the slot order of the destination.
+    :raises KeyError: If the source or the destination is not on the deck.
+    """
+    source_labware = bed_controller.deck.get_labware(source)
+    destination_labware = bed_controller.deck.get_labware(destination)
+    if volume is None:
+        volume = bed_controller.probe_volume
+    entries = []
+    for position, slot in destination_labware.slots.items():
+        if position in source_labware.slots and not slot[destination_labware.state_key]:
+            entries.append(WorklistEntry(len(entries), (source, position), (destination, position), float(volume)))
+    return entries
+
+
+def order_transfers(entries, bed_controller, max_passes=20):
+    """
+    Order the transfers so the tip of every cycle is picked up near the source of its transfer, see the top of this
+    file. Every cycle first gets the transfer whose source is nearest to its tip (nearest neighbour), then pairs of
+    cycles swap their transfers while that shortens the total tip -> source travel. The tips are used in the order
+    BedController.next_tip hands them out; transfers beyond the available tips keep their original order at the end.
+
+    :param entries: List of WorklistEntry.
+    :param bed_controller: BedController with the deck the transfers refer to.
+    :param max_passes: Upper bound of the swap passes over all cycles.
+    :return: New list of the same entries (their indices are kept).
+    """
+    tips = [tip["coordinates"] for tip in bed_controller.tips.values() if not tip["taken"]][:len(entries)]
+    if len(entries) < 2 or not tips:
+        return list(entries)
+    deck = bed_controller.deck
+    sources = np.array([deck.slot_coordinates(*entry.source) for entry in entries], dtype=float)
+    tips = np.array(tips, dtype=float)
+    cost = np.hypot(tips[:, None, 0] - sources[None, :, 0], tips[:, None, 1] - sources[None, :, 1])  # [cycle, entry]
+
+    # Nearest neighbour: every cycle takes the nearest source still left
+    remaining = np.ones(len(entries), dtype=bool)
+    assigned = np.empty(len(tips), dtype=int)  # Entry of every cycle
+    for cycle in range(len(tips)):
+        distances = np.where(remaining, cost[cycle], np.inf)
+        assigned[cycle] = int(np.argmin(distances))  # Ties keep the original order
+        remaining[assigned[cycle]] = False
+
+    # Pairwise swaps, the best one for every cycle in turn
+    cycles = np.arange(len(tips))
+    for _ in range(max_passes):
+        improved = False
+        for cycle in cycles:
+            current = cost[cycle, assigned[cycle]] + cost[cycles, assigned]
+            swapped = cost[cycle, assigned] + cost[cycles, assigned[cycle]]
+            gain = current - swapped
+            other = int(np.argmax(gain))
+            if gain[other] > 1e-9:
+                assigned[cycle], assigned[other] = assigned[other], assigned[cycle]
+                improved = True
+        if not improved:
+            break
+
+    ordered = [entries[index] for index in assigned]
+    ordered.extend(entry for entry, left in zip(entries, remaining) if left)
+    return ordered
+
+
+def travel_distance(entries, bed_controller):
+    """
+    Get the XY travel (mm) of the transfers done in the given order: tip -> source -> destination -> disposal per
+    cycle, with the tips in the order BedController.next_tip hands them out.
+    """
+    deck = bed_controller.deck
+    disposal = np.array(bed_controller.disposal_tank, dtype=float)
+    tips = [tip["coordinates"] for tip in bed_controller.tips.values() if not tip["taken"]]
+    total = 0.0
+    for entry, tip in zip(entries, tips):
+        points = np.array([tip, deck.slot_coordinates(*entry.source), deck.slot_coordinates(*entry.destination),
+                           disposal], dtype=float)
+        total += float(np.hypot(*np.diff(points, axis=0).T).sum())
+    return total
+
+
+class TransferList:
+    """
+    In-memory list of transfers with the interface of a Worklist (next_entry / mark_done), see
+    PipettifyStateMachine.load_worklist. The progress is not persisted.
+    """
+    def __init__(self, entries):
+        """
+        :param entries: List of WorklistEntry, done in this order.
+        """
+        self.entries = list(entries)
+        self.position = 0  # Index into entries of the next transfer handed out
+        self.completed = 0
+
+    def next_entry(self):
+        if self.position >= len(self.entries):
+            return None
+        entry = self.entries[self.position]
+        self.position += 1
+        return entry
+
+    def mark_done(self, entry):
+        self.completed += 1
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
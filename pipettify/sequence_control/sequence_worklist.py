@@ -0,0 +1,316 @@
+# This file implements worklists - transfer lists that drive a run instead of "fill the first N probes".
+# Each row of a worklist gives a source, a destination well and a volume. Worklists are read as a stream (one row
+# at a time), so files with hundreds of thousands of rows are never loaded into memory at once. Every row is validated
+# against the BedController deck and the position of the last completed row is persisted next to the worklist, so an
+# interrupted run can be resumed.
+#
+# Supported formats:
+#   .csv           - header row with "source", "destination" and "volume" columns, quoted fields may span lines
+#   .jsonl/.ndjson - one JSON object per line with "source", "destination" and "volume" keys
+#   .json          - JSON array of such objects
+# An optional "liquid_class" column/key selects the liquid class of the row (empty = liquid class of the run).
+#
+# Slots are addressed as "<labware>:<slot>", e.g. "probes:B3" or "source_plate:A1". Destination without the labware
+# part refers to the probe plate, empty source refers to the refilling tank.
+
+import csv
+import json
+import os
+from collections import namedtuple
+
+from pipettify.controllers.controller_deck import parse_slot_name
+
+WorklistEntry = namedtuple("WorklistEntry", ["index", "source", "destination", "volume", "liquid_class"],
+                           defaults=(None,))
+"""
+Single validated worklist row.
+index - number of the row in the worklist (0-based, header not counted)
+source / destination - tuples (labware_name, (row, col))
+volume - volume to transfer (uL)
+liquid_class - name of the liquid class, None = liquid class of the run
+"""
+
+JSON_READ_CHUNK_SIZE = 64 * 1024
+
+
+def _read_csv_record(file):
+    """
+    Read one CSV record from a binary file: a line, plus the following lines while a quoted field is open (an odd
+    number of quote characters so far, escaped quotes are doubled). The file position ends right after the record.
+
+    :return: Bytes of the record, empty at the end of the file.
+    :raises ValueError: If the file ends inside a quoted field.
+    """
+    record = file.readline()
+    while record.count(b'"') % 2:
+        line = file.readline()
+        if not line:
+            raise ValueError("CSV worklist ends inside a quoted field.")
+        record += line
+    return record
+
+
+class Worklist:
+    """
+    Streaming reader of a worklist file.
+    1. Parses rows lazily, one at a time
+    2. Validates every row against the deck of the BedController
+    3. Persists the progress (number of completed rows and file offset) in a small JSON file
+    """
+    def __init__(self,
+                 path,
+                 bed_controller,
+                 progress_path=None,
+                 default_source="refilling_tank",
+                 default_destination="probes",
+                 liquid_classes=None):
+        """
+        :param path: Path to the worklist file.
+        :param bed_controller: BedController whose deck is used to validate slots.
+        :param progress_path: Path to the progress file. Defaults to "<path>.progress.json".
+        :param default_source: Labware used when the source is empty.
+        :param default_destination: Labware used when the destination has no labware part.
+        :param liquid_classes: Names of the known liquid classes, None = liquid classes are not validated.
+        """
+        self.path = path
+        self.bed_controller = bed_controller
+        self.progress_path = progress_path or f"{path}.progress.json"
+        self.default_source = default_source
+        self.default_destination = default_destination
+        self.liquid_classes = liquid_classes
+        self.format = self._detect_format(path)
+
+        self.completed = 0  # Number of completed rows
+        self.offset = 0  # File offset right after the last completed row (csv/jsonl only)
+        self._rows = None  # Generator of (index, offset, raw_row)
+        self._pending = {}  # {index: offset} of rows handed out but not completed yet
+        self._load_progress()
+
+    @staticmethod
+    def _detect_format(path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".csv":
+            return "csv"
+        if extension in (".jsonl", ".ndjson"):
+            return "jsonl"
+        if extension == ".json":
+            return "json"
+        raise ValueError(f"Unsupported worklist format: {extension}")
+
+    ############################
+    # PROGRESS
+    ############################
+
+    def _load_progress(self):
+        """
+        Load the progress from the progress file, if it exists and belongs to this worklist.
+        """
+        if not os.path.exists(self.progress_path):
+            return
+        with open(self.progress_path, "r") as file:
+            progress = json.load(file)
+        if progress.get("worklist") != os.path.abspath(self.path):
+            return
+        self.completed = progress.get("completed", 0)
+        self.offset = progress.get("offset", 0)
+
+    def _save_progress(self):
+        """
+        Atomically write the progress file.
+        """
+        progress = {
+            "worklist": os.path.abspath(self.path),
+            "completed": self.completed,
+            "offset": self.offset,
+        }
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(progress, file)
+        os.replace(tmp_path, self.progress_path)
+
+    def reset_progress(self):
+        """
+        Start the worklist from the beginning.
+        """
+        self.completed = 0
+        self.offset = 0
+        self._rows = None
+        self._pending = {}
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+    def mark_done(self, entry):
+        """
+        Mark the entry as completed and persist the progress.
+
+        :param entry: WorklistEntry returned by next_entry().
+        """
+        offset = self._pending.pop(entry.index, None)
+        self.completed = max(self.completed, entry.index + 1)
+        if offset is not None:
+            self.offset = offset
+        self._save_progress()
+
+    ############################
+    # PARSING
+    ############################
+
+    def _iter_raw_rows(self, start_index, start_offset):
+        """
+        Yield tuples (index, offset_after_row, raw_row_dict) starting at the given row.
+        """
+        if self.format == "json":
+            yield from self._iter_json_rows(start_index)
+            return
+
+        with open(self.path, "rb") as file:
+            if self.format == "csv":
+                header = next(csv.reader([_read_csv_record(file).decode("utf-8-sig")]), None)
+                if not header:
+                    return
+                header = [column.strip().lower() for column in header]
+            if start_offset:
+                file.seek(start_offset)
+
+            index = start_index
+            while True:
+                line = _read_csv_record(file) if self.format == "csv" else file.readline()
+                if not line:
+                    return
+                text = line.decode("utf-8").strip()
+                if not text:
+                    continue
+                if self.format == "csv":
+                    row = dict(zip(header, next(csv.reader([text]))))
+                else:
+                    row = json.loads(text)
+                yield index, file.tell(), row
+                index += 1
+
+    def _iter_json_rows(self, start_index):
+        """
+        Incrementally decode a JSON array, reading the file in chunks. Already completed rows are decoded and skipped.
+        """
+        decoder = json.JSONDecoder()
+        with open(self.path, "r", encoding="utf-8") as file:
+            buffer = ""
+            started = False
+            index = 0
+            position = 0
+            while True:
+                # Skip whitespace and separators between objects
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if not started and position < len(buffer):
+                    if buffer[position] != "[":
+                        raise ValueError("JSON worklist must be an array of transfers.")
+                    started = True
+                    position += 1
+                    continue
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+
+                try:
+                    row, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    chunk = file.read(JSON_READ_CHUNK_SIZE)
+                    if not chunk:
+                        if buffer[position:].strip():
+                            raise ValueError(f"Malformed JSON worklist near row {index}.")
+                        return
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+
+                position = end
+                if index >= start_index:
+                    yield index, None, row
+                index += 1
+
+    def _parse_slot(self, text, default_labware, row_index):
+        """
+        Parse "<labware>:<slot>" (or "<slot>" / "<labware>") and check it exists on the deck.
+        """
+        text = (text or "").strip()
+        if ":" in text:
+            labware_name, name = text.split(":", 1)
+        elif text in self.bed_controller.deck.labware:
+            labware_name, name = text, ""
+        else:
+            labware_name, name = default_labware, text
+
+        try:
+            labware = self.bed_controller.deck.get_labware(labware_name)
+        except KeyError as e:
+            raise ValueError(f"Worklist row {row_index}: {e.args[0]}") from None
+
+        if name:
+            position = parse_slot_name(name)
+        elif len(labware.slots) == 1:
+            position = next(iter(labware.slots))  # Single slot labware (tanks) can be referred to by name only
+        else:
+            raise ValueError(f"Worklist row {row_index}: slot of labware '{labware_name}' is missing.")
+
+        if position not in labware.slots:
+            raise ValueError(f"Worklist row {row_index}: no active slot {name} in labware '{labware_name}'.")
+        return labware_name, position
+
+    def _make_entry(self, index, row):
+        """
+        Validate the raw row and convert it to WorklistEntry.
+        """
+        if "destination" not in row:
+            raise ValueError(f"Worklist row {index}: destination is missing.")
+        source = self._parse_slot(row.get("source"), self.default_source, index)
+        destination = self._parse_slot(row["destination"], self.default_destination, index)
+        try:
+            volume = float(row.get("volume") or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"Worklist row {index}: invalid volume {row.get('volume')!r}.") from None
+        if volume < 0:
+            raise ValueError(f"Worklist row {index}: volume must not be negative.")
+        liquid_class = (row.get("liquid_class") or "").strip() or None
+        if liquid_class is not None and self.liquid_classes is not None and liquid_class not in self.liquid_classes:
+            raise ValueError(f"Worklist row {index}: unknown liquid class {liquid_class!r}.")
+        return WorklistEntry(index, source, destination, volume, liquid_class)
+
+    ############################
+    # ACCESS
+    ############################
+
+    def next_entry(self):
+        """
+        Get the next entry of the worklist.
+
+        :return: WorklistEntry, or None if the worklist is finished.
+        """
+        if self._rows is None:
+            self._rows = self._iter_raw_rows(self.completed, self.offset)
+        for index, offset, row in self._rows:
+            self._pending[index] = offset
+            return self._make_entry(index, row)
+        return None
+
+    def __iter__(self):
+        while True:
+            entry = self.next_entry()
+            if entry is None:
+                return
+            yield entry
+
+    def validate(self):
+        """
+        Stream the whole worklist once and validate every row against the deck.
+
+        :return: List of error messages (empty if the worklist is valid).
+        """
+        errors = []
+        try:
+            for index, _, row in self._iter_raw_rows(0, 0):
+                try:
+                    self._make_entry(index, row)
+                except ValueError as e:
+                    errors.append(str(e))
+        except (ValueError, UnicodeDecodeError) as e:
+            errors.append(str(e))
+        return errors
@@ -0,0 +1,148 @@
+# This file implements the logging of the application. The controllers and the state machine log through standard
+# library loggers below "pipettify" instead of printing:
+#   - messages below the configured level are dropped by a level check, before any formatting (pass the values as
+#     arguments, logger.debug("Moving to %s mm", position), not as f-strings)
+#   - enabled records are put on the queue unformatted (RawQueueHandler), formatting and writing happen in a listener
+#     thread, so a slow terminal or disk never delays the Tk thread or a plunger move. The arguments are formatted
+#     later, so log values that are not modified afterwards (numbers, strings, tuples)
+#   - the listener keeps the last messages in a bounded ring buffer the GUI tails, and optionally writes them to the
+#     console and a log file
+#
+# Without configure_logging only warnings and errors are shown (Python's last-resort handler on stderr).
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from collections import deque
+
+ROOT_LOGGER = "pipettify"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+CONSOLE_FORMAT = "%(message)s"
+
+_listener = None  # QueueListener of the configured logging
+_queue_handler = None
+_ring_buffer = None
+
+
+def get_logger(name):
+    """
+    Get the logger of a module, e.g. get_logger("controller_tool") -> "pipettify.controller_tool".
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class RawQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as it is. The standard prepare() formats the message (msg % args) and the
+    traceback on the calling thread, here the listener thread does it.
+    """
+    def prepare(self, record):
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the last `capacity` formatted messages in memory. Every message gets a sequence number, so a reader can ask
+    only for the messages it has not seen yet.
+    """
+    def __init__(self, capacity=2000, level=logging.NOTSET):
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)  # [(sequence number, level number, message)]
+        self.sequence = 0
+        self._lock = threading.Lock()
+        self.setFormatter(logging.Formatter(LOG_FORMAT, "%H:%M:%S"))
+
+    def emit(self, record):
+        try:
+            message = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._lock:
+            self.sequence += 1
+            self.records.append((self.sequence, record.levelno, message))
+
+    def tail(self, count=None, since=0):
+        """
+        Get the last messages.
+
+        :param count: At most this many messages (the newest ones), None = all kept.
+        :param since: Only messages with a sequence number above this one.
+        :return: List of (sequence number, level number, message), oldest first.
+        """
+        with self._lock:
+            records = [record for record in self.records if record[0] > since]
+        return records if count is None else records[-count:]
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+
+def configure_logging(level="INFO", file_path=None, console=True, capacity=2000):
+    """
+    Configure the "pipettify" loggers. Can be called again to change the configuration.
+
+    :param level: Lowest level that is logged (name or number). Messages below it cost a level check only.
+    :param file_path: Also append the messages to this file, None = no log file.
+    :param console: Also print the messages to stdout.
+    :param capacity: Number of messages kept in the ring buffer.
+    :return: RingBufferHandler with the recent messages.
+    """
+    global _listener, _queue_handler, _ring_buffer
+    shutdown_logging()
+
+    if isinstance(level, str):
+        number = logging.getLevelName(level.upper())
+        if not isinstance(number, int):
+            raise ValueError(f"Unknown log level: {level}")
+        level = number
+
+    _ring_buffer = RingBufferHandler(capacity)
+    handlers = [_ring_buffer]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+    if file_path:
+        file_handler = logging.FileHandler(file_path, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = RawQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+    return _ring_buffer
+
+
+def shutdown_logging():
+    """
+    Write the queued messages and stop the listener thread. Logging falls back to warnings and errors on stderr.
+    """
+    global _listener, _queue_handler
+    logger = logging.getLogger(ROOT_LOGGER)
+    if _queue_handler is not None:
+        logger.removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()  # Processes everything queued so far
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    logger.setLevel(logging.NOTSET)
+    logger.propagate = True
+
+
+def ring_buffer():
+    """
+    Get the ring buffer of the configured logging, None if logging is not configured.
+    """
+    return _ring_buffer
@@ -0,0 +1,358 @@
+# This file implements the metrics of a run, so several machines on a long shift can be monitored without watching
+# each GUI. The metrics are exposed in the Prometheus text format, either over a small HTTP server (GET /metrics on
+# localhost, scraped by Prometheus or read with curl) or as a file rewritten periodically (node_exporter textfile
+# collector, or simply `cat`):
+#   pipettify_wells_completed            - filled wells (BedController)
+#   pipettify_tips_used                  - taken tips (BedController)
+#   pipettify_refills_total              - aspirations from the refilling tank (EndEffectorController)
+#   pipettify_well_cycle_seconds         - time between two completed wells, with percentiles
+#   pipettify_serial_latency_seconds     - M114 round trips and M400 waits per command, with percentiles
+#   pipettify_serial_commands_total      - commands sent per G-code
+#   pipettify_timeouts_total             - timeouts per operation (M114, M400, plunger, ready)
+#   pipettify_planner_queue_depth        - moves commanded but (by the dead reckoning) not finished yet
+#
+# Disabled metrics (the default everywhere) record nothing and cost one attribute check per call.
+
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+############################
+# METRIC TYPES
+############################
+
+class _Metric:
+    """
+    Metric with optional labels. Every combination of label values is a separate series.
+    """
+    kind = "untyped"
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}  # {label values: value}
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"Metric {self.name} expects labels {self.labels}, got {label_values}.")
+        return tuple(str(value) for value in label_values)
+
+    def samples(self):
+        """
+        Get the samples as (suffix, label values, extra labels, value).
+        """
+        return [("", key, (), value) for key, value in sorted(self.series.items())]
+
+
+class Counter(_Metric):
+    """
+    Value that only increases (commands sent, timeouts, ...).
+    """
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self.registry.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, *label_values):
+        return self.series.get(self._key(label_values), 0)
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. Either set explicitly, or read from a function at every scrape.
+    """
+    kind = "gauge"
+
+    def __init__(self, registry, name, documentation, labels=(), function=None):
+        """
+        :param function: Function returning the current value, called at every scrape. Errors skip the sample.
+        """
+        super().__init__(registry, name, documentation, labels)
+        self.function = function
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        with self.registry.lock:
+            self.series[key] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            return [("", (), (), self.function())]
+        except Exception:
+            return []  # The source is being rebuilt (e.g. a new grid), skip this scrape
+
+
+class Summary(_Metric):
+    """
+    Distribution of observations (durations). Exposes the quantiles of the last `window` observations and the sum and
+    count of all of them.
+    """
+    kind = "summary"
+
+    def __init__(self, registry, name, documentation, labels=(), quantiles=(0.5, 0.9, 0.99), window=1000):
+        super().__init__(registry, name, documentation, labels)
+        self.quantiles = tuple(quantiles)
+        self.window = window
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        with self.registry.lock:
+            if key not in self.series:
+                self.series[key] = [deque(maxlen=self.window), 0.0, 0]  # [recent values, sum, count]
+            series = self.series[key]
+            series[0].append(value)
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, *label_values):
+        """
+        Get the q-quantile (0..1) of the recent observations, None if there are none.
+        """
+        series = self.series.get(self._key(label_values))
+        if not series or not series[0]:
+            return None
+        values = sorted(series[0])
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    def samples(self):
+        samples = []
+        for key, (recent, total, count) in sorted(self.series.items()):
+            values = sorted(recent)
+            for q in self.quantiles:
+                value = values[min(int(q * len(values)), len(values) - 1)] if values else float("nan")
+                samples.append(("", key, (("quantile", _format_value(q)),), value))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+    """
+    def __init__(self):
+        self.metrics = {}  # {name: metric}, in registration order
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self._register(Gauge(self, name, documentation, labels, function))
+
+    def summary(self, name, documentation, labels=(), quantiles=(0.5, 0.9, 0.99), window=1000):
+        return self._register(Summary(self, name, documentation, labels, quantiles, window))
+
+    def render(self):
+        """
+        Get all metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            with self.lock:
+                samples = metric.samples()
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, label_values, extra, value in samples:
+                labels = _format_labels(metric.labels, label_values, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+############################
+# RUN METRICS
+############################
+
+class RunMetrics:
+    """
+    Metrics of a pipetting run. The printer and the tool controller report into it (see PrinterController.use_metrics),
+    the bed state is read at every scrape.
+    """
+    def __init__(self, enabled=True, clock=time.monotonic, window=1000):
+        """
+        :param enabled: Record metrics. Disabled metrics ignore all calls.
+        :param clock: Function returning the current time (s), e.g. a virtual clock of a simulation.
+        :param window: Number of recent observations the percentiles are computed from.
+        """
+        self.enabled = enabled
+        self.clock = clock
+        self.registry = MetricsRegistry()
+        self.bed_controller = None
+        self._last_well_time = None  # Reference of the next well cycle time
+
+        prefix = "pipettify_"
+        self.refills = self.registry.counter(prefix + "refills_total", "Aspirations from the refilling tank.")
+        self.well_cycle = self.registry.summary(prefix + "well_cycle_seconds", "Time between two completed wells.",
+                                                window=window)
+        self.serial_latency = self.registry.summary(prefix + "serial_latency_seconds",
+                                                    "Serial round trips (M114) and move waits (M400).",
+                                                    labels=("command",), window=window)
+        self.serial_commands = self.registry.counter(prefix + "serial_commands_total", "G-code commands sent.",
+                                                     labels=("command",))
+        self.timeouts = self.registry.counter(prefix + "timeouts_total", "Operations that timed out.",
+                                              labels=("operation",))
+
+    def watch(self, printer_controller):
+        """
+        Read the bed state and the planner queue of the printer at every scrape and time the completed wells.
+
+        :param printer_controller: PrinterController of the run.
+        """
+        if not self.enabled:
+            return
+        bed_controller = printer_controller.bed_controller
+        tool_controller = printer_controller.tool_controller
+        prefix = "pipettify_"
+        self.registry.gauge(prefix + "wells_completed", "Filled wells.",
+                            function=lambda: sum(1 for probe in list(bed_controller.probes.values())
+                                                 if probe["filled"]))
+        self.registry.gauge(prefix + "wells_total", "Active wells of the run.",
+                            function=lambda: len(bed_controller.probes))
+        self.registry.gauge(prefix + "tips_used", "Taken tips.",
+                            function=lambda: sum(1 for tip in list(bed_controller.tips.values()) if tip["taken"]))
+        self.registry.gauge(prefix + "planner_queue_depth", "Moves commanded but not finished yet (estimated).",
+                            function=lambda: self._queue_depth(printer_controller.motion, tool_controller.motion))
+        self.bed_controller = bed_controller
+        self._last_well_time = self.clock()
+        bed_controller.add_listener(self._on_bed_change)
+
+    def _queue_depth(self, *estimators):
+        now = self.clock()
+        return sum(1 for motion in estimators for segment in list(motion.segments) if segment.end_time > now)
+
+    def _on_bed_change(self, version, key):
+        name, position = key
+        if name != "probes" or position is None:
+            if name == "grid":
+                self._last_well_time = self.clock()  # New grid, new run
+            return
+        probe = self.bed_controller.probes.get(position)
+        if probe is None or not probe["filled"]:
+            self._last_well_time = self.clock()  # Probes cleared, the next run starts
+            return
+        now = self.clock()
+        if self._last_well_time is not None:
+            self.well_cycle.observe(now - self._last_well_time)
+        self._last_well_time = now
+
+    ############################
+    # RECORDING
+    ############################
+
+    def command_sent(self, code):
+        if self.enabled:
+            self.serial_commands.inc(code)
+
+    def observe_serial(self, code, seconds):
+        if self.enabled:
+            self.serial_latency.observe(seconds, code)
+
+    def count_timeout(self, operation):
+        if self.enabled:
+            self.timeouts.inc(operation)
+
+    def count_refill(self):
+        if self.enabled:
+            self.refills.inc()
+
+    ############################
+    # EXPOSITION
+    ############################
+
+    def render(self):
+        return self.registry.render()
+
+    def write_textfile(self, path):
+        """
+        Write the metrics to a file. The file is replaced atomically, so readers never see a partial file.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+
+NULL_METRICS = RunMetrics(enabled=False)  # Shared default of components that are not monitored
+
+
+class MetricsServer:
+    """
+    HTTP server exposing the metrics at /metrics, running in a daemon thread.
+    """
+    def __init__(self, metrics, port=9464, host="127.0.0.1"):
+        """
+        :param metrics: RunMetrics (or MetricsRegistry) to expose.
+        :param port: TCP port, 0 = any free port (see `port` after start).
+        :param host: Interface to listen on, localhost by default.
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the console
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,173 @@
+# This file implements tracing of a run. Timed spans are recorded for every state and sub-step of the state machine,
+# every serial command and every plunger move, with the well and the tip attached. The spans are exported as Chrome
+# trace JSON ("Trace Event Format"), which can be opened in chrome://tracing or https://ui.perfetto.dev to see where
+# the cycle time of each well goes.
+#
+# A disabled tracer (the default everywhere) records nothing and costs one attribute check per span.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    """
+    Span of a disabled tracer, does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    Span recorded when the `with` block ends.
+    """
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._complete(self.name, self.category, self.start, self.tracer.clock(), self.args)
+        return False
+
+    def set(self, **args):
+        """
+        Attach more arguments to the span, e.g. results known only at its end.
+        """
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Recorder of timed spans, exportable as Chrome trace JSON.
+    """
+    def __init__(self, enabled=True, clock=time.perf_counter, max_events=200000):
+        """
+        :param enabled: Record spans. A disabled tracer ignores all calls.
+        :param clock: Function returning the current time (s), e.g. a virtual clock of a simulation.
+        :param max_events: Keep at most this many events, the oldest ones are dropped.
+        """
+        self.enabled = enabled
+        self.clock = clock
+        self.events = deque(maxlen=max_events)
+        self._open = {}  # {key: (name, category, start, args, thread id)} of spans begun but not ended
+        self._thread_ids = {}  # {thread ident: small id} for readable trace tracks
+        self._lock = threading.Lock()
+
+    def _thread_id(self):
+        ident = threading.get_ident()
+        if ident not in self._thread_ids:
+            self._thread_ids[ident] = len(self._thread_ids) + 1
+        return self._thread_ids[ident]
+
+    def _complete(self, name, category, start, end, args, thread_id=None):
+        with self._lock:
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": max(end - start, 0.0) * 1e6,
+                "pid": os.getpid(),
+                "tid": thread_id or self._thread_id(),
+                "args": args,
+            })
+
+    ############################
+    # RECORDING
+    ############################
+
+    def span(self, name, category="", **args):
+        """
+        Span of a `with` block:
+            with tracer.span("G1", "serial", command=command):
+                ...
+
+        :param name: Name of the span.
+        :param category: Category, e.g. "state", "step", "serial" or "plunger".
+        :param args: Arguments shown with the span (well, tip, ...).
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def begin(self, key, name, category="", **args):
+        """
+        Begin a span that is ended by another call (e.g. a state lasting many polls). A span still open under the same
+        key is ended first.
+        """
+        if not self.enabled:
+            return
+        self.end(key)
+        self._open[key] = (name, category, self.clock(), args, self._thread_id())
+
+    def end(self, key, **args):
+        """
+        End the span begun under the key. Does nothing if there is no such span.
+        """
+        if not self.enabled or key not in self._open:
+            return
+        name, category, start, begin_args, thread_id = self._open.pop(key)
+        begin_args.update(args)
+        self._complete(name, category, start, self.clock(), begin_args, thread_id)
+
+    def instant(self, name, category="", **args):
+        """
+        Record a point in time (e.g. an emergency stop).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.events.append({"name": name, "cat": category, "ph": "i", "s": "t", "ts": self.clock() * 1e6,
+                                "pid": os.getpid(), "tid": self._thread_id(), "args": args})
+
+    def clear(self):
+        self.events.clear()
+        self._open.clear()
+
+    ############################
+    # EXPORT
+    ############################
+
+    def to_chrome_trace(self):
+        """
+        Get the trace in the Chrome Trace Event Format. Spans still open are included up to now.
+        """
+        now = self.clock()
+        events = list(self.events)
+        for name, category, start, args, thread_id in self._open.values():
+            events.append({"name": name, "cat": category, "ph": "X", "ts": start * 1e6,
+                           "dur": max(now - start, 0.0) * 1e6, "pid": os.getpid(), "tid": thread_id,
+                           "args": dict(args, open=True)})
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """
+        Write the trace to a JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_chrome_trace(), file)
+
+
+NULL_TRACER = Tracer(enabled=False)  # Shared default of components that are not traced